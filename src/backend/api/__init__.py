@@ -5,6 +5,7 @@ from .web import routes as web_routes
 from .api_key import routes as api_key_routes
 from .conversation import routes as conversation_routes
 from .system import routes as system_routes
+from .collections import routes as collection_routes
 
 __all__ = [
     "rag_routes", 
@@ -13,5 +14,6 @@ __all__ = [
     "web_routes", 
     "api_key_routes", 
     "conversation_routes",
-    "system_routes"
+    "system_routes",
+    "collection_routes"
 ]
\ No newline at end of file
@@ -0,0 +1,112 @@
+from datetime import datetime
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from services.file.storage import FileStorage
+from services.vector_db import VectorDBService
+from services.rag.registry import get_collection_service, rag_registry
+from services.rag.filters import SearchFilter
+from utils.collection_utils import collection_upload_dir, validate_collection_id
+from utils.sse import sse_response
+from urllib.parse import unquote
+from typing import Dict, Any, List, Optional
+
+router = APIRouter()
+vector_db = VectorDBService()
+
+
+async def _collection_service(collection_id: str):
+    """Lấy RAGService của collection, trả 400 nếu collection id không hợp lệ."""
+    try:
+        return await get_collection_service(collection_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _collection_storage(collection_id: str) -> FileStorage:
+    """FileStorage trỏ tới thư mục upload của collection."""
+    try:
+        return FileStorage(collection_upload_dir(validate_collection_id(collection_id)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/", response_model=Dict[str, Any])
+async def list_collections():
+    """Liệt kê các collection cùng số file, số chunk và các collection đang load index."""
+    collections = [
+        {"collection_id": collection_id, "files": num_files, "chunks": num_chunks}
+        for collection_id, num_files, num_chunks in vector_db.list_collections()
+    ]
+    return {"collections": collections, "active": rag_registry.active_collections()}
+
+@router.post("/{collection_id}/upload", response_model=Dict[str, Any])
+async def upload_file(collection_id: str, file: UploadFile = File(...)):
+    """Tải file lên một collection và cập nhật index của collection đó."""
+    file_storage = _collection_storage(collection_id)
+    rag_service = await _collection_service(collection_id)
+    try:
+        file_path = file_storage.save_file(file)
+        await rag_service.check_and_update_files()
+        return {"message": "Tải file lên thành công và đã được xử lý", "file_path": file_path}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi tải file lên: {str(e)}")
+
+@router.get("/{collection_id}/files", response_model=Dict[str, List[Dict[str, Any]]])
+async def get_files(collection_id: str):
+    """Lấy danh sách các file đã tải lên collection."""
+    return {"files": _collection_storage(collection_id).list_files()}
+
+@router.delete("/{collection_id}/files/{file_name}", response_model=Dict[str, str])
+async def delete_file(collection_id: str, file_name: str):
+    """Xóa một file khỏi collection cùng các vector tương ứng."""
+    decoded_filename = unquote(file_name)
+    file_storage = _collection_storage(collection_id)
+    rag_service = await _collection_service(collection_id)
+
+    if file_storage.delete_file(decoded_filename):
+        vector_db.delete_file_from_db(decoded_filename, collection_id)
+        await rag_service.update_index_for_files([decoded_filename])
+        return {"message": "Đã xóa file thành công"}
+    raise HTTPException(status_code=404, detail="Không tìm thấy file")
+
+@router.post("/{collection_id}/sync", response_model=Dict[str, str])
+async def sync_files(collection_id: str):
+    """Đồng bộ thư mục upload của collection vào VectorDB và index của collection."""
+    rag_service = await _collection_service(collection_id)
+    updated = await rag_service.check_and_update_files()
+    return {
+        "message": "Đã đồng bộ dữ liệu thành công" if updated
+        else "Không có thay đổi nào được phát hiện"
+    }
+
+@router.get("/{collection_id}/query", response_model=Dict[str, str])
+async def query(
+    collection_id: str,
+    question: str,
+    stream: bool = False,
+    file_names: Optional[List[str]] = Query(None),
+    file_ids: Optional[List[int]] = Query(None),
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None
+):
+    """Truy vấn RAG chỉ trong tài liệu của collection (cùng tham số với /rag/query)."""
+    rag_service = await _collection_service(collection_id)
+    search_filter = SearchFilter(file_names, file_ids, uploaded_after, uploaded_before)
+    if stream:
+        return sse_response(rag_service.query_stream(question, search_filter=search_filter))
+    response = await rag_service.query(question, search_filter=search_filter)
+    return {"response": response}
+
+@router.get("/{collection_id}/index-stats", response_model=Dict[str, Any])
+async def get_index_statistics(collection_id: str):
+    """Lấy thống kê index của collection."""
+    rag_service = await _collection_service(collection_id)
+    try:
+        return {
+            "status": "success",
+            "statistics": rag_service.get_index_statistics()
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Lỗi khi lấy thống kê: {str(e)}"
+        }
@@ -2,7 +2,7 @@ from fastapi import APIRouter, UploadFile, File, HTTPException
 from services.file.storage import FileStorage
 from services.file.async_reader import AsyncFileReader
 from services.vector_db import VectorDBService
-from services.rag.rag import RAGService
+from services.rag.registry import get_rag_service
 from config.pdf_config import PDFConfig
 from urllib.parse import unquote
 from typing import Dict, Any, List
@@ -11,13 +11,13 @@ router = APIRouter()
 vector_db = VectorDBService()
 file_storage = FileStorage()
 async_file_reader = AsyncFileReader()
-rag_service = RAGService()
 
 @router.post("/upload", response_model=Dict[str, Any])
 async def upload_file(file: UploadFile = File(...)):
     """Tải lên một file mới."""
     try:
         file_path = file_storage.save_file(file)
+        rag_service = await get_rag_service()
         await rag_service.check_and_update_files()
         return {"message": "Tải file lên thành công và đã được xử lý", "file_path": file_path}
     except Exception as e:
@@ -35,8 +35,10 @@ async def delete_uploaded_file(file_name: str):
     
     # Xóa file khỏi hệ thống
     if file_storage.delete_file(decoded_filename):
-        # Xóa dữ liệu khỏi database
+        # Xóa dữ liệu khỏi database và các vector tương ứng khỏi index
         vector_db.delete_file_from_db(decoded_filename)
+        rag_service = await get_rag_service()
+        await rag_service.update_index_for_files([decoded_filename])
         return {"message": "Đã xóa file thành công"}
     raise HTTPException(status_code=404, detail="Không tìm thấy file")
 
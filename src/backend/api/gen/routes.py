@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from services.llm.generator import GeneratorService
 from typing import Dict, Optional, Any
+from utils.sse import sse_response
 from .schemas import WebResults, WebSearchResponse
 
 router = APIRouter()
@@ -12,9 +13,21 @@ async def generate_content(
     conversation_id: Optional[str] = None, 
     rag_response: Optional[str] = None, 
     web_response: Optional[str] = None, 
-    file_response: Optional[str] = None
-) -> Dict[str, str]:
-    """Tạo nội dung dựa trên prompt và các ngữ cảnh bổ sung."""
+    file_response: Optional[str] = None,
+    stream: bool = False
+):
+    """Tạo nội dung dựa trên prompt và các ngữ cảnh bổ sung.
+
+    stream=true trả nội dung dạng Server-Sent Events, tin nhắn được lưu khi stream kết thúc.
+    """
+    if stream:
+        return sse_response(gen_service.generate_content_stream(
+            prompt,
+            conversation_id,
+            rag_response,
+            web_response,
+            file_response
+        ))
     try:
         content = await gen_service.generate_content(
             prompt, 
@@ -27,6 +40,21 @@ async def generate_content(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating content: {str(e)}")
 
+@router.get("/context_budget", response_model=Dict[str, Any])
+async def context_budget(
+    prompt: str,
+    conversation_id: Optional[str] = None,
+    rag_response: Optional[str] = None,
+    web_response: Optional[str] = None,
+    file_response: Optional[str] = None
+):
+    """Xem ngữ cảnh sẽ được giữ/bỏ theo ngân sách token mà không gọi model."""
+    conversation_history = None
+    if conversation_id:
+        conversation_history = gen_service.conversation_service.format_conversation_for_context(conversation_id)
+    packed = gen_service.llm.pack_context(prompt, rag_response, web_response, file_response, conversation_history)
+    return {"report": packed.report}
+
 @router.post("/merge_context", response_model=Dict[str, str])
 async def merge_context(web_results: WebResults) -> Dict[str, str]:
     """Hợp nhất và xử lý ngữ cảnh từ nhiều kết quả tìm kiếm web."""
@@ -1,19 +1,69 @@
-from fastapi import APIRouter
-from services.rag.rag import RAGService
-from typing import Dict, Any
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query
+from services.rag.registry import get_rag_service, rag_registry
+from services.rag.executor import run_inference
+from config.app_config import AppConfig
+from services.rag.filters import SearchFilter
+from typing import Dict, Any, List, Optional
+from utils.sse import sse_response
+from .schemas import BatchQueryRequest, BatchQueryResponse
+
+config = AppConfig()
 
 router = APIRouter()
-rag_service = RAGService()
 
 @router.get("/query", response_model=Dict[str, str])
-async def rag_query(question: str):
-    """Truy vấn hệ thống RAG với câu hỏi đầu vào. """
-    response = await rag_service.query(question)
+async def rag_query(
+    question: str,
+    stream: bool = False,
+    file_names: Optional[List[str]] = Query(None),
+    file_ids: Optional[List[int]] = Query(None),
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None
+):
+    """Truy vấn hệ thống RAG với câu hỏi đầu vào. 
+
+    stream=true trả câu trả lời dạng Server-Sent Events (event token/done/error).
+    file_names, file_ids, uploaded_after/uploaded_before giới hạn tìm kiếm trong các file khớp.
+    """
+    rag_service = await get_rag_service()
+    search_filter = SearchFilter(file_names, file_ids, uploaded_after, uploaded_before)
+    if stream:
+        return sse_response(rag_service.query_stream(question, search_filter=search_filter))
+    response = await rag_service.query(question, search_filter=search_filter)
     return {"response": response}
 
+@router.post("/query-batch", response_model=BatchQueryResponse)
+async def rag_query_batch(request: BatchQueryRequest):
+    """Truy vấn nhiều câu hỏi trong một lần gọi: encode theo batch và một lần index.search.
+
+    Đặt generate=false để chỉ lấy top-k chunk và điểm, không gọi LLM.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="questions must not be empty")
+    if len(request.questions) > config.RAG_BATCH_QUERY_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many questions, maximum is {config.RAG_BATCH_QUERY_MAX_QUESTIONS}"
+        )
+    if request.k <= 0:
+        raise HTTPException(status_code=400, detail="k must be positive")
+    
+    rag_service = await get_rag_service()
+    try:
+        search_filter = SearchFilter(
+            request.file_names, request.file_ids, request.uploaded_after, request.uploaded_before
+        )
+        return await rag_service.query_batch(
+            request.questions, k=request.k, generate=request.generate, search_filter=search_filter
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing batch query: {str(e)}")
+
 @router.post("/sync-files", response_model=Dict[str, str])
 async def sync_files():
     """Đồng bộ dữ liệu từ thư mục upload vào VectorDB. """
+    rag_service = await get_rag_service()
     updated = await rag_service.check_and_update_files()
     return {
         "message": "Đã đồng bộ dữ liệu thành công" if updated 
@@ -23,6 +73,7 @@ async def sync_files():
 @router.post("/force-rebuild", response_model=Dict[str, Any])
 async def force_rebuild_from_files():
     """Force rebuild toàn bộ database và index từ file upload (dùng khi database bị xóa)."""
+    rag_service = await get_rag_service()
     try:
         from utils.rag_file_utils import get_uploaded_files_info
         upload_info = get_uploaded_files_info(rag_service.upload_dir)
@@ -61,17 +112,50 @@ async def force_rebuild_from_files():
         }
 
 @router.post("/rebuild-index", response_model=Dict[str, str])
-async def rebuild_index():
-    """Xây dựng lại FAISS index từ dữ liệu trong database."""
+async def rebuild_index(background: bool = False):
+    """Xây dựng lại FAISS index từ dữ liệu trong database (index cũ vẫn phục vụ truy vấn trong lúc build)."""
+    rag_service = await get_rag_service()
     try:
+        if background:
+            rag_service.schedule_rebuild()
+            return {"message": "Đã bắt đầu xây dựng lại FAISS index ở chế độ nền"}
         await rag_service._rebuild_index_from_database()
         return {"message": "Đã xây dựng lại FAISS index thành công"}
     except Exception as e:
         return {"message": f"Lỗi khi xây dựng lại index: {str(e)}"}
 
+@router.post("/rebuild-shard/{shard_id}", response_model=Dict[str, Any])
+async def rebuild_shard(shard_id: int):
+    """Xây dựng lại một shard của index từ database, các shard khác không bị ảnh hưởng."""
+    rag_service = await get_rag_service()
+    try:
+        return await rag_service.rebuild_shard(shard_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/rollback-index", response_model=Dict[str, str])
+async def rollback_index():
+    """Quay lại snapshot index trước lần rebuild/cập nhật gần nhất."""
+    rag_service = await get_rag_service()
+    try:
+        if await rag_service.rollback_index():
+            return {"message": "Đã quay lại snapshot index trước đó"}
+        return {"message": "Không có snapshot trước đó để quay lại"}
+    except Exception as e:
+        return {"message": f"Lỗi khi quay lại index: {str(e)}"}
+
+@router.get("/memory", response_model=Dict[str, Any])
+async def get_memory_footprint():
+    """Lấy ước lượng bộ nhớ của model embedding, FAISS index và chunk mapping dùng chung."""
+    return {
+        "status": "success",
+        "memory": rag_registry.get_memory_footprint()
+    }
+
 @router.get("/index-stats", response_model=Dict[str, Any])
 async def get_index_statistics():
     """Lấy thống kê về FAISS index và hiệu suất."""
+    rag_service = await get_rag_service()
     try:
         stats = rag_service.get_index_statistics()
         return {
@@ -84,23 +168,41 @@ async def get_index_statistics():
             "message": f"Lỗi khi lấy thống kê: {str(e)}"
         }
 
-@router.post("/optimize-index", response_model=Dict[str, str])
-async def optimize_index():
-    """Tối ưu hóa FAISS index hiện tại."""
+@router.post("/optimize-index", response_model=Dict[str, Any])
+async def optimize_index(target_recall: Optional[float] = None, k: Optional[int] = None, sample_size: Optional[int] = None):
+    """Tinh chỉnh tham số search (efSearch/nprobe) theo recall@k và độ trễ, lưu vào metadata của index."""
+    rag_service = await get_rag_service()
     try:
         if rag_service.index is None:
             return {"message": "Không có index để tối ưu hóa"}
         
-        from utils.faiss_utils import optimize_search_params
-        optimize_search_params(rag_service.index)
+        result = await rag_service.tune_search_params(k=k, target_recall=target_recall, sample_size=sample_size)
+        if not result.get("tuned"):
+            return {"message": f"Không cần tối ưu hóa index: {result.get('reason')}", "result": result}
         
-        return {"message": "Đã tối ưu hóa FAISS index thành công"}
+        return {"message": "Đã tối ưu hóa FAISS index thành công", "result": result}
     except Exception as e:
         return {"message": f"Lỗi khi tối ưu hóa index: {str(e)}"}
 
+@router.get("/compression-report", response_model=Dict[str, Any])
+async def compression_report(k: Optional[int] = None, sample_size: Optional[int] = None, max_vectors: int = 20000):
+    """So sánh recall@k và bộ nhớ của các chế độ nén vector (none/fp16/sq8/pq) trên corpus hiện tại."""
+    rag_service = await get_rag_service()
+    try:
+        return {
+            "status": "success",
+            "report": await rag_service.compression_report(k=k, sample_size=sample_size, max_vectors=max_vectors)
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Lỗi khi đo chế độ nén: {str(e)}"
+        }
+
 @router.get("/query-advanced", response_model=Dict[str, Any])
 async def rag_query_advanced(question: str, k: int = 5, include_scores: bool = False):
     """Truy vấn RAG nâng cao với tùy chọn số lượng kết quả và điểm số."""
+    rag_service = await get_rag_service()
     try:
         response = await rag_service.query(question, k=k)
         result = {
@@ -114,11 +216,10 @@ async def rag_query_advanced(question: str, k: int = 5, include_scores: bool = F
         if include_scores and rag_service.index:
             # Thêm thông tin về search quality
             import numpy as np
-            query_embedding = rag_service.model.encode([question])
-            query_embedding = np.array(query_embedding, dtype='float32')
+            query_embedding = await run_inference(rag_service.embedder.encode_queries, [question])
             
             search_k = min(k, rag_service.index.ntotal)
-            D, I = rag_service.index.search(query_embedding, k=search_k)
+            D, I = await run_inference(rag_service.search, query_embedding, search_k)
             
             result["search_info"] = {
                 "distances": D[0].tolist(),
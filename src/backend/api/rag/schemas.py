@@ -1 +1,29 @@
-# Để trống, sẽ bổ sung schema nếu cần trong tương lai. 
\ No newline at end of file
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Dict, Optional
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    k: int = 5
+    generate: bool = False
+    file_names: Optional[List[str]] = None
+    file_ids: Optional[List[int]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+class RetrievedChunk(BaseModel):
+    chunk_id: int
+    content: str
+    source: str
+    chunk_index: int
+    score: float
+
+class BatchQueryResult(BaseModel):
+    question: str
+    chunks: List[RetrievedChunk]
+    response: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+    num_questions: int
+    timings_ms: Dict[str, float]
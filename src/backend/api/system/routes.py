@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from services.app_manager import app_manager
 from config.app_config import AppConfig
+from utils.tracing import InMemorySpanExporter, tracer
 
 router = APIRouter()
 
@@ -21,6 +22,19 @@ async def get_system_status():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy trạng thái: {str(e)}")
 
+@router.get("/traces", response_model=Dict[str, Any])
+async def get_recent_traces(limit: int = 20, trace_id: Optional[str] = None):
+    """Các trace gần nhất (cần TRACING_EXPORTER=memory), mỗi trace gồm toàn bộ span của request."""
+    if not isinstance(tracer.exporter, InMemorySpanExporter):
+        return {
+            "status": "disabled",
+            "message": f"Tracing exporter hiện tại là '{tracer.exporter_name}', đặt TRACING_EXPORTER=memory để xem trace"
+        }
+    if trace_id:
+        spans = tracer.exporter.get_finished_spans(trace_id)
+        return {"status": "success", "spans": [span.to_dict() for span in spans]}
+    return {"status": "success", "traces": tracer.exporter.recent_traces(limit)}
+
 @router.get("/services", response_model=Dict[str, Any])
 async def get_services_info():
     """Lấy thông tin về tất cả services."""
@@ -4,6 +4,8 @@ import urllib.parse
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 
+from utils.tracing import span
+
 load_dotenv()
 
 class GoogleSearchClient:
@@ -28,7 +30,9 @@ class GoogleSearchClient:
                 url += f"&siteSearch={urllib.parse.quote(site_restrict)}"
             url += "&safe=active"
             
-            response = requests.get(url, timeout=10)
+            with span("web.google_search", num_results=num_results) as search_span:
+                response = requests.get(url, timeout=10)
+                search_span.set_attribute("http.status_code", response.status_code)
             
             if response.status_code == 200:
                 data = response.json()
@@ -28,15 +28,101 @@ class AppConfig:
     # ==================== RAG CONFIG ====================
     FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index.bin")
     CHUNK_MAPPING_PATH = os.getenv("CHUNK_MAPPING_PATH", "chunk_mapping.npz")
+    CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", "chunk_store")
+    INDEX_METADATA_PATH = os.getenv("INDEX_METADATA_PATH", "faiss_index_meta.json")
+    # Đọc index qua mmap để nhiều worker dùng chung một bản trong page cache
+    FAISS_MMAP_ENABLED = os.getenv("FAISS_MMAP_ENABLED", "true").lower() == "true"
+    # Mỗi lần publish index ghi một generation mới, manifest trỏ tới generation hiện tại
+    INDEX_GENERATIONS_DIR = os.getenv("INDEX_GENERATIONS_DIR", "faiss_index_generations")
+    INDEX_MANIFEST_PATH = os.getenv("INDEX_MANIFEST_PATH", "faiss_index_manifest.json")
+    INDEX_KEEP_GENERATIONS = int(os.getenv("INDEX_KEEP_GENERATIONS", "3"))
+    # Checksum được tính một lần khi publish; băm lại file index khi load (O(kích thước index)) là tùy chọn
+    INDEX_VERIFY_CHECKSUM = os.getenv("INDEX_VERIFY_CHECKSUM", "false").lower() == "true"
+    # Số lần dựng lại và publish khi worker khác đã publish generation mới hơn trong lúc build
+    INDEX_PUBLISH_ATTEMPTS = int(os.getenv("INDEX_PUBLISH_ATTEMPTS", "3"))
+    # Chu kỳ (giây) worker kiểm tra manifest để hot reload index, 0 để tắt
+    INDEX_RELOAD_POLL_SECONDS = float(os.getenv("INDEX_RELOAD_POLL_SECONDS", "2.0"))
+    # Chia corpus thành nhiều shard index: "file" (theo file id) hoặc "hash" (theo chunk id)
+    RAG_NUM_SHARDS = int(os.getenv("RAG_NUM_SHARDS", "1"))
+    RAG_SHARD_BY = os.getenv("RAG_SHARD_BY", "file")
+    RAG_SHARD_SEARCH_THREADS = int(os.getenv("RAG_SHARD_SEARCH_THREADS", "0"))
+    # Collection: mỗi collection có thư mục upload và index riêng, index được load khi cần
+    COLLECTIONS_DIR = os.getenv("COLLECTIONS_DIR", "collections")
+    RAG_MAX_ACTIVE_COLLECTIONS = int(os.getenv("RAG_MAX_ACTIVE_COLLECTIONS", "8"))
+    RAG_COLLECTION_IDLE_SECONDS = float(os.getenv("RAG_COLLECTION_IDLE_SECONDS", "600"))
+    # Build index: ma trận embedding tạm (memmap) đặt ở RAG_BUILD_TMP_DIR (mặc định thư mục tạm của hệ thống),
+    # số thread OpenMP cho k-means khi train quantizer (0 = mặc định của FAISS)
+    RAG_BUILD_TMP_DIR = os.getenv("RAG_BUILD_TMP_DIR", "")
+    RAG_BUILD_TRAIN_THREADS = int(os.getenv("RAG_BUILD_TRAIN_THREADS", "0"))
+    # Số chunk đọc từ SQLite mỗi trang khi rebuild (chỉ một trang nằm trong bộ nhớ)
+    RAG_REBUILD_PAGE_SIZE = int(os.getenv("RAG_REBUILD_PAGE_SIZE", "2000"))
+    # Nén vector trong index: "none", "fp16", "sq8" hoặc "pq"; khi bật, vector float32 gốc được
+    # lưu ở file phụ (memory-map) để re-rank RAG_RERANK_FACTOR * k ứng viên bằng khoảng cách chính xác
+    RAG_VECTOR_COMPRESSION = os.getenv("RAG_VECTOR_COMPRESSION", "none").lower()
+    RAG_RERANK_FACTOR = int(os.getenv("RAG_RERANK_FACTOR", "4"))
+    
+    # Embedding model và cache embedding trên đĩa
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+    # Số embedding tối đa giữ trên đĩa (0 = không giới hạn), dòng lâu không dùng bị xóa trước
+    EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "500000"))
+    # Số câu truy vấn giữ embedding trong bộ nhớ (0 = tắt)
+    EMBEDDING_QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "1024"))
+    # Backend encode: "torch" (SentenceTransformer fp32) hoặc "onnx_int8" (ONNX Runtime, int8 động)
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "onnx_models")
+    EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "1"))
+    # Kiểm tra cosine giữa backend đã chọn và PyTorch khi khởi động
+    EMBEDDING_VERIFY_BACKEND = os.getenv("EMBEDDING_VERIFY_BACKEND", "true").lower() == "true"
+    EMBEDDING_AGREEMENT_THRESHOLD = float(os.getenv("EMBEDDING_AGREEMENT_THRESHOLD", "0.99"))
     
     # RAG parameters
     RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
     RAG_BATCH_SIZE = int(os.getenv("RAG_BATCH_SIZE", "50"))
+    # Tỷ lệ vector đã xóa mềm trong HNSW vượt ngưỡng này thì dựng lại graph
+    RAG_INDEX_COMPACT_FRACTION = float(os.getenv("RAG_INDEX_COMPACT_FRACTION", "0.2"))
+    
+    # Gom batch các query embedding đồng thời
+    RAG_QUERY_BATCH_MAX_SIZE = int(os.getenv("RAG_QUERY_BATCH_MAX_SIZE", "32"))
+    RAG_QUERY_BATCH_WINDOW_MS = float(os.getenv("RAG_QUERY_BATCH_WINDOW_MS", "5"))
+    
+    # Giới hạn cho API truy vấn theo lô (/rag/query-batch)
+    RAG_BATCH_QUERY_MAX_QUESTIONS = int(os.getenv("RAG_BATCH_QUERY_MAX_QUESTIONS", "5000"))
+    RAG_BATCH_GENERATION_CONCURRENCY = int(os.getenv("RAG_BATCH_GENERATION_CONCURRENCY", "4"))
+    
+    # Truy vấn có bộ lọc: tập chunk nhỏ hơn ngưỡng này được quét chính xác thay vì dùng IDSelector
+    RAG_FILTER_EXACT_SEARCH_MAX = int(os.getenv("RAG_FILTER_EXACT_SEARCH_MAX", "2048"))
+    
+    # Đa dạng hóa ngữ cảnh: lấy RAG_MMR_FETCH_FACTOR * k ứng viên, chọn k bằng MMR
+    # (lambda càng lớn càng ưu tiên độ liên quan hơn độ khác biệt) rồi gộp các chunk liền kề
+    RAG_MMR_ENABLED = os.getenv("RAG_MMR_ENABLED", "true").lower() == "true"
+    RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+    RAG_MMR_FETCH_FACTOR = int(os.getenv("RAG_MMR_FETCH_FACTOR", "3"))
+    RAG_MERGE_ADJACENT_CHUNKS = os.getenv("RAG_MERGE_ADJACENT_CHUNKS", "true").lower() == "true"
+    
+    # Rerank bằng cross-encoder (CPU): chấm lại RAG_RERANKER_TOP_N ứng viên đầu trong một batch,
+    # quá RAG_RERANKER_TIMEOUT_MS thì giữ thứ tự của FAISS; điểm được cache theo (câu hỏi, chunk id)
+    RAG_RERANKER_ENABLED = os.getenv("RAG_RERANKER_ENABLED", "false").lower() == "true"
+    RAG_RERANKER_MODEL = os.getenv("RAG_RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RAG_RERANKER_TOP_N = int(os.getenv("RAG_RERANKER_TOP_N", "20"))
+    RAG_RERANKER_TIMEOUT_MS = float(os.getenv("RAG_RERANKER_TIMEOUT_MS", "500"))
+    RAG_RERANKER_CACHE_SIZE = int(os.getenv("RAG_RERANKER_CACHE_SIZE", "10000"))
+    
+    # Tinh chỉnh efSearch/nprobe theo recall@k so với search chính xác
+    RAG_TUNE_TARGET_RECALL = float(os.getenv("RAG_TUNE_TARGET_RECALL", "0.95"))
+    RAG_TUNE_K = int(os.getenv("RAG_TUNE_K", "10"))
+    RAG_TUNE_SAMPLE_SIZE = int(os.getenv("RAG_TUNE_SAMPLE_SIZE", "200"))
     
     # ==================== LLM CONFIG ====================
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash-lite")
     LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+    # Ngân sách token cho ngữ cảnh gửi LLM (lịch sử, RAG, web, file), chia theo tỉ lệ từng nguồn;
+    # phần nguồn không dùng hết được chia lại cho các nguồn khác. Token được ước lượng theo số ký tự.
+    LLM_CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "8000"))
+    LLM_CONTEXT_SHARES = os.getenv("LLM_CONTEXT_SHARES", "rag:0.4,file:0.3,web:0.2,history:0.1")
+    LLM_CHARS_PER_TOKEN = float(os.getenv("LLM_CHARS_PER_TOKEN", "3.0"))
     
     # ==================== WEB SEARCH CONFIG ====================
     GOOGLE_SEARCH_API_KEY = os.getenv("GOOGLE_SEARCH_API_KEY")
@@ -58,9 +144,20 @@ class AppConfig:
     # ==================== LOGGING CONFIG ====================
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
     LOG_FILE = os.getenv("LOG_FILE", "rag_service.log")
+    # Tracing các bước xử lý request: exporter "none", "log", "memory" (xem /system/traces)
+    # hoặc "otel" (OpenTelemetry API, SDK/exporter cấu hình theo chuẩn OpenTelemetry)
+    TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+    TRACING_MEMORY_MAX_SPANS = int(os.getenv("TRACING_MEMORY_MAX_SPANS", "5000"))
     
     # ==================== PERFORMANCE CONFIG ====================
     MAX_WORKERS = int(os.getenv("MAX_WORKERS", "4"))
+    # Số thread cho encode/FAISS search chạy ngoài event loop
+    INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(MAX_WORKERS)))
+    # Pool nhiều process để encode khi rebuild toàn bộ index (0 = tắt)
+    EMBEDDING_POOL_WORKERS = int(os.getenv("EMBEDDING_POOL_WORKERS", "0"))
+    EMBEDDING_POOL_THREADS_PER_WORKER = int(os.getenv("EMBEDDING_POOL_THREADS_PER_WORKER", "1"))
+    EMBEDDING_POOL_SHARD_SIZE = int(os.getenv("EMBEDDING_POOL_SHARD_SIZE", "256"))
+    EMBEDDING_POOL_MIN_CHUNKS = int(os.getenv("EMBEDDING_POOL_MIN_CHUNKS", "5000"))
     MEMORY_LIMIT_GB = float(os.getenv("MEMORY_LIMIT_GB", "8.0"))
     
     @classmethod
@@ -117,8 +214,45 @@ class AppConfig:
             "chunk_overlap": cls.CHUNK_OVERLAP,
             "top_k": cls.RAG_TOP_K,
             "batch_size": cls.RAG_BATCH_SIZE,
+            "query_batch_max_size": cls.RAG_QUERY_BATCH_MAX_SIZE,
+            "query_batch_window_ms": cls.RAG_QUERY_BATCH_WINDOW_MS,
+            "tune_target_recall": cls.RAG_TUNE_TARGET_RECALL,
+            "tune_k": cls.RAG_TUNE_K,
+            "tune_sample_size": cls.RAG_TUNE_SAMPLE_SIZE,
             "index_path": cls.FAISS_INDEX_PATH,
             "mapping_path": cls.CHUNK_MAPPING_PATH,
+            "chunk_store_dir": cls.CHUNK_STORE_DIR,
+            "metadata_path": cls.INDEX_METADATA_PATH,
+            "faiss_mmap_enabled": cls.FAISS_MMAP_ENABLED,
+            "index_generations_dir": cls.INDEX_GENERATIONS_DIR,
+            "index_manifest_path": cls.INDEX_MANIFEST_PATH,
+            "index_keep_generations": cls.INDEX_KEEP_GENERATIONS,
+            "index_reload_poll_seconds": cls.INDEX_RELOAD_POLL_SECONDS,
+            "num_shards": cls.RAG_NUM_SHARDS,
+            "shard_by": cls.RAG_SHARD_BY,
+            "collections_dir": cls.COLLECTIONS_DIR,
+            "max_active_collections": cls.RAG_MAX_ACTIVE_COLLECTIONS,
+            "collection_idle_seconds": cls.RAG_COLLECTION_IDLE_SECONDS,
+            "build_tmp_dir": cls.RAG_BUILD_TMP_DIR,
+            "build_train_threads": cls.RAG_BUILD_TRAIN_THREADS,
+            "rebuild_page_size": cls.RAG_REBUILD_PAGE_SIZE,
+            "vector_compression": cls.RAG_VECTOR_COMPRESSION,
+            "rerank_factor": cls.RAG_RERANK_FACTOR,
+            "mmr_enabled": cls.RAG_MMR_ENABLED,
+            "mmr_lambda": cls.RAG_MMR_LAMBDA,
+            "mmr_fetch_factor": cls.RAG_MMR_FETCH_FACTOR,
+            "merge_adjacent_chunks": cls.RAG_MERGE_ADJACENT_CHUNKS,
+            "reranker_enabled": cls.RAG_RERANKER_ENABLED,
+            "reranker_model": cls.RAG_RERANKER_MODEL,
+            "reranker_top_n": cls.RAG_RERANKER_TOP_N,
+            "reranker_timeout_ms": cls.RAG_RERANKER_TIMEOUT_MS,
+            "embedding_model": cls.EMBEDDING_MODEL,
+            "embedding_backend": cls.EMBEDDING_BACKEND,
+            "embedding_agreement_threshold": cls.EMBEDDING_AGREEMENT_THRESHOLD,
+            "embedding_cache_enabled": cls.EMBEDDING_CACHE_ENABLED,
+            "embedding_cache_path": cls.EMBEDDING_CACHE_PATH,
+            "embedding_cache_max_rows": cls.EMBEDDING_CACHE_MAX_ROWS,
+            "embedding_query_cache_size": cls.EMBEDDING_QUERY_CACHE_SIZE,
             "supported_extensions": cls.SUPPORTED_EXTENSIONS
         }
     
@@ -128,7 +262,10 @@ class AppConfig:
         return {
             "api_key": cls.GOOGLE_API_KEY,
             "model": cls.LLM_MODEL,
-            "temperature": cls.LLM_TEMPERATURE
+            "temperature": cls.LLM_TEMPERATURE,
+            "context_token_budget": cls.LLM_CONTEXT_TOKEN_BUDGET,
+            "context_shares": cls.LLM_CONTEXT_SHARES,
+            "chars_per_token": cls.LLM_CHARS_PER_TOKEN
         }
     
     @classmethod
@@ -1,11 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from api import rag_routes, gen_routes, file_routes, web_routes, api_key_routes, conversation_routes
+from api import rag_routes, gen_routes, file_routes, web_routes, api_key_routes, conversation_routes, collection_routes
 from api.system import routes as system_routes
 from services.vector_db.database_manager import DatabaseManager
 from services.app_manager import app_manager
 from config.app_config import AppConfig
+from utils.tracing import TraceContextMiddleware
 import logging
 import sys
 import os
@@ -58,7 +59,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["traceparent"],
 )
+app.add_middleware(TraceContextMiddleware)
 
 app.include_router(rag_routes.router, prefix="/rag", tags=["RAG"])
 app.include_router(file_routes.router, prefix="/files", tags=["Files"])
@@ -67,6 +70,7 @@ app.include_router(gen_routes.router, prefix="/generate", tags=["Generative Cont
 app.include_router(api_key_routes.router, prefix="/api-key", tags=["API Key"])
 app.include_router(conversation_routes.router, prefix="/conversations", tags=["Conversations"])
 app.include_router(system_routes.router, prefix="/system", tags=["System Management"])
+app.include_router(collection_routes.router, prefix="/collections", tags=["Collections"])
 
 @app.get("/")
 def read_root():
@@ -1,14 +1,20 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
-from typing import List, Dict, Optional
+import logging
+from typing import AsyncIterator, List, Dict, Optional
+from services.llm.context_packer import ContextPacker, PackedContext
+from utils.tracing import span
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class LLM:
     
     def __init__(self):
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
         self.model = genai.GenerativeModel("gemini-2.0-flash-lite")
+        self.context_packer = ContextPacker()
         
         self.system_prompt = """Bạn là ChatBot, một trợ lý AI thông minh được phát triển để hỗ trợ người dùng một cách toàn diện và chuyên nghiệp.
 
@@ -34,6 +40,70 @@ class LLM:
             Bạn được thiết kế để giúp đỡ trong các lĩnh vực từ giáo dục, công việc đến giải trí và đời sống hàng ngày, nhưng luôn tuân thủ các nguyên tắc đạo đức và pháp luật.
         """
 
+    def pack_context(self, prompt: str, rag_response: str = None, web_response: str = None,
+                     file_response: str = None, conversation_history: str = None) -> PackedContext:
+        """Cắt lịch sử hội thoại và các nguồn ngữ cảnh vào ngân sách token của prompt."""
+        return self.context_packer.pack(prompt, {
+            "history": conversation_history,
+            "rag": rag_response,
+            "web": web_response,
+            "file": file_response,
+        })
+
+    async def _build_prompt(self, prompt: str, rag_response: str = None, web_response: str = None,
+                            file_response: str = None, conversation_history: str = None) -> str:
+        """Ghép prompt hệ thống, lịch sử hội thoại, ngữ cảnh và câu hỏi thành prompt gửi cho model.
+
+        Ngữ cảnh được cắt theo ngân sách token trước (xem ContextPacker) để kích thước prompt có giới hạn.
+        """
+        with span("llm.pack_context") as pack_span:
+            packed = self.pack_context(prompt, rag_response, web_response, file_response, conversation_history)
+            pack_span.set_attribute("input_tokens", packed.report["input_tokens"])
+            pack_span.set_attribute("used_tokens", packed.report["used_tokens"])
+        if packed.report["sources"]:
+            logger.info(packed.summary())
+        conversation_history = packed.get("history")
+        rag_response = packed.get("rag")
+        web_response = packed.get("web")
+        file_response = packed.get("file")
+        
+        needs_analysis = self.should_analyze_prompt(prompt)
+        analysis_response = ""
+        if needs_analysis:
+            with span("llm.analyze_prompt"):
+                analysis_response = await self.analyze_communication_context(prompt)
+            
+        combined_prompt = f"System: {self.system_prompt}\n\n"
+
+        if conversation_history is not None and len(conversation_history.strip()) > 0:
+            combined_prompt += f"Lịch sử hội thoại:\n{conversation_history}\n\n"
+        
+        context_added = False
+        
+        if rag_response is not None and len(rag_response.strip()) > 0:
+            combined_prompt += f"Thông tin RAG:\n{rag_response}\n\n"
+            context_added = True
+            
+        if web_response is not None and len(web_response.strip()) > 0:
+            combined_prompt += f"Thông tin web:\n{web_response}\n\n"
+            context_added = True
+
+        if file_response is not None and len(file_response.strip()) > 0:
+            combined_prompt += f"Thông tin file:\n{file_response}\n\n"
+            context_added = True
+
+        combined_prompt += f"Câu hỏi: {prompt}\n\n"
+        
+        if needs_analysis and analysis_response:
+            combined_prompt += f"Phân tích: {analysis_response}\n\n"
+
+        if context_added:
+            combined_prompt += "Trả lời dựa trên thông tin cung cấp và kiến thức của bạn."
+        else:
+            combined_prompt += "Trả lời dựa trên kiến thức của bạn."
+        
+        return combined_prompt
+
     async def generateContent(self, prompt: str, rag_response: str = None, web_response: str = None, 
                              file_response: str = None, conversation_history: str = None) -> str:
         """Tạo nội dung dựa trên prompt và ngữ cảnh được cung cấp.
@@ -42,46 +112,41 @@ class LLM:
         (RAG, web, file) để tạo ra phản hồi phù hợp và mạch lạc.
         """
         try:
-            needs_analysis = self.should_analyze_prompt(prompt)
-            analysis_response = ""
-            if needs_analysis:
-                analysis_response = await self.analyze_communication_context(prompt)
-                
-            combined_prompt = f"System: {self.system_prompt}\n\n"
-
-            if conversation_history is not None and len(conversation_history.strip()) > 0:
-                combined_prompt += f"Lịch sử hội thoại:\n{conversation_history}\n\n"
-            
-            context_added = False
-            
-            if rag_response is not None and len(rag_response.strip()) > 0:
-                combined_prompt += f"Thông tin RAG:\n{rag_response}\n\n"
-                context_added = True
-                
-            if web_response is not None and len(web_response.strip()) > 0:
-                combined_prompt += f"Thông tin web:\n{web_response}\n\n"
-                context_added = True
-
-            if file_response is not None and len(file_response.strip()) > 0:
-                combined_prompt += f"Thông tin file:\n{file_response}\n\n"
-                context_added = True
-
-            combined_prompt += f"Câu hỏi: {prompt}\n\n"
-            
-            if needs_analysis and analysis_response:
-                combined_prompt += f"Phân tích: {analysis_response}\n\n"
-
-            if context_added:
-                combined_prompt += "Trả lời dựa trên thông tin cung cấp và kiến thức của bạn."
-            else:
-                combined_prompt += "Trả lời dựa trên kiến thức của bạn."
-            
-            response = await self.model.generate_content_async(combined_prompt)
+            combined_prompt = await self._build_prompt(
+                prompt, rag_response, web_response, file_response, conversation_history
+            )
+            with span("llm.generate", prompt_chars=len(combined_prompt)) as generate_span:
+                response = await self.model.generate_content_async(combined_prompt)
+                usage = getattr(response, "usage_metadata", None)
+                if usage is not None:
+                    generate_span.set_attribute("prompt_tokens", getattr(usage, "prompt_token_count", None))
+                    generate_span.set_attribute("output_tokens", getattr(usage, "candidates_token_count", None))
             return response.text
 
         except Exception as e:
             print(f"Lỗi khi tạo nội dung: {str(e)}")
             return "Xin lỗi, tôi không thể tạo nội dung lúc này."
+
+    async def generateContentStream(self, prompt: str, rag_response: str = None, web_response: str = None,
+                                    file_response: str = None, conversation_history: str = None) -> AsyncIterator[str]:
+        """Giống generateContent nhưng trả từng đoạn văn bản ngay khi model sinh ra.
+        
+        Người dùng thấy token đầu tiên sau một lượt gọi model thay vì phải chờ toàn bộ câu trả lời.
+        Lỗi không bị nuốt thành câu xin lỗi mà được ném tiếp để luồng SSE gửi sự kiện error.
+        """
+        combined_prompt = await self._build_prompt(
+            prompt, rag_response, web_response, file_response, conversation_history
+        )
+        with span("llm.generate_stream_start", prompt_chars=len(combined_prompt)):
+            response = await self.model.generate_content_async(combined_prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk không có phần văn bản (ví dụ bị chặn bởi safety filter)
+                continue
+            if text:
+                yield text
     
     def should_analyze_prompt(self, prompt: str) -> bool:
         """Xác định xem prompt có cần phân tích chi tiết không.
@@ -7,7 +7,7 @@ from contextlib import asynccontextmanager
 
 from config.app_config import AppConfig
 from services.vector_db import VectorDBService
-from services.rag.rag import RAGService
+from services.rag.registry import get_rag_service, rag_registry
 from services.llm.generator import GeneratorService
 from services.web.service import WebSearchService
 from services.conversation.service import ConversationService
@@ -77,7 +77,8 @@ class AppManager:
         """Khởi tạo RAG service."""
         safe_log('info', "Khởi tạo RAG Service...")
         
-        self.services['rag'] = RAGService(upload_dir=self.config.UPLOAD_DIR)
+        self.services['rag'] = await get_rag_service()
+        self.services['rag'].start_index_watcher()
         
         safe_log('info', "RAG Service đã sẵn sàng")
     
@@ -168,6 +169,11 @@ class AppManager:
         """Tắt tất cả services."""
         safe_log('info', "Đang tắt ứng dụng...")
         
+        try:
+            await rag_registry.shutdown_collections()
+        except Exception as e:
+            safe_log('error', f"Lỗi khi tắt các collection: {str(e)}")
+        
         for service_name, service in self.services.items():
             try:
                 if hasattr(service, 'shutdown'):
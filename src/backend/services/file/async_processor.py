@@ -5,6 +5,7 @@ from pathlib import Path
 
 from services.vector_db.database_manager import DatabaseManager
 from services.vector_db.text_processor import TextProcessor
+from utils.collection_utils import DEFAULT_COLLECTION, collection_upload_dir
 from .async_reader import AsyncFileReader
 
 
@@ -23,14 +24,14 @@ class AsyncFileProcessor:
         self.file_reader = AsyncFileReader()
         self.valid_extensions = {'.txt', '.pdf', '.doc', '.docx', '.yaml', '.yml'}
 
-    async def process_file(self, file_path: str) -> None:
+    async def process_file(self, file_path: str, collection_id: str = DEFAULT_COLLECTION) -> None:
         """Xử lý file và lưu vào database nếu nội dung thay đổi (async)."""
         try:
             file_name = os.path.basename(file_path)
             content = await self.file_reader.read_file_from_path(file_path)
             
             has_changed, file_id = self.database_manager.check_file_changed(
-                file_name, len(content)
+                file_name, len(content), collection_id
             )
             
             if not has_changed:
@@ -39,20 +40,20 @@ class AsyncFileProcessor:
             chunks = self.text_processor.split_text(content)
             
             file_id = self.database_manager.update_file_metadata(
-                file_name, len(content)
+                file_name, len(content), collection_id
             )
             
-            self.database_manager.update_file_chunks(file_id, chunks)
+            self.database_manager.update_file_chunks(file_id, chunks, collection_id)
             
         except Exception as e:
             print(f"Lỗi khi xử lý file {file_path}: {str(e)}")
             raise
 
     def get_db_files(self) -> Set[str]:
-        """Lấy danh sách tên các file đã lưu trong database."""
+        """Lấy danh sách tên các file của collection mặc định đã lưu trong database."""
         with self.database_manager.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT name FROM files")
+            cursor.execute("SELECT name FROM files WHERE collection_id = ?", (DEFAULT_COLLECTION,))
             return {row[0] for row in cursor.fetchall()}
     
     def get_uploaded_files(self) -> Set[str]:
@@ -106,14 +107,15 @@ class AsyncFileProcessor:
         except Exception as e:
             print(f"Lỗi khi đồng bộ dữ liệu: {str(e)}")
 
-    def delete_file(self, file_name: str) -> None:
+    def delete_file(self, file_name: str, collection_id: str = DEFAULT_COLLECTION) -> None:
         """Xóa file khỏi cả database và filesystem."""
         try:
             # Xóa khỏi database
-            self.database_manager.delete_file_from_db(file_name)
+            self.database_manager.delete_file_from_db(file_name, collection_id)
             
             # Xóa khỏi filesystem nếu tồn tại
-            file_path = os.path.join(self.upload_dir, file_name)
+            upload_dir = self.upload_dir if collection_id == DEFAULT_COLLECTION else collection_upload_dir(collection_id)
+            file_path = os.path.join(upload_dir, file_name)
             if os.path.exists(file_path):
                 os.remove(file_path)
                 print(f"Đã xóa file {file_name} khỏi filesystem")
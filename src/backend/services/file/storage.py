@@ -7,16 +7,20 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 class FileStorage:
 
+    def __init__(self, upload_dir: str = UPLOAD_FOLDER) -> None:
+        self.upload_dir = upload_dir
+        os.makedirs(self.upload_dir, exist_ok=True)
+
     def save_file(self, file: UploadFile) -> str:
         """Lưu file tải lên vào thư mục upload."""
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
+        file_path = os.path.join(self.upload_dir, file.filename)
         with open(file_path, "wb") as f:
             f.write(file.file.read())
         return file_path
 
     def delete_file(self, file_name: str) -> bool:
         """Xóa file khỏi thư mục upload."""
-        file_path = os.path.join(UPLOAD_FOLDER, file_name)
+        file_path = os.path.join(self.upload_dir, file_name)
         if os.path.exists(file_path):
             os.remove(file_path)
             return True
@@ -25,8 +29,8 @@ class FileStorage:
     def list_files(self) -> List[Dict[str, Any]]:
         """Liệt kê tất cả các file trong thư mục upload."""
         files = []
-        for file_name in os.listdir(UPLOAD_FOLDER):
-            file_path = os.path.join(UPLOAD_FOLDER, file_name)
+        for file_name in os.listdir(self.upload_dir):
+            file_path = os.path.join(self.upload_dir, file_name)
             size = os.path.getsize(file_path)
             files.append({"name": file_name, "size": size, "path": file_path})
         return files 
\ No newline at end of file
@@ -0,0 +1,220 @@
+import re
+import math
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.app_config import AppConfig
+
+config = AppConfig()
+
+logger = logging.getLogger(__name__)
+
+# Thứ tự các nguồn ngữ cảnh trong prompt
+CONTEXT_SOURCES = ("history", "rag", "web", "file")
+
+_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def estimate_tokens(text: str, chars_per_token: Optional[float] = None) -> int:
+    """Ước lượng số token của văn bản theo số ký tự (không gọi API đếm token của model)."""
+    if not text:
+        return 0
+    return max(1, math.ceil(len(text) / (chars_per_token or config.LLM_CHARS_PER_TOKEN)))
+
+
+def parse_shares(spec: str) -> Dict[str, float]:
+    """Đọc tỉ lệ ngân sách dạng "rag:0.4,file:0.3,..." thành dict, bỏ qua nguồn không hợp lệ."""
+    shares = {}
+    for item in spec.split(","):
+        name, _, value = item.partition(":")
+        name = name.strip()
+        try:
+            share = float(value)
+        except ValueError:
+            continue
+        if name in CONTEXT_SOURCES and share > 0:
+            shares[name] = share
+    return shares
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    """Cắt đoạn quá dài thành các khối tối đa max_chars ký tự, ưu tiên cắt ở khoảng trắng."""
+    pieces = []
+    while len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars)
+        cut = cut if cut > max_chars // 2 else max_chars
+        pieces.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def split_segments(text: str, separator: str, max_chars: int) -> List[str]:
+    """Tách văn bản thành các đoạn theo separator, đoạn quá dài được cắt nhỏ."""
+    segments = []
+    for part in text.split(separator):
+        part = part.strip()
+        if part:
+            segments.extend(_split_long(part, max_chars))
+    return segments
+
+
+def lexical_scores(question: str, segments: List[str]) -> List[float]:
+    """Điểm liên quan của từng đoạn với câu hỏi: số từ khóa khác nhau xuất hiện, cộng tần suất (đã chuẩn hóa)."""
+    terms = {term for term in _TERM_PATTERN.findall(question.lower()) if len(term) > 2}
+    if not terms:
+        return [0.0] * len(segments)
+    scores = []
+    for segment in segments:
+        counts = Counter(_TERM_PATTERN.findall(segment.lower()))
+        distinct = sum(1 for term in terms if counts[term])
+        frequency = sum(min(counts[term], 5) for term in terms)
+        scores.append(distinct + frequency / (1.0 + math.log1p(sum(counts.values()))))
+    return scores
+
+
+class PackedContext:
+    """Ngữ cảnh đã cắt theo ngân sách token: nội dung từng nguồn và báo cáo phần giữ/bỏ."""
+
+    def __init__(self, sections: Dict[str, str], report: Dict[str, Any]) -> None:
+        self.sections = sections
+        self.report = report
+
+    def get(self, source: str) -> Optional[str]:
+        """Nội dung của một nguồn sau khi cắt, None nếu nguồn rỗng."""
+        return self.sections.get(source) or None
+
+    def summary(self) -> str:
+        """Một dòng tóm tắt cho log."""
+        parts = [
+            f"{name} {entry['used_tokens']}/{entry['input_tokens']}"
+            + (f" (-{entry['dropped_segments']})" if entry['dropped_segments'] else "")
+            for name, entry in self.report["sources"].items()
+        ]
+        return f"context {self.report['used_tokens']}/{self.report['budget_tokens']} tokens: " + ", ".join(parts)
+
+
+class ContextPacker:
+    """Ghép ngữ cảnh (lịch sử, RAG, web, file) vào prompt trong giới hạn token.
+
+    Ngân sách LLM_CONTEXT_TOKEN_BUDGET được chia theo tỉ lệ của các nguồn có mặt;
+    nguồn cần ít hơn phần của mình nhường phần dư cho các nguồn còn lại. Mỗi nguồn
+    được tách thành đoạn, chọn đoạn theo điểm liên quan cho tới khi hết phần ngân
+    sách, rồi ghép lại theo thứ tự gốc:
+    - rag: thứ tự xếp hạng của retrieval
+    - web, file: độ trùng từ khóa với câu hỏi
+    - history: tin nhắn gần nhất trước
+    """
+
+    def __init__(
+        self,
+        budget_tokens: Optional[int] = None,
+        shares: Optional[Dict[str, float]] = None,
+        chars_per_token: Optional[float] = None,
+        max_segment_chars: int = 1500
+    ) -> None:
+        self.budget_tokens = budget_tokens if budget_tokens is not None else config.LLM_CONTEXT_TOKEN_BUDGET
+        self.shares = shares if shares is not None else parse_shares(config.LLM_CONTEXT_SHARES)
+        self.chars_per_token = chars_per_token or config.LLM_CHARS_PER_TOKEN
+        self.max_segment_chars = max_segment_chars
+
+    def _segments(self, source: str, text: str, question: str) -> Tuple[List[str], List[float], str]:
+        """Các đoạn của nguồn, điểm ưu tiên tương ứng và chuỗi nối khi ghép lại."""
+        if source == "history":
+            segments = split_segments(text, "\n", self.max_segment_chars)
+            return segments, [float(position) for position in range(len(segments))], "\n"
+        if source == "rag":
+            segments = split_segments(text, "\n\n", self.max_segment_chars)
+            return segments, [-float(position) for position in range(len(segments))], "\n\n"
+        separator = "\n\n" if source == "file" else "\n"
+        segments = split_segments(text, separator, self.max_segment_chars)
+        return segments, lexical_scores(question, segments), separator
+
+    def _allocate(self, demands: Dict[str, int]) -> Dict[str, int]:
+        """Chia ngân sách theo tỉ lệ, nguồn cần ít hơn phần được chia nhường phần dư cho nguồn khác."""
+        allocation: Dict[str, int] = {}
+        remaining = self.budget_tokens
+        pending = {name: demand for name, demand in demands.items() if demand > 0}
+        while pending:
+            weights = {name: self.shares.get(name, 0.0) for name in pending}
+            if not any(weights.values()):
+                weights = {name: 1.0 for name in pending}
+            total_weight = sum(weights.values())
+            fair = {name: remaining * weights[name] / total_weight for name in pending}
+            satisfied = [name for name, demand in pending.items() if demand <= fair[name]]
+            if not satisfied:
+                for name in pending:
+                    allocation[name] = int(fair[name])
+                break
+            for name in satisfied:
+                allocation[name] = pending.pop(name)
+                remaining -= allocation[name]
+        return allocation
+
+    def _fill(self, segments: List[str], scores: List[float], budget: int) -> Tuple[List[int], int]:
+        """Chọn đoạn theo điểm giảm dần (cùng điểm thì đoạn trước) cho tới khi hết ngân sách."""
+        order = sorted(range(len(segments)), key=lambda position: (-scores[position], position))
+        kept, used = [], 0
+        for position in order:
+            tokens = estimate_tokens(segments[position], self.chars_per_token)
+            if used + tokens <= budget:
+                kept.append(position)
+                used += tokens
+        return sorted(kept), used
+
+    def pack(self, question: str, sources: Dict[str, Optional[str]]) -> PackedContext:
+        """Cắt các nguồn ngữ cảnh vào ngân sách token, trả về nội dung và báo cáo phần bị bỏ."""
+        prepared = {}
+        for name in CONTEXT_SOURCES:
+            text = sources.get(name)
+            if text and text.strip():
+                prepared[name] = self._segments(name, text, question)
+        demands = {
+            name: sum(estimate_tokens(segment, self.chars_per_token) for segment in segments)
+            for name, (segments, _, _) in prepared.items()
+        }
+        allocation = self._allocate(demands)
+
+        sections: Dict[str, str] = {}
+        report_sources: Dict[str, Any] = {}
+        for name, (segments, scores, separator) in prepared.items():
+            budget = allocation.get(name, 0)
+            kept, used = self._fill(segments, scores, budget)
+            if not kept and segments and budget > 0:
+                # Không đoạn nào vừa: giữ phần đầu của đoạn tốt nhất
+                best = max(range(len(segments)), key=lambda position: (scores[position], -position))
+                truncated = segments[best][:int(budget * self.chars_per_token)]
+                sections[name] = truncated
+                kept, used = [best], estimate_tokens(truncated, self.chars_per_token)
+            else:
+                sections[name] = separator.join(segments[position] for position in kept)
+            kept_set = set(kept)
+            dropped = [position for position in range(len(segments)) if position not in kept_set]
+            report_sources[name] = {
+                "budget_tokens": budget,
+                "input_tokens": demands[name],
+                "used_tokens": used,
+                "segments": len(segments),
+                "kept_segments": len(kept),
+                "dropped_segments": len(dropped),
+                "dropped_tokens": max(0, demands[name] - used),
+                "dropped": [
+                    {
+                        "segment": position,
+                        "tokens": estimate_tokens(segments[position], self.chars_per_token),
+                        "preview": segments[position][:80],
+                    }
+                    for position in dropped[:20]
+                ],
+            }
+
+        report = {
+            "budget_tokens": self.budget_tokens,
+            "input_tokens": sum(demands.values()),
+            "used_tokens": sum(entry["used_tokens"] for entry in report_sources.values()),
+            "question_tokens": estimate_tokens(question, self.chars_per_token),
+            "sources": report_sources,
+        }
+        return PackedContext(sections, report)
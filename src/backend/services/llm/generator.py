@@ -1,5 +1,5 @@
 from models.llm import LLM
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional
 from services.conversation.service import ConversationService
 import faiss
 
@@ -62,6 +62,60 @@ class GeneratorService:
         
         return response
     
+    async def generate_content_stream(
+        self,
+        prompt: str,
+        conversation_id: Optional[str] = None,
+        rag_response: Optional[str] = None,
+        web_response: Optional[str] = None,
+        file_response: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Giống generate_content nhưng trả từng đoạn văn bản; tin nhắn được lưu khi stream kết thúc.
+
+        Lỗi của model được ném tiếp (SSE gửi sự kiện error) và câu trả lời dở dang không được lưu.
+        """
+        prompt_lower = prompt.lower().strip()
+        if (
+            prompt_lower in self.quick_responses
+            and not rag_response and not web_response and not file_response
+        ):
+            response = self.quick_responses[prompt_lower]
+            if conversation_id:
+                self.conversation_service.add_message(conversation_id, "user", prompt)
+                self.conversation_service.add_message(conversation_id, "assistant", response)
+            yield response
+            return
+        
+        conversation_history = None
+        if conversation_id:
+            conversation_history = self.conversation_service.format_conversation_for_context(conversation_id)
+        
+        has_contextual_info = any(
+            x is not None and len(str(x).strip()) > 0
+            for x in [rag_response, web_response, file_response]
+        )
+        
+        parts: List[str] = []
+        failed = False
+        try:
+            async for text in self.llm.generateContentStream(
+                prompt,
+                rag_response if has_contextual_info else None,
+                web_response if has_contextual_info else None,
+                file_response if has_contextual_info else None,
+                conversation_history
+            ):
+                parts.append(text)
+                yield text
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # Lưu cả khi client ngắt kết nối giữa chừng để lịch sử không mất câu hỏi
+            if conversation_id and parts and not failed:
+                self.conversation_service.add_message(conversation_id, "user", prompt)
+                self.conversation_service.add_message(conversation_id, "assistant", "".join(parts))
+    
     async def merge_context(self, web_results: List[List[Dict]]) -> str:
         """Hợp nhất kết quả tìm kiếm web thành một văn bản thống nhất."""
         return await self.llm.merge_context(web_results)
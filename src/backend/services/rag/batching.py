@@ -0,0 +1,144 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatchEmbedder:
+    """Gom các yêu cầu encode đồng thời thành một lần forward theo batch.
+
+    Mỗi yêu cầu được đưa vào hàng đợi; worker lấy yêu cầu đầu tiên rồi chờ thêm
+    tối đa max_wait_ms (hoặc tới khi đủ max_batch_size), encode cả batch một lần
+    và trả từng vector về cho coroutine đang chờ.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        runner: Optional[Callable[..., Awaitable[Any]]] = None
+    ) -> None:
+        self.encode_fn = encode_fn
+        self.runner = runner
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "max_batch_size_seen": 0,
+            "total_wait_ms": 0.0,
+            "total_encode_ms": 0.0,
+        }
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        """Khởi động worker trên event loop hiện tại nếu chưa chạy."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker_task is None or self._worker_task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker_task = loop.create_task(self._run())
+        return self._queue
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Encode một văn bản, được gộp batch với các yêu cầu đồng thời khác."""
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[str, asyncio.Future, float]]:
+        """Lấy một batch từ hàng đợi theo cửa sổ thời gian và kích thước tối đa."""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Encode một batch văn bản, qua runner (executor) nếu được cấu hình."""
+        if self.runner is not None:
+            return await self.runner(self.encode_fn, texts)
+        return self.encode_fn(texts)
+
+    async def _run(self) -> None:
+        """Vòng lặp worker: gom batch, encode và trả kết quả."""
+        while True:
+            batch = await self._collect_batch()
+            batch_start = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+
+            try:
+                vectors = await self._encode_batch(texts)
+            except asyncio.CancelledError:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Error encoding query batch of {len(batch)}: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], len(batch))
+            self._stats["total_wait_ms"] += sum((batch_start - enqueued) * 1000 for _, _, enqueued in batch)
+            self._stats["total_encode_ms"] += (time.perf_counter() - batch_start) * 1000
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê kích thước batch và thời gian chờ."""
+        requests = self._stats["requests"]
+        batches = self._stats["batches"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "requests": requests,
+            "batches": batches,
+            "avg_batch_size": round(requests / batches, 2) if batches else 0.0,
+            "max_batch_size_seen": self._stats["max_batch_size_seen"],
+            "avg_wait_ms": round(self._stats["total_wait_ms"] / requests, 3) if requests else 0.0,
+            "avg_encode_ms": round(self._stats["total_encode_ms"] / batches, 3) if batches else 0.0,
+        }
+
+    async def shutdown(self) -> None:
+        """Dừng worker và hủy các yêu cầu còn trong hàng đợi."""
+        if self._worker_task is not None and not self._worker_task.done():
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, future, _ = self._queue.get_nowait()
+                if not future.done():
+                    future.cancel()
+        self._worker_task = None
+        self._queue = None
+        self._loop = None
@@ -0,0 +1,115 @@
+import os
+import time
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BUILD_PHASES = ("encode", "train", "add", "persist")
+
+
+class BuildTimings:
+    """Thời gian (giây) của từng giai đoạn build index: encode, train, add, persist."""
+
+    def __init__(self, num_vectors: int = 0) -> None:
+        self.num_vectors = num_vectors
+        self.phases: Dict[str, float] = {}
+        self.started_at = time.time()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Đo thời gian một giai đoạn (cộng dồn nếu giai đoạn chạy nhiều lần)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    @property
+    def total_seconds(self) -> float:
+        """Tổng thời gian các giai đoạn."""
+        return sum(self.phases.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Báo cáo dạng dict cho log và /rag/index-stats."""
+        return {
+            "num_vectors": self.num_vectors,
+            "phases": {name: round(self.phases[name], 3) for name in BUILD_PHASES if name in self.phases},
+            "total_seconds": round(self.total_seconds, 3),
+            "started_at": self.started_at,
+        }
+
+
+class EncodedCorpus:
+    """Ma trận embedding của toàn bộ chunk trong một file memmap tạm.
+
+    Mỗi chunk được encode đúng một lần vào ma trận này; dữ liệu train quantizer
+    và vector thêm vào index đều đọc lại từ đây thay vì encode lại, và ma trận
+    nằm trong page cache thay vì heap nên build corpus lớn không cần thêm RAM.
+
+    Vector được append theo từng trang (không cần biết trước số dòng), sau
+    finish() ma trận được map lại ở chế độ chỉ đọc.
+    """
+
+    def __init__(self, dim: int, tmp_dir: Optional[str] = None) -> None:
+        if tmp_dir:
+            os.makedirs(tmp_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="rag-build-", suffix=".f32", dir=tmp_dir or None)
+        self._file = os.fdopen(fd, 'wb')
+        self.dim = dim
+        self.num_rows = 0
+        self.vectors: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __enter__(self) -> "EncodedCorpus":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def append(self, embeddings: np.ndarray) -> None:
+        """Ghi thêm một khối embedding vào cuối ma trận."""
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got shape {embeddings.shape}")
+        self._file.write(embeddings.tobytes())
+        self.num_rows += embeddings.shape[0]
+
+    def finish(self) -> None:
+        """Đóng file ghi và map ma trận để train/add đọc lại."""
+        self._file.close()
+        if self.num_rows == 0:
+            self.vectors = np.empty((0, self.dim), dtype='float32')
+        else:
+            self.vectors = np.memmap(self.path, dtype='float32', mode='r', shape=(self.num_rows, self.dim))
+
+    def rows(self, start: int, end: int) -> np.ndarray:
+        """Khối dòng liên tiếp dạng mảng float32 liền bộ nhớ (cho FAISS)."""
+        return np.ascontiguousarray(self.vectors[start:end])
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Các dòng theo chỉ số (đọc theo thứ tự tăng dần để truy cập file tuần tự)."""
+        return np.ascontiguousarray(self.vectors[np.sort(rows)])
+
+    def sample(self, rows: np.ndarray, sample_size: int, seed: Optional[int] = None) -> np.ndarray:
+        """Mẫu ngẫu nhiên không lặp gồm sample_size dòng trong rows, dùng làm dữ liệu train."""
+        if sample_size >= len(rows):
+            return self.take(rows)
+        picked = np.random.default_rng(seed).choice(len(rows), size=sample_size, replace=False)
+        return self.take(np.asarray(rows)[picked])
+
+    def close(self) -> None:
+        """Bỏ map và xóa file tạm."""
+        if not self._file.closed:
+            self._file.close()
+        self.vectors = None
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logger.warning(f"Could not remove build matrix {self.path}: {e}")
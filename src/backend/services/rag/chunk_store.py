@@ -0,0 +1,382 @@
+import os
+import sys
+import json
+import logging
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from services.rag.segments import (
+    Segment, SegmentedStore, load_array, load_raw, segment_name, write_array, write_json, write_state
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _ChunkSegment(Segment):
+    """Segment của ChunkStore: các cột sắp xếp theo chunk id và file texts.
+
+    spans[i] = (start, end) là vị trí nội dung của dòng i trong texts, nên
+    texts không cần cùng thứ tự với các cột.
+    """
+
+    FILES = ("ids.npy", "file_ids.npy", "chunk_indices.npy", "spans.npy", "texts.bin")
+
+    def __init__(
+        self,
+        name: str,
+        ids: np.ndarray,
+        file_ids: np.ndarray,
+        chunk_indices: np.ndarray,
+        spans: np.ndarray,
+        texts: np.ndarray
+    ) -> None:
+        super().__init__(name, ids)
+        self.file_ids = file_ids
+        self.chunk_indices = chunk_indices
+        self.spans = spans
+        self.texts = texts
+
+    @classmethod
+    def load(cls, directory: str, name: str, mmap: bool) -> "_ChunkSegment":
+        """Map (hoặc đọc) một segment từ thư mục."""
+        mmap_mode = 'r' if mmap else None
+        prefix = os.path.join(directory, name)
+        texts_path = f"{prefix}.texts.bin"
+        return cls(
+            name,
+            load_array(f"{prefix}.ids.npy", mmap_mode),
+            load_array(f"{prefix}.file_ids.npy", mmap_mode),
+            load_array(f"{prefix}.chunk_indices.npy", mmap_mode),
+            load_array(f"{prefix}.spans.npy", mmap_mode),
+            load_raw(texts_path, 'uint8', (os.path.getsize(texts_path),), mmap),
+        )
+
+    def text(self, position: int) -> str:
+        """Giải mã nội dung chunk tại vị trí trong segment."""
+        start, end = int(self.spans[position, 0]), int(self.spans[position, 1])
+        return bytes(self.texts[start:end]).decode('utf-8')
+
+    def nbytes(self) -> int:
+        return sum(
+            int(np.asarray(array_data).nbytes)
+            for array_data in (self.ids, self.file_ids, self.chunk_indices, self.spans, self.texts)
+        )
+
+
+class ChunkStore(SegmentedStore):
+    """Lưu chunk mapping dạng cột, có thể memory-map thay cho mảng object pickle.
+
+    Dùng định dạng segment chung của SegmentedStore; mỗi segment gồm ids.npy
+    int64 đã sắp xếp, file_ids.npy và chunk_indices.npy int32, spans.npy int64
+    (n, 2) và texts.bin UTF-8. files.json ánh xạ file_id -> tên file.
+
+    Overlay giữ (file_id, chunk_index, content) của các chunk mới; save() chỉ
+    ghi phần thay đổi, các segment cũ được dùng lại.
+    """
+
+    _SEGMENT_CLASS = _ChunkSegment
+    _FILES_FILE = "files.json"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._added: Dict[int, Tuple[int, int, str]] = {}
+        self._file_names: Dict[int, str] = {}
+
+    # ==================== CONSTRUCTION ====================
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence]) -> "ChunkStore":
+        """Tạo store từ các dòng (id, content, source, chunk_index, file_id)."""
+        store = cls()
+        store.add(rows)
+        return store
+
+    @classmethod
+    def from_legacy_entries(cls, entries: List[Dict[str, Any]]) -> "ChunkStore":
+        """Chuyển mapping cũ (list dict pickle) sang ChunkStore.
+
+        Mapping cũ không có file_id nên mỗi tên file được gán một id âm tạm thời.
+        """
+        synthetic_ids: Dict[str, int] = {}
+        rows = []
+        for entry in entries:
+            source = entry.get('source', '')
+            file_id = synthetic_ids.setdefault(source, -(len(synthetic_ids) + 1))
+            rows.append((entry['chunk_id'], entry.get('content') or '', source, entry.get('chunk_index', 0), file_id))
+        return cls.from_rows(rows)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ChunkStore":
+        """Load ChunkStore từ thư mục, mặc định memory-map để khởi động O(1)."""
+        store = cls()
+        store._load_state(directory, cls.read_state(directory), mmap)
+
+        files_path = os.path.join(directory, cls._FILES_FILE)
+        if os.path.exists(files_path):
+            with open(files_path, 'r', encoding='utf-8') as f:
+                store._file_names = {int(k): v for k, v in json.load(f).items()}
+        return store
+
+    def _load_segment(self, directory: str, name: str, mmap: bool) -> _ChunkSegment:
+        return _ChunkSegment.load(directory, name, mmap)
+
+    # ==================== LOOKUP ====================
+
+    def get(self, chunk_id: Any, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Lấy thông tin chunk theo id dưới dạng dict giống mapping cũ."""
+        chunk_id = int(chunk_id)
+        if chunk_id in self._added:
+            file_id, chunk_index, content = self._added[chunk_id]
+        else:
+            segment, position = self._find_base(chunk_id)
+            if segment is None:
+                return default
+            file_id = int(segment.file_ids[position])
+            chunk_index = int(segment.chunk_indices[position])
+            content = segment.text(position)
+        return {
+            'chunk_id': chunk_id,
+            'content': content,
+            'source': self._file_names.get(file_id, ''),
+            'chunk_index': chunk_index,
+            'file_id': file_id,
+        }
+
+    def file_ids_for_names(self, file_names: Iterable[str]) -> List[int]:
+        """Chuyển tên file thành file_id theo bảng file của store."""
+        names = set(file_names)
+        return [file_id for file_id, name in self._file_names.items() if name in names]
+
+    def ids_for_file_ids(self, file_ids: Iterable[int]) -> np.ndarray:
+        """Lấy tất cả chunk id thuộc các file_id (mảng int64 tăng dần)."""
+        wanted = np.asarray(sorted(set(int(file_id) for file_id in file_ids)), dtype='int32')
+        if wanted.size == 0:
+            return np.empty(0, dtype='int64')
+        dead = self._dead_ids()
+        parts = []
+        for segment in self._segments:
+            ids = np.asarray(segment.ids)[np.isin(segment.file_ids, wanted)]
+            if dead.shape[0]:
+                ids = ids[~np.isin(ids, dead)]
+            parts.append(ids)
+        wanted_set = set(wanted.tolist())
+        added_ids = [chunk_id for chunk_id, (file_id, _, _) in self._added.items() if file_id in wanted_set]
+        if added_ids:
+            parts.append(np.asarray(added_ids, dtype='int64'))
+        if not parts:
+            return np.empty(0, dtype='int64')
+        result = np.concatenate(parts).astype('int64', copy=False)
+        result.sort()
+        return result
+
+    def ids_for_files(self, file_names: Iterable[str]) -> List[int]:
+        """Lấy tất cả chunk id thuộc các file (theo tên)."""
+        return self.ids_for_file_ids(self.file_ids_for_names(file_names)).tolist()
+
+    def copy(self) -> "ChunkStore":
+        """Bản sao để sửa độc lập: dùng chung các segment (chỉ đọc), sao chép overlay."""
+        store = ChunkStore()
+        self._copy_state(store)
+        store._file_names = dict(self._file_names)
+        return store
+
+    # ==================== MUTATION ====================
+
+    def add(self, rows: Iterable[Sequence]) -> None:
+        """Thêm các dòng (id, content, source, chunk_index, file_id) vào overlay."""
+        for row in rows:
+            chunk_id, content, source, chunk_index, file_id = (
+                int(row[0]), row[1] or '', row[2], int(row[3]), int(row[4])
+            )
+            self._file_names[file_id] = source
+            self._put(chunk_id, (file_id, chunk_index, content))
+
+    # ==================== PERSISTENCE ====================
+
+    def save(self, directory: str) -> "ChunkStore":
+        """Lưu store ra thư mục và trả về ChunkStore mới map từ đó; store hiện tại không đổi.
+
+        Chỉ overlay được ghi thành segment mới, các segment cũ được giữ nguyên
+        hoặc hard-link sang thư mục mới, nên chi phí tỷ lệ với phần thay đổi
+        (xem SegmentedStore._save_segments).
+        """
+        segment_names, _ = self._save_segments(directory)
+        store = ChunkStore.load(directory, self._mmap)
+        logger.info(
+            f"Saved chunk store with {len(store)} chunks to {directory} "
+            f"(+{len(self._added)} -{len(self._removed)}, {len(segment_names)} segments)"
+        )
+        return store
+
+    def _before_state(self, directory: str, segment_names: List[str], compacted: bool) -> None:
+        """Ghi files.json; sau khi gộp segment chỉ giữ các file còn chunk."""
+        file_names = self._file_names
+        if compacted:
+            live_file_ids = self._live_file_ids(directory, segment_names)
+            file_names = {file_id: source for file_id, source in file_names.items() if file_id in live_file_ids}
+        write_json(os.path.join(directory, self._FILES_FILE), {str(k): v for k, v in file_names.items()})
+
+    @staticmethod
+    def _live_file_ids(directory: str, segment_names: List[str]) -> Set[int]:
+        """Các file_id còn được dùng trong các segment vừa ghi."""
+        file_ids: Set[int] = set()
+        for name in segment_names:
+            column = np.load(os.path.join(directory, f"{name}.file_ids.npy"), mmap_mode='r')
+            file_ids.update(int(file_id) for file_id in np.unique(column))
+        return file_ids
+
+    @staticmethod
+    def _write_segment(
+        directory: str,
+        name: str,
+        segments: List[_ChunkSegment],
+        dead: np.ndarray,
+        added: Dict[int, Tuple[int, int, str]]
+    ) -> int:
+        """Ghi một segment mới từ các dòng còn sống của segments cũ và overlay, trả về số dòng.
+
+        Nội dung của các dòng liền nhau trong texts cũ được copy theo từng đoạn
+        (run) nên số lần ghi tỷ lệ với số chỗ bị xóa, không phải số dòng.
+        """
+        prefix = os.path.join(directory, name)
+        ids_parts, file_id_parts, chunk_index_parts, span_parts = [], [], [], []
+        written = 0
+
+        with open(f"{prefix}.texts.bin", 'wb') as f:
+            for segment in segments:
+                keep = np.arange(len(segment))
+                if dead.shape[0]:
+                    keep = keep[~np.isin(segment.ids, dead)]
+                if keep.shape[0] == 0:
+                    continue
+
+                spans = np.asarray(segment.spans)[keep]
+                order = np.argsort(spans[:, 0], kind='stable')
+                starts, ends = spans[order, 0], spans[order, 1]
+                breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+                run_first = np.concatenate([[0], breaks])
+                run_last = np.concatenate([breaks, [starts.shape[0]]]) - 1
+                run_starts, run_ends = starts[run_first], ends[run_last]
+                run_lengths = run_ends - run_starts
+                run_out = written + np.concatenate([[0], np.cumsum(run_lengths)[:-1]])
+
+                for run_start, run_end in zip(run_starts.tolist(), run_ends.tolist()):
+                    f.write(np.ascontiguousarray(segment.texts[run_start:run_end]).tobytes())
+
+                row_run = np.repeat(np.arange(run_first.shape[0]), run_last - run_first + 1)
+                new_starts = run_out[row_run] + (starts - run_starts[row_run])
+                new_spans = np.empty((keep.shape[0], 2), dtype='int64')
+                new_spans[order, 0] = new_starts
+                new_spans[order, 1] = new_starts + (ends - starts)
+                written += int(run_lengths.sum())
+
+                ids_parts.append(np.asarray(segment.ids)[keep])
+                file_id_parts.append(np.asarray(segment.file_ids)[keep])
+                chunk_index_parts.append(np.asarray(segment.chunk_indices)[keep])
+                span_parts.append(new_spans)
+
+            if added:
+                added_ids = sorted(added)
+                added_spans = np.empty((len(added_ids), 2), dtype='int64')
+                added_file_ids = np.empty(len(added_ids), dtype='int32')
+                added_chunk_indices = np.empty(len(added_ids), dtype='int32')
+                for i, chunk_id in enumerate(added_ids):
+                    file_id, chunk_index, content = added[chunk_id]
+                    encoded = content.encode('utf-8')
+                    f.write(encoded)
+                    added_spans[i] = (written, written + len(encoded))
+                    added_file_ids[i] = file_id
+                    added_chunk_indices[i] = chunk_index
+                    written += len(encoded)
+                ids_parts.append(np.asarray(added_ids, dtype='int64'))
+                file_id_parts.append(added_file_ids)
+                chunk_index_parts.append(added_chunk_indices)
+                span_parts.append(added_spans)
+
+        if not ids_parts:
+            os.remove(f"{prefix}.texts.bin")
+            return 0
+
+        ids = np.concatenate(ids_parts)
+        order = np.argsort(ids, kind='stable')
+        write_array(f"{prefix}.ids.npy", ids[order])
+        write_array(f"{prefix}.file_ids.npy", np.concatenate(file_id_parts)[order])
+        write_array(f"{prefix}.chunk_indices.npy", np.concatenate(chunk_index_parts)[order])
+        write_array(f"{prefix}.spans.npy", np.concatenate(span_parts)[order])
+        return int(ids.shape[0])
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Ước lượng bộ nhớ: phần map từ đĩa (page cache dùng chung) và overlay riêng của process."""
+        mapped = self.mapped_bytes()
+        overlay = sum(
+            sys.getsizeof(content) + 64 for _, _, content in self._added.values()
+        ) + len(self._removed) * 32
+        return {"mapped_bytes": mapped, "overlay_bytes": overlay}
+
+
+
+class ChunkStoreWriter:
+    """Ghi ChunkStore thẳng ra đĩa theo từng trang dòng, dùng khi rebuild toàn bộ.
+
+    Các dòng phải tới theo chunk id tăng dần và được ghi thành một segment duy
+    nhất (cùng định dạng với ChunkStore.save). Nội dung được ghi ngay vào
+    texts.bin nên chỉ các cột số nguyên (vài byte mỗi chunk) nằm trong bộ nhớ,
+    không phải toàn bộ văn bản của corpus.
+    """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._prefix = os.path.join(directory, segment_name(1))
+        self._texts = open(f"{self._prefix}.texts.bin", 'wb')
+        self._ids = array('q')
+        self._file_ids = array('i')
+        self._chunk_indices = array('i')
+        self._lengths = array('q')
+        self._file_names: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def append(self, rows: Iterable[Sequence]) -> None:
+        """Ghi các dòng (id, content, source, chunk_index, file_id)."""
+        for row in rows:
+            chunk_id = int(row[0])
+            if self._ids and chunk_id <= self._ids[-1]:
+                raise ValueError(f"Chunk ids must be increasing, got {chunk_id} after {self._ids[-1]}")
+            encoded = (row[1] or '').encode('utf-8')
+            self._texts.write(encoded)
+            file_id = int(row[4])
+            self._file_names[file_id] = row[2]
+            self._ids.append(chunk_id)
+            self._file_ids.append(file_id)
+            self._chunk_indices.append(int(row[3]))
+            self._lengths.append(len(encoded))
+
+    def close(self) -> ChunkStore:
+        """Ghi các cột và segments.json rồi trả về ChunkStore map từ thư mục vừa ghi."""
+        self._texts.close()
+        segment_names = []
+        if self._ids:
+            ends = np.cumsum(np.frombuffer(self._lengths, dtype='int64'))
+            spans = np.empty((ends.shape[0], 2), dtype='int64')
+            spans[:, 1] = ends
+            spans[0, 0] = 0
+            spans[1:, 0] = ends[:-1]
+            write_array(f"{self._prefix}.ids.npy", np.frombuffer(self._ids, dtype='int64'))
+            write_array(f"{self._prefix}.file_ids.npy", np.frombuffer(self._file_ids, dtype='int32'))
+            write_array(f"{self._prefix}.chunk_indices.npy", np.frombuffer(self._chunk_indices, dtype='int32'))
+            write_array(f"{self._prefix}.spans.npy", spans)
+            segment_names.append(segment_name(1))
+        else:
+            os.remove(f"{self._prefix}.texts.bin")
+
+        write_json(
+            os.path.join(self.directory, ChunkStore._FILES_FILE),
+            {str(k): v for k, v in self._file_names.items()}
+        )
+        write_state(self.directory, segment_names, None, 2)
+        logger.info(f"Wrote chunk store with {len(self._ids)} chunks to {self.directory}")
+        return ChunkStore.load(self.directory)
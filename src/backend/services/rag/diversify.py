@@ -0,0 +1,101 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Chuẩn hóa L2 từng dòng (dòng 0 giữ nguyên) để tích vô hướng là cosine."""
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(
+    query_vector: np.ndarray,
+    candidate_vectors: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.7,
+    relevance: Optional[np.ndarray] = None
+) -> List[int]:
+    """Chọn k ứng viên theo maximal marginal relevance, trả về chỉ số theo thứ tự chọn.
+
+    Điểm MMR = lambda * sim(query, d) - (1 - lambda) * max sim(d, đã chọn), dùng cosine.
+    relevance (nếu có, ví dụ điểm reranker trong [0, 1]) thay cho sim(query, d).
+    Ma trận tương đồng giữa các ứng viên được tính một lần; mỗi bước chọn chỉ cập nhật
+    vector "tương đồng lớn nhất với tập đã chọn" bằng một phép maximum.
+    """
+    num_candidates = candidate_vectors.shape[0]
+    k = min(k, num_candidates)
+    if k <= 0:
+        return []
+
+    candidates = _normalize(candidate_vectors)
+    if relevance is None:
+        relevance = candidates @ _normalize(query_vector.reshape(-1))
+    relevance = np.asarray(relevance, dtype='float32')
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(num_candidates, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+def _overlap_length(previous: str, following: str, max_overlap: int) -> int:
+    """Độ dài phần cuối của previous trùng với phần đầu của following (tối đa max_overlap ký tự)."""
+    for length in range(min(max_overlap, len(previous), len(following)), 0, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+def merge_adjacent_hits(hits: List[Dict[str, Any]], max_overlap: int) -> List[Dict[str, Any]]:
+    """Gộp các chunk liền kề (cùng source, chunk_index liên tiếp) thành một đoạn, bỏ phần chồng lấn.
+
+    Các hit được sắp theo (source, chunk_index) rồi gộp theo từng dãy liên tiếp,
+    nên thứ tự đầu vào không ảnh hưởng cách gộp. Thứ tự đầu ra theo hit tốt nhất
+    của mỗi đoạn (thứ tự của hits đầu vào); đoạn gộp giữ score tốt nhất và danh
+    sách chunk_ids đã gộp.
+    """
+    def position_key(rank: int) -> tuple:
+        return hits[rank].get("source", ""), int(hits[rank].get("chunk_index", 0))
+
+    runs: List[List[int]] = []
+    for rank in sorted(range(len(hits)), key=lambda rank: (position_key(rank), rank)):
+        source, chunk_index = position_key(rank)
+        if runs:
+            previous_source, previous_index = position_key(runs[-1][-1])
+            if previous_source == source and chunk_index - previous_index <= 1:
+                if chunk_index != previous_index:
+                    runs[-1].append(rank)
+                continue
+        runs.append([rank])
+
+    merged = []
+    for run in sorted(runs, key=min):
+        if len(run) == 1:
+            merged.append(hits[run[0]])
+            continue
+        ordered = [hits[rank] for rank in run]
+        best = hits[min(run)]
+        content = ordered[0]["content"]
+        for hit in ordered[1:]:
+            content += hit["content"][_overlap_length(content, hit["content"], max_overlap):]
+        merged.append({
+            **best,
+            "content": content,
+            "chunk_index": int(ordered[0].get("chunk_index", 0)),
+            "chunk_ids": [hit["chunk_id"] for hit in ordered],
+        })
+    return merged
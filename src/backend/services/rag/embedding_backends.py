@@ -0,0 +1,208 @@
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TORCH_BACKEND = "torch"
+ONNX_INT8_BACKEND = "onnx_int8"
+
+# Câu mẫu dùng để so sánh vector của backend với PyTorch
+AGREEMENT_SAMPLE_TEXTS = [
+    "Hướng dẫn cài đặt và cấu hình hệ thống.",
+    "Tài liệu này mô tả quy trình xử lý dữ liệu khách hàng.",
+    "Kết quả kinh doanh quý ba tăng trưởng so với cùng kỳ năm trước.",
+    "The quick brown fox jumps over the lazy dog.",
+    "FAISS is a library for efficient similarity search of dense vectors.",
+    "Please upload a PDF or DOCX file to add it to the knowledge base.",
+    "def add(a, b):\n    return a + b",
+    "Câu hỏi thường gặp về chính sách bảo mật và quyền riêng tư.",
+]
+
+
+def resolve_hub_model_id(model_name: str) -> str:
+    """Chuyển tên model rút gọn (all-MiniLM-L6-v2) thành id đầy đủ trên Hugging Face Hub."""
+    if "/" in model_name or os.path.isdir(model_name):
+        return model_name
+    return f"sentence-transformers/{model_name}"
+
+
+class TorchEmbeddingBackend:
+    """Backend mặc định: SentenceTransformer fp32 trên PyTorch."""
+
+    name = TORCH_BACKEND
+
+    def __init__(self, model_name: str, model: Optional[Any] = None) -> None:
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = model if model is not None else SentenceTransformer(model_name)
+        self.agreement: Optional[Dict[str, Any]] = None
+
+    @property
+    def cache_namespace(self) -> str:
+        """Tên dùng làm khóa cache embedding (giữ nguyên tên model để dùng lại cache cũ)."""
+        return self.model_name
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """Số chiều của vector embedding."""
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        """Encode danh sách văn bản thành ma trận float32."""
+        return np.asarray(
+            self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar),
+            dtype='float32'
+        )
+
+    def memory_bytes(self) -> int:
+        """Số byte tham số của model."""
+        return sum(param.numel() * param.element_size() for param in self.model.parameters())
+
+
+class OnnxInt8EmbeddingBackend:
+    """Chạy cùng model qua ONNX Runtime với dynamic int8 quantization (chỉ CPU).
+
+    Lần đầu model được export sang ONNX và quantize vào export_dir, các lần sau
+    chỉ load file đã quantize. Pooling là mean pooling theo attention mask và
+    chuẩn hóa L2, giống pipeline của all-MiniLM-L6-v2.
+    """
+
+    name = ONNX_INT8_BACKEND
+    QUANTIZED_FILE_NAME = "model_quantized.onnx"
+
+    def __init__(
+        self,
+        model_name: str,
+        export_dir: str = "onnx_models",
+        num_threads: int = 1,
+        max_seq_length: int = 256,
+        normalize: bool = True
+    ) -> None:
+        try:
+            import onnxruntime as ort
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "ONNX embedding backend requires 'optimum[onnxruntime]' and 'transformers'"
+            ) from e
+
+        self.model_name = model_name
+        self.max_seq_length = max_seq_length
+        self.normalize = normalize
+        self.agreement: Optional[Dict[str, Any]] = None
+        self.model_dir = os.path.join(export_dir, model_name.replace("/", "__") + "-int8")
+
+        if not os.path.exists(os.path.join(self.model_dir, self.QUANTIZED_FILE_NAME)):
+            self._export_quantized(resolve_hub_model_id(model_name))
+
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = max(1, num_threads)
+        session_options.inter_op_num_threads = 1
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            self.model_dir,
+            file_name=self.QUANTIZED_FILE_NAME,
+            session_options=session_options,
+            provider="CPUExecutionProvider"
+        )
+        self._dimension = int(self.model.config.hidden_size)
+        logger.info(f"Loaded int8 ONNX embedding model from {self.model_dir}")
+
+    def _export_quantized(self, hub_model_id: str) -> None:
+        """Export model sang ONNX rồi quantize int8 động, lưu vào model_dir."""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+
+        logger.info(f"Exporting {hub_model_id} to ONNX with dynamic int8 quantization...")
+        export_dir = self.model_dir + ".fp32"
+        ORTModelForFeatureExtraction.from_pretrained(hub_model_id, export=True).save_pretrained(export_dir)
+        AutoTokenizer.from_pretrained(hub_model_id).save_pretrained(self.model_dir)
+
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        quantization_config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=self.model_dir, quantization_config=quantization_config)
+        logger.info(f"Saved quantized ONNX model to {self.model_dir}")
+
+    @property
+    def cache_namespace(self) -> str:
+        """Vector int8 khác PyTorch nên cache embedding dùng namespace riêng."""
+        return f"{self.model_name}#{self.name}"
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """Số chiều của vector embedding."""
+        return self._dimension
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Tokenize, chạy ONNX và mean pooling cho một batch."""
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np"
+        )
+        outputs = self.model(**inputs)
+        token_embeddings = np.asarray(outputs.last_hidden_state, dtype='float32')
+        mask = inputs["attention_mask"][..., None].astype('float32')
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        """Encode danh sách văn bản thành ma trận float32."""
+        if not texts:
+            return np.empty((0, self._dimension), dtype='float32')
+        return np.vstack([
+            self._encode_batch(texts[start:start + batch_size])
+            for start in range(0, len(texts), batch_size)
+        ])
+
+    def memory_bytes(self) -> int:
+        """Kích thước file model int8 (xấp xỉ bộ nhớ trọng số)."""
+        model_path = os.path.join(self.model_dir, self.QUANTIZED_FILE_NAME)
+        return os.path.getsize(model_path) if os.path.exists(model_path) else 0
+
+
+def create_embedding_backend(
+    backend: str,
+    model_name: str,
+    onnx_dir: str = "onnx_models",
+    num_threads: int = 1
+) -> Any:
+    """Tạo embedding backend theo tên cấu hình (torch hoặc onnx_int8)."""
+    if backend == ONNX_INT8_BACKEND:
+        return OnnxInt8EmbeddingBackend(model_name, export_dir=onnx_dir, num_threads=num_threads)
+    if backend != TORCH_BACKEND:
+        logger.warning(f"Unknown embedding backend '{backend}', using {TORCH_BACKEND}")
+    return TorchEmbeddingBackend(model_name)
+
+
+def check_backend_agreement(
+    backend: Any,
+    reference: Any,
+    threshold: float,
+    texts: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """So sánh cosine giữa vector của backend và của backend tham chiếu (PyTorch)."""
+    texts = texts or AGREEMENT_SAMPLE_TEXTS
+    candidate = np.asarray(backend.encode(texts), dtype='float32')
+    expected = np.asarray(reference.encode(texts), dtype='float32')
+
+    candidate /= np.clip(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12, None)
+    expected /= np.clip(np.linalg.norm(expected, axis=1, keepdims=True), 1e-12, None)
+    cosines = (candidate * expected).sum(axis=1)
+
+    return {
+        "reference": reference.name,
+        "threshold": threshold,
+        "num_samples": len(texts),
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "passed": bool(cosines.min() >= threshold),
+    }
@@ -0,0 +1,322 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Lưu embedding trên đĩa (SQLite BLOB) theo hash của (tên model, nội dung văn bản).
+
+    Chỉ dùng cho embedding của corpus. Mỗi thread giữ một connection riêng, số
+    dòng bị giới hạn bởi max_rows và các dòng lâu không dùng nhất bị xóa trước.
+    """
+
+    _QUERY_BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        db_path: str = "embedding_cache.db",
+        model_name: str = "all-MiniLM-L6-v2",
+        max_rows: int = 0
+    ) -> None:
+        self.db_path = db_path
+        self.model_name = model_name
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.init_db()
+        self._approx_rows = self._count_rows()
+
+    @contextmanager
+    def get_connection(self):
+        """Context manager trả về connection riêng của thread hiện tại (tạo một lần rồi dùng lại)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            self._local.conn = conn
+        yield conn
+
+    def close(self) -> None:
+        """Đóng connection của thread hiện tại."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def init_db(self) -> None:
+        """Khởi tạo bảng lưu embedding nếu chưa tồn tại."""
+        with self._lock:
+            with self.get_connection() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS embeddings (
+                        key TEXT PRIMARY KEY,
+                        dim INTEGER NOT NULL,
+                        vector BLOB NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                ''')
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+                conn.commit()
+
+    def _count_rows(self) -> int:
+        """Đếm số dòng hiện có trong cache."""
+        with self.get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def make_key(self, text: str) -> str:
+        """Tạo khóa cache từ tên model và nội dung văn bản."""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def record(self, hits: int, misses: int) -> None:
+        """Cộng dồn số lần hit/miss (được gọi từ nhiều thread)."""
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Lấy các embedding đã có trong cache theo danh sách khóa và đánh dấu vừa được dùng."""
+        found = {}
+        if not keys:
+            return found
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(keys), self._QUERY_BATCH_SIZE):
+                batch = keys[i:i + self._QUERY_BATCH_SIZE]
+                placeholders = ",".join("?" for _ in batch)
+                cursor.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                )
+                for key, blob in cursor.fetchall():
+                    found[key] = np.frombuffer(blob, dtype='float32')
+
+            if found and self.max_rows > 0:
+                now = time.time()
+                with self._lock:
+                    conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                        [(now, key) for key in found]
+                    )
+                    conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        """Lưu các embedding mới vào cache, xóa bớt dòng cũ nếu vượt max_rows."""
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, int(vector.shape[-1]), np.ascontiguousarray(vector, dtype='float32').tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            with self.get_connection() as conn:
+                cursor = conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._approx_rows += max(cursor.rowcount, 0)
+                if self.max_rows > 0 and self._approx_rows > self.max_rows:
+                    self._evict(conn)
+                conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Xóa các dòng lâu không dùng nhất để số dòng trở về max_rows."""
+        # Đếm lại vì process khác có thể đã ghi hoặc xóa bớt
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_rows
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            self.evictions += excess
+            count = self.max_rows
+            logger.info(f"Evicted {excess} least recently used embeddings from cache")
+        self._approx_rows = count
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê về cache embedding."""
+        count = self._count_rows()
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "db_path": self.db_path,
+            "model_name": self.model_name,
+            "entries": count,
+            "max_rows": self.max_rows,
+            "evictions": self.evictions,
+            "size_bytes": os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+class QueryEmbeddingCache:
+    """LRU trong bộ nhớ cho embedding của câu truy vấn, giới hạn theo số câu."""
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Lấy embedding của câu truy vấn nếu còn trong cache."""
+        with self._lock:
+            vector = self._entries.get(text)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(text)
+            self.hits += 1
+            return vector
+
+    def put(self, text: str, vector: np.ndarray) -> None:
+        """Lưu embedding của câu truy vấn, bỏ câu lâu không dùng nhất khi đầy."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[text] = vector
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê về cache truy vấn."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class CachedEmbedder:
+    """Encode văn bản qua cache, chỉ gọi model cho các văn bản chưa từng encode.
+
+    Corpus đi qua EmbeddingCache trên đĩa; câu truy vấn chỉ đi qua
+    QueryEmbeddingCache trong bộ nhớ để không ghi đĩa trên đường truy vấn.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 32,
+        query_cache: Optional[QueryEmbeddingCache] = None
+    ) -> None:
+        self.model = model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.query_cache = query_cache
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """Số chiều của vector embedding."""
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode_uncached(
+        self,
+        texts: List[str],
+        encode_fn: Optional[Callable[[List[str]], np.ndarray]] = None
+    ) -> np.ndarray:
+        """Gọi model (hoặc encode_fn nếu có) để encode và làm sạch các giá trị NaN/inf."""
+        if encode_fn is not None:
+            embeddings = np.asarray(encode_fn(texts), dtype='float32')
+        else:
+            embeddings = np.array(
+                self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=False),
+                dtype='float32'
+            )
+        if np.any(np.isnan(embeddings)) or np.any(np.isinf(embeddings)):
+            logger.warning("Found invalid embeddings, cleaning...")
+            embeddings = np.nan_to_num(embeddings, nan=0.0, posinf=0.0, neginf=0.0)
+        return embeddings
+
+    def encode_queries(self, texts: List[str]) -> np.ndarray:
+        """Encode câu truy vấn, dùng lại embedding trong LRU bộ nhớ nếu có."""
+        if self.query_cache is None:
+            return self._encode_uncached(texts)
+
+        dim = self.get_sentence_embedding_dimension()
+        result = np.empty((len(texts), dim), dtype='float32')
+        missing_positions: Dict[str, List[int]] = {}
+        for position, text in enumerate(texts):
+            vector = self.query_cache.get(text)
+            if vector is not None:
+                result[position] = vector
+            else:
+                missing_positions.setdefault(text, []).append(position)
+
+        if missing_positions:
+            missing_texts = list(missing_positions.keys())
+            embeddings = self._encode_uncached(missing_texts)
+            for text, vector in zip(missing_texts, embeddings):
+                result[missing_positions[text]] = vector
+                self.query_cache.put(text, vector.copy())
+
+        return result
+
+    def encode(
+        self,
+        texts: List[str],
+        encode_fn: Optional[Callable[[List[str]], np.ndarray]] = None
+    ) -> np.ndarray:
+        """Encode danh sách văn bản của corpus thành ma trận float32, dùng lại embedding đã cache.
+
+        encode_fn cho phép thay model mặc định (ví dụ pool nhiều process khi rebuild)
+        cho các văn bản chưa có trong cache.
+        """
+        if self.cache is None:
+            return self._encode_uncached(texts, encode_fn)
+
+        dim = self.get_sentence_embedding_dimension()
+        result = np.empty((len(texts), dim), dtype='float32')
+        if not texts:
+            return result
+
+        keys = [self.cache.make_key(text) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+
+        missing_positions: Dict[str, List[int]] = {}
+        for position, key in enumerate(keys):
+            vector = cached.get(key)
+            if vector is not None and vector.shape[0] == dim:
+                result[position] = vector
+            else:
+                missing_positions.setdefault(key, []).append(position)
+
+        num_missing = sum(len(positions) for positions in missing_positions.values())
+        self.cache.record(len(texts) - num_missing, num_missing)
+
+        if missing_positions:
+            missing_keys = list(missing_positions.keys())
+            missing_texts = [texts[missing_positions[key][0]] for key in missing_keys]
+            embeddings = self._encode_uncached(missing_texts, encode_fn)
+
+            for key, vector in zip(missing_keys, embeddings):
+                result[missing_positions[key]] = vector
+            self.cache.put_many(dict(zip(missing_keys, embeddings)))
+
+        return result
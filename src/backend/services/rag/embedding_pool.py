@@ -0,0 +1,116 @@
+import os
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Model riêng của mỗi worker process, được load trong _init_worker
+_worker_model: Optional[Any] = None
+
+
+def _init_worker(model_name: str, num_threads: int, backend: str, onnx_dir: str) -> None:
+    """Khởi tạo worker: giới hạn số thread và load một bản model riêng cùng backend."""
+    global _worker_model
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+
+    import torch
+    from services.rag.embedding_backends import create_embedding_backend
+
+    torch.set_num_threads(max(1, num_threads))
+    _worker_model = create_embedding_backend(backend, model_name, onnx_dir, num_threads)
+
+
+def _encode_shard(texts: List[str]) -> np.ndarray:
+    """Encode một shard văn bản trong worker process."""
+    embeddings = np.asarray(_worker_model.encode(texts, show_progress_bar=False), dtype='float32')
+    if np.any(np.isnan(embeddings)) or np.any(np.isinf(embeddings)):
+        embeddings = np.nan_to_num(embeddings, nan=0.0, posinf=0.0, neginf=0.0)
+    return embeddings
+
+
+class EmbeddingProcessPool:
+    """Pool nhiều process, mỗi process một bản model, dùng cho rebuild toàn bộ index.
+
+    config/torch_config.py giới hạn torch ở 1 thread trong process chính; pool này
+    chia văn bản thành các shard và encode song song trên nhiều core, trả kết quả
+    theo đúng thứ tự đầu vào.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        num_workers: int,
+        threads_per_worker: int = 1,
+        shard_size: int = 256,
+        backend: str = "torch",
+        onnx_dir: str = "onnx_models"
+    ) -> None:
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.shard_size = max(1, shard_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> "EmbeddingProcessPool":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """Khởi động các worker process (spawn để tránh fork trạng thái torch)."""
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.model_name, self.threads_per_worker, self.backend, self.onnx_dir)
+        )
+        logger.info(
+            f"Started {self.backend} embedding pool with {self.num_workers} workers x "
+            f"{self.threads_per_worker} threads"
+        )
+
+    def encode_stream(self, texts: List[str]) -> Iterator[np.ndarray]:
+        """Encode theo shard, trả từng shard theo thứ tự đầu vào ngay khi sẵn sàng.
+
+        Số shard đang xử lý được giới hạn để không giữ toàn bộ corpus trong hàng đợi.
+        """
+        if self._executor is None:
+            self.start()
+
+        max_in_flight = self.num_workers * 2
+        pending = deque()
+        for start in range(0, len(texts), self.shard_size):
+            pending.append(self._executor.submit(_encode_shard, texts[start:start + self.shard_size]))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode toàn bộ danh sách văn bản song song, giữ nguyên thứ tự."""
+        shards = list(self.encode_stream(texts))
+        if not shards:
+            return np.empty((0, 0), dtype='float32')
+        return np.vstack(shards)
+
+    @property
+    def preferred_batch_size(self) -> int:
+        """Kích thước batch đủ lớn để mọi worker đều có việc."""
+        return self.shard_size * self.num_workers * 2
+
+    def close(self) -> None:
+        """Dừng các worker process."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
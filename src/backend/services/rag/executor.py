@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+from config.app_config import AppConfig
+
+config = AppConfig()
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceExecutor:
+    """Thread pool riêng cho các tác vụ CPU (encode, FAISS search/add) ngoài event loop.
+
+    model.encode và các thao tác FAISS nhả GIL trong phần tính toán nặng, nên chạy
+    chúng trên thread pool giữ cho event loop của FastAPI luôn phản hồi.
+    """
+
+    def __init__(self, max_workers: int = 4) -> None:
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._active = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Tạo thread pool ở lần dùng đầu tiên (hoặc sau khi shutdown)."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="inference"
+                    )
+                    logger.info(f"Started inference executor with {self.max_workers} workers")
+        return self._executor
+
+    def _tracked(self, fn: Callable[..., Any]) -> Any:
+        """Chạy hàm và cập nhật số tác vụ đang chạy."""
+        with self._lock:
+            self._active += 1
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Chạy hàm đồng bộ trên inference executor và chờ kết quả.
+
+        Hàm chạy trong bản sao context của coroutine gọi nên span tracing mở trong
+        thread vẫn là con của span hiện tại.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._submitted += 1
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._get_executor(),
+            partial(context.run, self._tracked, partial(fn, *args, **kwargs))
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê về inference executor."""
+        return {
+            "max_workers": self.max_workers,
+            "running": self._executor is not None,
+            "submitted": self._submitted,
+            "active": self._active,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Dừng thread pool; lần gọi run() tiếp theo sẽ tạo lại."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+inference_executor = InferenceExecutor(config.INFERENCE_WORKERS)
+
+
+async def run_inference(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Chạy tác vụ encode/search/add trên inference executor dùng chung."""
+    return await inference_executor.run(fn, *args, **kwargs)
@@ -0,0 +1,39 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class SearchFilter:
+    """Bộ lọc truy vấn theo metadata của file: tên file, file id và khoảng thời gian upload.
+
+    Các điều kiện được kết hợp bằng AND; bộ lọc rỗng nghĩa là tìm trên toàn bộ index.
+    """
+
+    def __init__(
+        self,
+        file_names: Optional[List[str]] = None,
+        file_ids: Optional[List[int]] = None,
+        uploaded_after: Optional[datetime] = None,
+        uploaded_before: Optional[datetime] = None
+    ) -> None:
+        self.file_names = list(file_names) if file_names else None
+        self.file_ids = [int(file_id) for file_id in file_ids] if file_ids else None
+        self.uploaded_after = uploaded_after
+        self.uploaded_before = uploaded_before
+
+    def is_empty(self) -> bool:
+        """Không có điều kiện lọc nào."""
+        return (
+            self.file_names is None
+            and self.file_ids is None
+            and self.uploaded_after is None
+            and self.uploaded_before is None
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Biểu diễn bộ lọc để ghi log hoặc trả về trong response."""
+        return {
+            "file_names": self.file_names,
+            "file_ids": self.file_ids,
+            "uploaded_after": self.uploaded_after.isoformat() if self.uploaded_after else None,
+            "uploaded_before": self.uploaded_before.isoformat() if self.uploaded_before else None,
+        }
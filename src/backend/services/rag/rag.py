@@ -3,14 +3,28 @@ import time
 import logging
 import asyncio
 import sys
-from typing import List, Dict, Tuple, Optional, Set, Any
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Dict, Tuple, Optional, Set, Any
 from pathlib import Path
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
 from services.vector_db import VectorDBService
+from services.rag.embedding_cache import EmbeddingCache, QueryEmbeddingCache, CachedEmbedder
+from services.rag.chunk_store import ChunkStore, ChunkStoreWriter
+from services.rag.vector_store import VectorStore, VectorStoreWriter
+from services.rag.batching import MicroBatchEmbedder
+from services.rag.executor import inference_executor, run_inference
+from services.rag.embedding_pool import EmbeddingProcessPool
+from services.rag.embedding_backends import TORCH_BACKEND, create_embedding_backend
+from services.rag.snapshot import IndexSnapshot
+from services.rag.build_pipeline import BuildTimings, EncodedCorpus
+from services.rag.filters import SearchFilter
+from services.rag.diversify import merge_adjacent_hits, mmr_select
+from services.rag.reranker import get_reranker
 from models.llm import LLM
 
 from config.torch_config import device, suppress_pytorch_warnings
@@ -19,10 +33,20 @@ from utils.rag_file_utils import (
     get_uploaded_files_info, process_file_changes
 )
 from utils.faiss_utils import (
-    create_new_index, create_optimized_index, save_index_to_disk, 
-    load_index_and_mapping, optimize_search_params, get_index_info
+    COMPRESSION_NONE, evaluate_compression, load_vector_store, reconstruct_vectors, rerank_exact,
+    create_new_index, create_optimized_index, faiss_threads, save_index_to_disk, training_sample_size,
+    load_index_and_mapping, load_index_metadata, mapping_exists, optimize_search_params, get_index_info,
+    read_generation_index, load_index_generation, clone_index, get_index_ids,
+    get_index_tier, is_id_mapped, remove_ids_from_index, count_deleted_vectors, exclude_deleted, search_subset
 )
+from utils.index_manifest import (
+    GenerationConflictError, generation_dir, manifest_signature, read_manifest
+)
+from utils.collection_utils import DEFAULT_COLLECTION
+from utils.sharded_index import ShardedIndex, assign_shards
+from utils.search_tuner import apply_search_params, exact_knn, get_search_param_name, tune_search_params
 from utils.rag_utils import calculate_relevance, process_web_search_results, process_chunk_batch
+from utils.tracing import span, traced
 from config.app_config import AppConfig
 
 config = AppConfig()
@@ -39,19 +63,80 @@ logger = logging.getLogger(__name__)
 
 class RAGService:
     
-    def __init__(self, upload_dir: str = "upload") -> None:
-        """Initialize RAGService with required components."""
+    def __init__(
+        self,
+        upload_dir: str = "upload",
+        model: Optional[Any] = None,
+        collection_id: str = DEFAULT_COLLECTION
+    ) -> None:
+        """Initialize RAGService with required components.
+
+        Dùng services.rag.registry.get_rag_service() (hoặc get_collection_service()
+        cho collection khác mặc định) thay vì khởi tạo trực tiếp.
+        """
+        self.collection_id = collection_id
         self.upload_dir = upload_dir
         os.makedirs(self.upload_dir, exist_ok=True)
         self.vector_db = VectorDBService()
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = model if model is not None else create_embedding_backend(
+            config.EMBEDDING_BACKEND, config.EMBEDDING_MODEL, config.EMBEDDING_ONNX_DIR, config.EMBEDDING_ONNX_THREADS
+        )
+        self.embedding_backend = getattr(self.model, 'name', TORCH_BACKEND)
+        embedding_cache = (
+            EmbeddingCache(
+                config.EMBEDDING_CACHE_PATH,
+                getattr(self.model, 'cache_namespace', config.EMBEDDING_MODEL),
+                config.EMBEDDING_CACHE_MAX_ROWS
+            )
+            if config.EMBEDDING_CACHE_ENABLED else None
+        )
+        query_cache = (
+            QueryEmbeddingCache(config.EMBEDDING_QUERY_CACHE_SIZE)
+            if config.EMBEDDING_QUERY_CACHE_SIZE > 0 else None
+        )
+        self.embedder = CachedEmbedder(self.model, embedding_cache, query_cache=query_cache)
+        self.query_embedder = MicroBatchEmbedder(
+            self._encode_queries,
+            max_batch_size=config.RAG_QUERY_BATCH_MAX_SIZE,
+            max_wait_ms=config.RAG_QUERY_BATCH_WINDOW_MS,
+            runner=run_inference
+        )
         self.llm = LLM()
-        self.chunk_id_mapping = []
-        self.index = None
+        self._snapshot = IndexSnapshot()
+        self._previous_snapshot: Optional[IndexSnapshot] = None
+        self._swap_lock = threading.Lock()
+        self._update_lock = asyncio.Lock()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._active_queries = 0
+        self._index_needs_rebuild = False
+        self._watch_task: Optional[asyncio.Task] = None
+        self._manifest_signature: Optional[Tuple[int, int, int]] = None
+        self._last_reload_at: Optional[float] = None
+        self._last_build: Optional[Dict[str, Any]] = None
         self.use_gpu = faiss.get_num_gpus() > 0
         self.optimal_batch_size = self._calculate_optimal_batch_size()
         self._initialize_service()
 
+    @property
+    def index(self) -> Optional[Any]:
+        """FAISS index của snapshot đang được publish."""
+        return self._snapshot.index
+
+    @property
+    def chunk_id_mapping(self) -> ChunkStore:
+        """Chunk mapping của snapshot đang được publish."""
+        return self._snapshot.chunk_store
+
+    @property
+    def vector_store(self) -> Optional[VectorStore]:
+        """Vector chính xác của snapshot đang được publish (None khi index không nén)."""
+        return self._snapshot.vector_store
+
+    @property
+    def index_metadata(self) -> Dict[str, Any]:
+        """Metadata của snapshot đang được publish."""
+        return self._snapshot.metadata
+
     def _calculate_optimal_batch_size(self) -> int:
         """Tính toán batch size tối ưu dựa trên memory và GPU availability."""
         try:
@@ -93,9 +178,9 @@ class RAGService:
     def _get_database_files_info(self) -> Tuple[Set[str], Dict[str, float]]:
         """Retrieve information about files stored in the database."""
         try:
-            db_files = self.vector_db.get_all_files()
+            db_files = self.vector_db.get_all_files(self.collection_id)
             db_file_names = {file[1] for file in db_files}
-            db_file_mtimes = self.vector_db.database_manager.get_file_modification_times()
+            db_file_mtimes = self.vector_db.database_manager.get_file_modification_times(self.collection_id)
             logger.debug(f"Retrieved info for {len(db_file_names)} files from database")
             return db_file_names, db_file_mtimes
         except Exception as e:
@@ -111,7 +196,7 @@ class RAGService:
             file_path = os.path.join(self.upload_dir, file_name)
             try:
                 start_time = time.time()
-                await self.vector_db.process_file(file_path)
+                await self.vector_db.process_file(file_path, self.collection_id)
                 process_time = time.time() - start_time
                 logger.info(f"Processed file {file_name} in {process_time:.2f}s")
             except FileNotFoundError:
@@ -128,7 +213,7 @@ class RAGService:
         logger.info(f"Starting processing of {len(deleted_files)} deleted files")
         for file_name in deleted_files:
             try:
-                self.vector_db.delete_file(file_name)
+                self.vector_db.delete_file(file_name, self.collection_id)
                 logger.info(f"Removed file {file_name} from database")
             except Exception as e:
                 logger.error(f"Error removing file {file_name}: {str(e)}")
@@ -142,6 +227,10 @@ class RAGService:
                 upload_info, db_file_names, db_file_mtimes
             )
             if not new_or_modified and not deleted:
+                if self._index_needs_rebuild:
+                    logger.info("Index format is outdated, rebuilding from database...")
+                    await self._rebuild_index_from_database()
+                    return True
                 logger.debug("No changes detected in upload directory")
                 return False
             
@@ -155,10 +244,9 @@ class RAGService:
                 await self._process_modified_files(new_or_modified)
                 files_changed = True
             
-            # Rebuild FAISS index nếu có thay đổi
+            # Chỉ cập nhật vector của các file thay đổi, rebuild khi cần đổi loại index
             if files_changed:
-                logger.info("Files changed, rebuilding optimized FAISS index...")
-                await self._rebuild_index_from_database()
+                await self.update_index_for_files(deleted + new_or_modified)
             
             logger.info("Successfully updated database and FAISS index")
             return True
@@ -169,28 +257,129 @@ class RAGService:
     def load_or_create_index(self) -> None:
         """Load or create a new FAISS index and chunk mapping."""
         try:
-            index_exists = os.path.exists(config.FAISS_INDEX_PATH)
-            mapping_exists = os.path.exists(config.CHUNK_MAPPING_PATH) or os.path.exists(config.CHUNK_MAPPING_PATH.replace('.npy', '.npz'))
+            manifest = read_manifest(self.collection_id)
+            if manifest is not None:
+                logger.info(
+                    f"Loading FAISS index generation {manifest['generation']} of collection "
+                    f"'{self.collection_id}' from disk..."
+                )
+                self._manifest_signature = manifest_signature(self.collection_id)
+                self._snapshot = self._load_generation_snapshot(manifest)
+                self._check_loaded_index()
+                return
+            
+            # File index phẳng (trước khi có generation) chỉ thuộc collection mặc định
+            index_exists = self.collection_id == DEFAULT_COLLECTION and os.path.exists(config.FAISS_INDEX_PATH)
             
-            if index_exists and mapping_exists:
+            if index_exists and mapping_exists():
                 logger.info("Loading FAISS index and chunk mapping from disk...")
-                self.index, self.chunk_id_mapping = load_index_and_mapping()
+                index, chunk_store, mmapped = load_index_and_mapping()
+                self._snapshot = IndexSnapshot(index, chunk_store, load_index_metadata(), mmapped)
                 logger.info(
                     f"Loaded index with {self.index.ntotal} vectors and "
                     f"{len(self.chunk_id_mapping)} chunk mappings"
                 )
-                
-                optimize_search_params(self.index)
+                self._check_loaded_index()
                 return
+            else:
+                logger.info("Index files not found or corrupted, creating new index...")
                 
-            logger.info("Index files not found or corrupted, creating new index...")
-            self.index = create_new_index(self.model.get_sentence_embedding_dimension(), 0, self.use_gpu)
-            self.chunk_id_mapping = []
-            save_index_to_disk(self.index, self.chunk_id_mapping)
+            index = self._create_empty_index()
+            try:
+                self._publish_snapshot(
+                    IndexSnapshot(
+                        index, ChunkStore(), self._build_index_metadata(index, 0), vector_store=self._new_vector_store()
+                    ),
+                    None
+                )
+            except GenerationConflictError:
+                # Worker khác vừa publish index đầu tiên: load generation đó
+                self.load_or_create_index()
         except Exception as e:
             logger.critical(f"Critical error initializing index: {str(e)}")
             raise
 
+    def _load_generation_snapshot(self, manifest: Dict[str, Any]) -> IndexSnapshot:
+        """Load generation mà manifest trỏ tới thành một snapshot."""
+        index, chunk_store, metadata, mmapped = load_index_generation(manifest)
+        vector_store = load_vector_store(manifest["directory"])
+        return IndexSnapshot(index, chunk_store, metadata, mmapped, manifest["generation"], vector_store)
+
+    def _check_loaded_index(self) -> None:
+        """Đánh dấu cần rebuild nếu index vừa load không dùng được, nếu không thì áp dụng tham số search."""
+        if not is_id_mapped(self.index):
+            logger.info("Index on disk is not keyed by chunk id, it will be rebuilt on next sync")
+            self._index_needs_rebuild = True
+        elif not self._embedding_matches_metadata():
+            logger.warning(
+                f"Index vectors were produced by {self.index_metadata.get('embedding_backend', TORCH_BACKEND)}/"
+                f"{self.index_metadata.get('embedding_model', config.EMBEDDING_MODEL)}, current backend is "
+                f"{self.embedding_backend}/{config.EMBEDDING_MODEL}; index will be rebuilt on next sync"
+            )
+            self._index_needs_rebuild = True
+        elif not self._compression_matches_snapshot(self._snapshot):
+            logger.info(
+                f"Index vectors are stored as {self.index_metadata.get('vector_compression', COMPRESSION_NONE)}, "
+                f"configured compression is {config.RAG_VECTOR_COMPRESSION}; index will be rebuilt on next sync"
+            )
+            self._index_needs_rebuild = True
+        else:
+            self._apply_search_params(self.index, self.index_metadata)
+
+    def _reload_from_manifest(self) -> bool:
+        """Chuyển sang generation mới hơn do worker khác publish; gọi khi đang giữ _update_lock.
+
+        Truy vấn đang chạy giữ tham chiếu tới snapshot cũ nên không bị gián đoạn.
+        """
+        manifest = read_manifest(self.collection_id)
+        current = self._snapshot.generation
+        if manifest is None or (current is not None and manifest["generation"] <= current):
+            return False
+        
+        snapshot = self._load_generation_snapshot(manifest)
+        if not is_id_mapped(snapshot.index) or not self._embedding_matches_metadata(snapshot.metadata):
+            logger.warning(
+                f"Index generation {manifest['generation']} is not compatible with this worker, keeping "
+                f"generation {current}"
+            )
+            return False
+        self._apply_search_params(snapshot.index, snapshot.metadata)
+        with self._swap_lock:
+            if self._snapshot.index is not None:
+                self._previous_snapshot = self._snapshot
+            self._snapshot = snapshot
+        self._last_reload_at = time.time()
+        logger.info(f"Worker {os.getpid()} reloaded index generation {snapshot.generation} ({snapshot.num_vectors} vectors)")
+        return True
+
+    async def reload_if_changed(self) -> bool:
+        """Hot reload index nếu manifest thay đổi; khi manifest không đổi chỉ tốn một lần stat."""
+        signature = manifest_signature(self.collection_id)
+        if signature is None or signature == self._manifest_signature:
+            return False
+        async with self._update_lock:
+            self._manifest_signature = signature
+            try:
+                return await run_inference(self._reload_from_manifest)
+            except Exception as e:
+                logger.error(f"Error reloading index from manifest: {str(e)}", exc_info=True)
+                return False
+
+    def start_index_watcher(self) -> Optional[asyncio.Task]:
+        """Chạy task nền poll manifest để nhận index do worker khác publish."""
+        if config.INDEX_RELOAD_POLL_SECONDS <= 0:
+            return None
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch_manifest())
+        return self._watch_task
+
+    async def _watch_manifest(self) -> None:
+        """Vòng lặp poll manifest theo INDEX_RELOAD_POLL_SECONDS."""
+        logger.info(f"Worker {os.getpid()} watching index manifest every {config.INDEX_RELOAD_POLL_SECONDS}s")
+        while True:
+            await asyncio.sleep(config.INDEX_RELOAD_POLL_SECONDS)
+            await self.reload_if_changed()
+
     def calculate_relevance(self, query: str, result: Dict[str, Any]) -> float:
         """Tính điểm relevance của kết quả tìm kiếm với query."""
         return calculate_relevance(query, result)
@@ -203,131 +392,1109 @@ class RAGService:
         """Xử lý và sắp xếp kết quả tìm kiếm web theo relevance."""
         return process_web_search_results(query, search_results)
 
-    async def _rebuild_index_from_database(self) -> None:
-        """Xây dựng lại FAISS index từ dữ liệu trong database với tối ưu hóa."""
-        try:
-            all_chunks = self.vector_db.get_all_chunks()
-            
-            if not all_chunks:
-                logger.info("No chunks found in database")
-                return
-            
-            num_chunks = len(all_chunks)
-            logger.info(f"Rebuilding optimized FAISS index from {num_chunks} chunks")
+    def _create_empty_index(self) -> Any:
+        """Index rỗng: một index duy nhất hoặc RAG_NUM_SHARDS shard rỗng."""
+        vector_size = self.model.get_sentence_embedding_dimension()
+        compression = config.RAG_VECTOR_COMPRESSION
+        if config.RAG_NUM_SHARDS <= 1:
+            if compression == COMPRESSION_NONE:
+                return create_new_index(vector_size, 0, self.use_gpu)
+            return create_optimized_index(vector_size, 0, compression=compression)
+        return ShardedIndex(
+            [create_optimized_index(vector_size, 0, compression=compression) for _ in range(config.RAG_NUM_SHARDS)],
+            config.RAG_SHARD_BY,
+            config.RAG_SHARD_SEARCH_THREADS
+        )
+
+    @staticmethod
+    def _shard_assignments(ids: np.ndarray, file_ids: np.ndarray) -> np.ndarray:
+        """Shard của từng chunk theo RAG_SHARD_BY (file id hoặc chunk id)."""
+        return assign_shards(file_ids if config.RAG_SHARD_BY == "file" else ids, config.RAG_NUM_SHARDS)
+
+    def _build_index_metadata(self, index: Any, num_chunks: int) -> Dict[str, Any]:
+        """Tạo metadata mô tả index để quyết định khi nào cần rebuild."""
+        metadata = {
+            "index_tier": get_index_tier(num_chunks),
+            "num_vectors": int(index.ntotal) if index is not None else 0,
+            "deleted_vectors": count_deleted_vectors(index) if index is not None else 0,
+            "embedding_backend": self.embedding_backend,
+            "embedding_model": config.EMBEDDING_MODEL,
+            "vector_compression": config.RAG_VECTOR_COMPRESSION,
+        }
+        if isinstance(index, ShardedIndex):
+            metadata.update({
+                "num_shards": index.num_shards,
+                "shard_by": index.shard_by,
+                "shard_tiers": [get_index_tier(int(shard.ntotal)) for shard in index.shards],
+            })
+        agreement = getattr(self.model, 'agreement', None)
+        if agreement is not None:
+            metadata["embedding_agreement"] = agreement
+        return metadata
+
+    @staticmethod
+    def _apply_search_params(index: Any, metadata: Dict[str, Any]) -> None:
+        """Áp dụng tham số search đã tinh chỉnh trong metadata, nếu chưa có thì dùng mặc định."""
+        if not apply_search_params(index, metadata.get("search_params")):
+            optimize_search_params(index)
+
+    def _embedding_matches_metadata(self, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Kiểm tra vector trong index được tạo bởi cùng backend và model hiện tại.
+
+        Metadata cũ không có thông tin backend được coi là do PyTorch tạo ra.
+        """
+        metadata = metadata if metadata is not None else self.index_metadata
+        return (
+            metadata.get("embedding_backend", TORCH_BACKEND) == self.embedding_backend
+            and metadata.get("embedding_model", config.EMBEDDING_MODEL) == config.EMBEDDING_MODEL
+        )
+
+    def _compression_matches_snapshot(self, snapshot: IndexSnapshot) -> bool:
+        """Kiểm tra snapshot lưu vector theo chế độ nén đang cấu hình (và có vector chính xác nếu nén)."""
+        compression = snapshot.metadata.get("vector_compression", COMPRESSION_NONE)
+        if compression != config.RAG_VECTOR_COMPRESSION:
+            return False
+        return compression == COMPRESSION_NONE or snapshot.vector_store is not None
+
+    def _new_vector_store(self, directory: Optional[str] = None) -> Optional[Any]:
+        """Nơi lưu vector chính xác cho rebuild: writer ghi thẳng vào directory, None nếu không nén."""
+        if config.RAG_VECTOR_COMPRESSION == COMPRESSION_NONE:
+            return None
+        vector_size = self.model.get_sentence_embedding_dimension()
+        if directory is None:
+            return VectorStore(vector_size)
+        return VectorStoreWriter(directory, vector_size)
+
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode danh sách văn bản thành ma trận float32, chỉ encode văn bản chưa có trong cache."""
+        return self.embedder.encode(texts)
+
+    def _encode_queries(self, texts: List[str]) -> np.ndarray:
+        """Encode câu truy vấn qua LRU trong bộ nhớ, không ghi vào cache trên đĩa."""
+        return self.embedder.encode_queries(texts)
+
+    def _add_chunks_to_index(
+        self,
+        chunks: List[Tuple],
+        index: Any,
+        chunk_store: ChunkStore,
+        pool: Optional[EmbeddingProcessPool] = None,
+        vector_store: Optional[VectorStore] = None
+    ) -> None:
+        """Encode và thêm các chunks vào index (chưa publish) theo chunk id.
+
+        Khi có pool, các chunk chưa cache được encode song song trên nhiều process
+        và được thêm vào index theo đúng thứ tự. Khi index nén, vector chính xác
+        được thêm vào vector_store.
+        """
+        num_chunks = len(chunks)
+        batch_size = pool.preferred_batch_size if pool is not None else self.optimal_batch_size
+        encode_fn = pool.encode if pool is not None else None
+        
+        for i in range(0, num_chunks, batch_size):
+            batch = chunks[i:i + batch_size]
             
-            training_data = None
-            if num_chunks > 1000:
-                sample_size = min(max(num_chunks // 10, 100), 10000)
-                sample_indices = np.random.choice(num_chunks, sample_size, replace=False)
-                sample_texts = [all_chunks[i][1] for i in sample_indices]
-                training_data = self.model.encode(sample_texts, show_progress_bar=False)
-                training_data = np.array(training_data, dtype='float32')
-                logger.info(f"Created training data with {len(training_data)} samples")
+            embeddings_array = self.embedder.encode([chunk[1] for chunk in batch], encode_fn)  # chunk[1] là content
+            ids_array = np.array([chunk[0] for chunk in batch], dtype='int64')
+            if isinstance(index, ShardedIndex):
+                index.add_with_ids(embeddings_array, ids_array, file_ids=[chunk[4] for chunk in batch])
+            else:
+                index.add_with_ids(embeddings_array, ids_array)
+            chunk_store.add(batch)
+            if vector_store is not None:
+                vector_store.add(ids_array, embeddings_array)
             
-            vector_size = self.model.get_sentence_embedding_dimension()
-            self.index = create_optimized_index(vector_size, num_chunks, training_data)
-            self.chunk_id_mapping = []
+            if (i // batch_size + 1) % 10 == 0:
+                logger.info(f"Processed {i + len(batch)}/{num_chunks} chunks")
+
+    def _encode_pages(
+        self,
+        pages: Iterable[List[Tuple]],
+        corpus: EncodedCorpus,
+        add_rows: Callable[[List[Tuple]], None],
+        pool: Optional[EmbeddingProcessPool] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Encode các trang chunk đúng một lần vào corpus và chuyển các dòng cho add_rows.
+
+        Các trang được gom lại thành batch đủ batch_size dòng (với pool là
+        preferred_batch_size) trước khi encode, để trang nhỏ hơn batch không làm
+        các worker của pool ngồi không. Chỉ một batch và một trang nằm trong bộ
+        nhớ; trả về (chunk ids, file ids) theo thứ tự dòng của corpus.
+        """
+        batch_size = pool.preferred_batch_size if pool is not None else self.optimal_batch_size
+        encode_fn = pool.encode if pool is not None else None
+        ids_parts: List[np.ndarray] = []
+        file_ids_parts: List[np.ndarray] = []
+        pending: List[Tuple] = []
+        
+        def flush(batch: List[Tuple]) -> None:
+            corpus.append(self.embedder.encode([chunk[1] for chunk in batch], encode_fn))  # chunk[1] là content
+            add_rows(batch)
+            ids_parts.append(np.array([chunk[0] for chunk in batch], dtype='int64'))
+            file_ids_parts.append(np.array([chunk[4] for chunk in batch], dtype='int64'))
+            if len(ids_parts) % 10 == 0:
+                logger.info(f"Encoded {len(corpus)} chunks")
+        
+        for page in pages:
+            pending.extend(page)
+            while len(pending) >= batch_size:
+                flush(pending[:batch_size])
+                pending = pending[batch_size:]
+        if pending:
+            flush(pending)
+        
+        corpus.finish()
+        if not ids_parts:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+        return np.concatenate(ids_parts), np.concatenate(file_ids_parts)
+
+    @staticmethod
+    def _create_trained_index(corpus: EncodedCorpus, rows: np.ndarray) -> Any:
+        """Tạo index cho các dòng rows của corpus, train quantizer (IVF/PQ/SQ) từ mẫu các dòng đó."""
+        num_rows = len(rows)
+        compression = config.RAG_VECTOR_COMPRESSION
+        training_data = None
+        if num_rows > 1000 or (compression != COMPRESSION_NONE and num_rows > 0):
+            training_data = corpus.sample(rows, training_sample_size(num_rows))
+            logger.info(f"Training on {len(training_data)} of {num_rows} encoded vectors")
+        with faiss_threads(config.RAG_BUILD_TRAIN_THREADS):
+            return create_optimized_index(corpus.dim, num_rows, training_data, compression)
+
+    @staticmethod
+    def _add_corpus_to_index(
+        corpus: EncodedCorpus,
+        ids: np.ndarray,
+        file_ids: np.ndarray,
+        index: Any,
+        add_vectors: Optional[Callable[[np.ndarray, np.ndarray], None]] = None,
+        block_size: int = 16384
+    ) -> None:
+        """Thêm vector đã encode trong corpus vào index (chưa publish) theo chunk id, từng khối dòng.
+
+        add_vectors (nếu có) nhận cùng các khối để lưu vector chính xác cạnh index nén.
+        """
+        for start in range(0, len(ids), block_size):
+            end = min(start + block_size, len(ids))
+            vectors = corpus.rows(start, end)
+            if isinstance(index, ShardedIndex):
+                index.add_with_ids(vectors, ids[start:end], file_ids=file_ids[start:end])
+            else:
+                index.add_with_ids(vectors, ids[start:end])
+            if add_vectors is not None:
+                add_vectors(ids[start:end], vectors)
+
+    async def _build_from_pages(
+        self,
+        pages: Iterable[List[Tuple]],
+        add_rows: Callable[[List[Tuple]], None],
+        timings: BuildTimings,
+        expected_chunks: int,
+        num_shards: int = 1,
+        add_vectors: Optional[Callable[[np.ndarray, np.ndarray], None]] = None
+    ) -> Any:
+        """Build index từ các trang chunk: encode một lần vào memmap tạm, train rồi add từ cùng ma trận.
+
+        Các dòng được chuyển cho add_rows (chunk store) ngay khi encode xong trang,
+        vector chính xác cho add_vectors (vector store) trong lúc add.
+        Với num_shards > 1 trả về ShardedIndex, mỗi shard được train từ chính các
+        dòng thuộc shard.
+        """
+        vector_size = self.model.get_sentence_embedding_dimension()
+        
+        with EncodedCorpus(vector_size, config.RAG_BUILD_TMP_DIR) as corpus:
+            with timings.phase("encode"):
+                pool = self._create_embedding_pool(expected_chunks)
+                if pool is None:
+                    logger.info(f"Encoding chunks with batch size: {self.optimal_batch_size}")
+                    ids, file_ids = await run_inference(self._encode_pages, pages, corpus, add_rows)
+                else:
+                    logger.info(f"Encoding chunks with {pool.num_workers}-process embedding pool")
+                    with pool:
+                        ids, file_ids = await run_inference(self._encode_pages, pages, corpus, add_rows, pool)
+            timings.num_vectors = len(ids)
             
-            batch_size = self.optimal_batch_size
-            logger.info(f"Processing chunks with batch size: {batch_size}")
+            with timings.phase("train"):
+                if num_shards > 1:
+                    assignments = self._shard_assignments(ids, file_ids)
+                    logger.info(
+                        f"Building {num_shards} shards by {config.RAG_SHARD_BY}: "
+                        f"{np.bincount(assignments, minlength=num_shards).tolist()}"
+                    )
+                    shards = [
+                        await run_inference(self._create_trained_index, corpus, np.flatnonzero(assignments == shard_id))
+                        for shard_id in range(num_shards)
+                    ]
+                    index = ShardedIndex(shards, config.RAG_SHARD_BY, config.RAG_SHARD_SEARCH_THREADS)
+                else:
+                    index = await run_inference(self._create_trained_index, corpus, np.arange(len(ids)))
             
-            for i in range(0, num_chunks, batch_size):
-                batch = all_chunks[i:i + batch_size]
-                
-                texts = [chunk[1] for chunk in batch]  # chunk[1] là content
-                embeddings = self.model.encode(texts, show_progress_bar=False)
-                embeddings_array = np.array(embeddings, dtype='float32')
-                
-                if np.any(np.isnan(embeddings_array)) or np.any(np.isinf(embeddings_array)):
-                    logger.warning(f"Found invalid embeddings in batch {i//batch_size + 1}, cleaning...")
-                    embeddings_array = np.nan_to_num(embeddings_array, nan=0.0, posinf=0.0, neginf=0.0)
-                
-                self.index.add(embeddings_array)
-                
-                for chunk in batch:
-                    chunk_mapping = {
-                        'chunk_id': chunk[0],  # chunk[0] là ID
-                        'content': chunk[1],   # chunk[1] là content
-                        'source': chunk[2],    # chunk[2] là source file
-                        'chunk_index': chunk[3] # chunk[3] là chunk_index
-                    }
-                    self.chunk_id_mapping.append(chunk_mapping)
-                
-                if (i // batch_size + 1) % 10 == 0:
-                    logger.info(f"Processed {i + len(batch)}/{num_chunks} chunks")
+            with timings.phase("add"):
+                await run_inference(self._add_corpus_to_index, corpus, ids, file_ids, index, add_vectors)
+        return index
+
+    def _record_build(self, timings: BuildTimings, scope: str) -> Dict[str, Any]:
+        """Ghi nhận và log thời gian các giai đoạn của lần build gần nhất."""
+        report = {"scope": scope, **timings.to_dict()}
+        self._last_build = report
+        logger.info(f"Index build ({scope}) timings: {report['phases']}, total {report['total_seconds']}s")
+        return report
+
+    def _create_embedding_pool(self, num_chunks: int) -> Optional[EmbeddingProcessPool]:
+        """Tạo pool encode nhiều process cho rebuild lớn nếu được bật trong cấu hình."""
+        if config.EMBEDDING_POOL_WORKERS <= 1 or num_chunks < config.EMBEDDING_POOL_MIN_CHUNKS:
+            return None
+        return EmbeddingProcessPool(
+            config.EMBEDDING_MODEL,
+            num_workers=config.EMBEDDING_POOL_WORKERS,
+            threads_per_worker=config.EMBEDDING_POOL_THREADS_PER_WORKER,
+            shard_size=config.EMBEDDING_POOL_SHARD_SIZE,
+            backend=self.embedding_backend,
+            onnx_dir=config.EMBEDDING_ONNX_DIR
+        )
+
+    def _build_incremental_snapshot(
+        self,
+        base: IndexSnapshot,
+        stale_ids: List[int],
+        new_chunks: List[Tuple],
+        num_chunks: int
+    ) -> IndexSnapshot:
+        """Tạo snapshot mới từ bản sao của snapshot hiện tại: xóa id cũ, thêm chunk mới.
+
+        Snapshot đang phục vụ truy vấn không bị sửa nên search không cần khóa.
+        """
+        index = clone_index(base.index)
+        chunk_store = base.chunk_store.copy()
+        vector_store = base.vector_store.copy() if base.vector_store is not None else None
+        if stale_ids:
+            if vector_store is not None:
+                vector_store.remove(stale_ids)
+            # Khi cần compact, index nén được dựng lại từ vector chính xác của các chunk còn lại
+            index = remove_ids_from_index(index, stale_ids, vector_store)
+            chunk_store.remove(stale_ids)
+        if new_chunks:
+            self._add_chunks_to_index(new_chunks, index, chunk_store, vector_store=vector_store)
+        
+        metadata = dict(base.metadata)
+        metadata.update(self._build_index_metadata(index, num_chunks))
+        if "shard_tiers" in base.metadata:
+            # Loại index của shard chỉ đổi khi shard đó được rebuild
+            metadata["shard_tiers"] = list(base.metadata["shard_tiers"])
+        return IndexSnapshot(index, chunk_store, metadata, vector_store=vector_store)
+
+    def _outgrown_shards(self, snapshot: IndexSnapshot) -> List[int]:
+        """Các shard có số vector không còn hợp với loại index đang dùng."""
+        if not isinstance(snapshot.index, ShardedIndex):
+            return []
+        shard_tiers = snapshot.metadata.get("shard_tiers", [])
+        return [
+            shard_id for shard_id, shard in enumerate(snapshot.index.shards)
+            if shard_id >= len(shard_tiers) or shard_tiers[shard_id] != get_index_tier(int(shard.ntotal))
+        ]
+
+    async def _build_shard_snapshot(
+        self,
+        base: IndexSnapshot,
+        shard_id: int,
+        timings: Optional[BuildTimings] = None
+    ) -> IndexSnapshot:
+        """Tạo snapshot mới chỉ build lại một shard từ database, các shard khác dùng chung."""
+        timings = timings if timings is not None else BuildTimings()
+        old_ids = get_index_ids(base.index.shards[shard_id])
+        chunk_store = base.chunk_store.copy()
+        chunk_store.remove(old_ids)
+        vector_store = base.vector_store.copy() if base.vector_store is not None else None
+        if vector_store is not None:
+            vector_store.remove(old_ids)
+        pages = self.vector_db.iter_chunks(
+            self.collection_id, config.RAG_REBUILD_PAGE_SIZE, config.RAG_NUM_SHARDS, shard_id, config.RAG_SHARD_BY
+        )
+        shard = await self._build_from_pages(
+            pages, chunk_store.add, timings, int(base.index.shards[shard_id].ntotal),
+            add_vectors=vector_store.add if vector_store is not None else None
+        )
+        num_shard_chunks = int(shard.ntotal)
+        logger.info(f"Rebuilt shard {shard_id} from {num_shard_chunks} chunks")
+        
+        index = base.index.replace_shard(shard_id, shard)
+        metadata = dict(base.metadata)
+        metadata.update(self._build_index_metadata(index, len(chunk_store)))
+        shard_tiers = list(base.metadata.get("shard_tiers", metadata["shard_tiers"]))
+        shard_tiers[shard_id] = get_index_tier(num_shard_chunks)
+        metadata["shard_tiers"] = shard_tiers
+        self._apply_search_params(shard, metadata)
+        return IndexSnapshot(index, chunk_store, metadata, vector_store=vector_store)
+
+    async def rebuild_shard(self, shard_id: int) -> Dict[str, Any]:
+        """Build lại một shard độc lập (các shard khác vẫn giữ nguyên) rồi publish."""
+        async def build(base: IndexSnapshot) -> IndexSnapshot:
+            if not isinstance(base.index, ShardedIndex):
+                raise ValueError("Index is not sharded, set RAG_NUM_SHARDS > 1 and rebuild the index")
+            if not 0 <= shard_id < base.index.num_shards:
+                raise ValueError(f"Shard {shard_id} does not exist (index has {base.index.num_shards} shards)")
+            return await self._build_shard_snapshot(base, shard_id, timings)
+        
+        async with self._update_lock:
+            start_time = time.time()
+            timings = BuildTimings()
+            snapshot = await self._publish_on_latest(build, timings)
+            elapsed = time.time() - start_time
+            logger.info(f"Rebuilt shard {shard_id} in {elapsed:.2f}s")
+            return {
+                "shard": shard_id,
+                "num_vectors": int(snapshot.index.shards[shard_id].ntotal),
+                "index_tier": snapshot.metadata["shard_tiers"][shard_id],
+                "seconds": round(elapsed, 3),
+                "build": self._record_build(timings, f"shard {shard_id}"),
+            }
+
+    def _publish_snapshot(self, snapshot: IndexSnapshot, base_generation: Optional[int]) -> IndexSnapshot:
+        """Lưu snapshot thành generation mới rồi thay snapshot đang dùng, giữ snapshot cũ để rollback.
+
+
+        base_generation là generation mà snapshot được dựng từ đó; nếu manifest đã
+        trỏ sang generation khác thì GenerationConflictError được ném ra và snapshot
+        đang dùng giữ nguyên. Snapshot đầu vào không bị sửa (rollback truyền vào
+        snapshot mà truy vấn có thể vẫn đang giữ); snapshot được publish là bản mới
+        dùng chunk store vừa lưu. Khi bật mmap, index vừa build được thay bằng bản
+        map từ file đã lưu để process này cũng dùng chung page cache với các worker khác.
+        """
+        manifest, chunk_store = save_index_to_disk(
+            snapshot.index, snapshot.chunk_store, snapshot.metadata,
+            base_generation=base_generation, rollback_generation=self._snapshot.generation,
+            collection_id=self.collection_id, vector_store=snapshot.vector_store
+        )
+        vector_store = load_vector_store(manifest["directory"]) if snapshot.vector_store is not None else None
+        index, mmapped = snapshot.index, snapshot.mmapped
+        if config.FAISS_MMAP_ENABLED and not self.use_gpu:
+            index, mmapped = read_generation_index(manifest)
+            self._apply_search_params(index, snapshot.metadata)
+        published = IndexSnapshot(
+            index, chunk_store, snapshot.metadata, mmapped=mmapped, generation=manifest["generation"],
+            vector_store=vector_store
+        )
+        with self._swap_lock:
+            if self._snapshot.index is not None:
+                self._previous_snapshot = self._snapshot
+            self._snapshot = published
+        logger.info(f"Published index snapshot with {published.num_vectors} vectors")
+        return published
+
+    async def _publish_on_latest(
+        self,
+        build: Callable[[IndexSnapshot], Awaitable[Optional[IndexSnapshot]]],
+        timings: Optional[BuildTimings] = None
+    ) -> Optional[IndexSnapshot]:
+        """Dựng snapshot trên generation mới nhất rồi publish; gọi khi đang giữ _update_lock.
+
+        _update_lock chỉ loại trừ trong một process: khi worker khác publish trước,
+        generation mới được load và build được gọi lại trên đó (tối đa
+        INDEX_PUBLISH_ATTEMPTS lần). build trả về None nếu không có gì để publish.
+        Thời gian ghi generation được cộng vào giai đoạn persist của timings (nếu có).
+        """
+        attempts = max(1, config.INDEX_PUBLISH_ATTEMPTS)
+        for attempt in range(1, attempts + 1):
+            await run_inference(self._reload_from_manifest)
+            base = self._snapshot
+            snapshot = await build(base)
+            if snapshot is None:
+                return None
+            try:
+                with timings.phase("persist") if timings is not None else nullcontext():
+                    return await run_inference(self._publish_snapshot, snapshot, base.generation)
+            except GenerationConflictError as e:
+                if attempt == attempts:
+                    raise
+                logger.warning(f"{e}; rebuilding on the latest generation (attempt {attempt}/{attempts})")
+        return None
+
+    def search(
+        self,
+        query_embeddings: np.ndarray,
+        k: int,
+        snapshot: Optional[IndexSnapshot] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Tìm kiếm trên snapshot (mặc định snapshot hiện tại), gọi qua run_inference từ code async.
+
+        Khi index lưu vector nén, lấy RAG_RERANK_FACTOR * k ứng viên rồi re-rank bằng vector chính xác.
+        """
+        snapshot = snapshot if snapshot is not None else self._snapshot
+        params = exclude_deleted(snapshot.index) if snapshot.metadata.get("deleted_vectors") else None
+        if snapshot.vector_store is None:
+            return snapshot.index.search(query_embeddings, k=k, params=params)
+        _, candidate_ids = snapshot.index.search(query_embeddings, k=self._rerank_candidates(k, snapshot), params=params)
+        return rerank_exact(query_embeddings, candidate_ids, snapshot.vector_store, k)
+
+    def search_filtered(
+        self,
+        query_embeddings: np.ndarray,
+        k: int,
+        chunk_ids: np.ndarray,
+        snapshot: Optional[IndexSnapshot] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Tìm kiếm chỉ trong tập chunk id cho trước, lọc ngay trong FAISS."""
+        snapshot = snapshot if snapshot is not None else self._snapshot
+        if snapshot.vector_store is None:
+            return search_subset(snapshot.index, query_embeddings, k, chunk_ids, config.RAG_FILTER_EXACT_SEARCH_MAX)
+        _, candidate_ids = search_subset(
+            snapshot.index, query_embeddings, self._rerank_candidates(k, snapshot), chunk_ids,
+            config.RAG_FILTER_EXACT_SEARCH_MAX
+        )
+        return rerank_exact(query_embeddings, candidate_ids, snapshot.vector_store, k)
+
+    @staticmethod
+    def _rerank_candidates(k: int, snapshot: IndexSnapshot) -> int:
+        """Số ứng viên lấy từ index nén trước khi re-rank chính xác."""
+        return min(k * max(1, config.RAG_RERANK_FACTOR), snapshot.num_vectors)
+
+    async def _resolve_filter_ids(
+        self,
+        search_filter: Optional[SearchFilter],
+        chunk_store: ChunkStore
+    ) -> Optional[np.ndarray]:
+        """Chuyển bộ lọc metadata thành tập chunk id qua file_id; None nếu không lọc."""
+        if search_filter is None or search_filter.is_empty():
+            return None
+        file_ids = await run_inference(
+            self.vector_db.find_file_ids,
+            file_names=search_filter.file_names,
+            file_ids=search_filter.file_ids,
+            uploaded_after=search_filter.uploaded_after,
+            uploaded_before=search_filter.uploaded_before,
+            collection_id=self.collection_id
+        )
+        chunk_ids = chunk_store.ids_for_file_ids(file_ids)
+        logger.debug(f"Filter {search_filter.to_dict()} matched {len(file_ids)} files, {len(chunk_ids)} chunks")
+        return chunk_ids
+
+    async def _search_snapshot(
+        self,
+        query_embeddings: np.ndarray,
+        k: int,
+        snapshot: IndexSnapshot,
+        chunk_ids: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Search toàn bộ snapshot hoặc chỉ trong chunk_ids nếu có bộ lọc."""
+        search_k = min(k, snapshot.num_vectors)
+        if chunk_ids is None:
+            return await run_inference(self.search, query_embeddings, search_k, snapshot)
+        return await run_inference(self.search_filtered, query_embeddings, search_k, chunk_ids, snapshot)
+
+    def _needs_full_rebuild(self, num_chunks: int) -> bool:
+        """Kiểm tra index hiện tại có cần rebuild toàn bộ hay không.
+
+        Với index chia shard, loại index được kiểm tra theo từng shard (xem _outgrown_shards),
+        chỉ đổi số shard hoặc cách chia mới cần rebuild toàn bộ.
+        """
+        if self._index_needs_rebuild or self.index is None or not is_id_mapped(self.index):
+            return True
+        if not self._embedding_matches_metadata() or not self._compression_matches_snapshot(self._snapshot):
+            return True
+        if isinstance(self.index, ShardedIndex):
+            return self.index.num_shards != config.RAG_NUM_SHARDS or self.index.shard_by != config.RAG_SHARD_BY
+        if config.RAG_NUM_SHARDS > 1:
+            return True
+        return self.index_metadata.get("index_tier") != get_index_tier(num_chunks)
+
+    async def update_index_for_files(self, file_names: List[str]) -> None:
+        """Cập nhật index chỉ cho các file đã thêm, sửa hoặc xóa.
+
+        Chunk id là AUTOINCREMENT nên không bị tái sử dụng: id có trong mapping
+        nhưng không còn trong database là vector cũ cần xóa, id mới chưa có trong
+        mapping là vector cần thêm. Thay đổi được áp dụng trên bản sao rồi publish.
+        """
+        if not file_names:
+            return
+        names = set(file_names)
+        needs_rebuild = False
+        
+        async def build(base: IndexSnapshot) -> Optional[IndexSnapshot]:
+            nonlocal needs_rebuild
+            db_chunks = await run_inference(self.vector_db.get_chunks_by_file_names, list(names), self.collection_id)
+            db_ids = {chunk[0] for chunk in db_chunks}
             
-            optimize_search_params(self.index)
+            stale_ids = [
+                chunk_id for chunk_id in base.chunk_store.ids_for_files(names)
+                if chunk_id not in db_ids
+            ]
+            new_chunks = [chunk for chunk in db_chunks if chunk[0] not in base.chunk_store]
             
-            save_index_to_disk(self.index, self.chunk_id_mapping)
+            if not stale_ids and not new_chunks:
+                logger.debug("Index already up to date for changed files")
+                return None
             
-            info = get_index_info(self.index)
-            logger.info(f"FAISS index rebuilt successfully: {info}")
+            num_chunks = len(base.chunk_store) - len(stale_ids) + len(new_chunks)
+            if self._needs_full_rebuild(num_chunks):
+                needs_rebuild = True
+                return None
+            logger.info(f"Incrementally updating index: -{len(stale_ids)} +{len(new_chunks)} vectors")
+            snapshot = await run_inference(self._build_incremental_snapshot, base, stale_ids, new_chunks, num_chunks)
+            for shard_id in self._outgrown_shards(snapshot):
+                snapshot = await self._build_shard_snapshot(snapshot, shard_id)
+            return snapshot
+        
+        try:
+            async with self._update_lock:
+                start_time = time.time()
+                if await self._publish_on_latest(build) is not None:
+                    logger.info(f"Incrementally updated index in {time.time() - start_time:.2f}s")
             
+            if needs_rebuild:
+                logger.info("Index type needs to change, rebuilding optimized FAISS index...")
+                await self._rebuild_index_from_database()
         except Exception as e:
-            logger.error(f"Error rebuilding FAISS index: {str(e)}", exc_info=True)
+            logger.error(f"Error updating FAISS index for files: {str(e)}", exc_info=True)
             raise
 
-    async def query(self, question: str, k: int = 5) -> str:
-        """Truy vấn hệ thống RAG với câu hỏi đầu vào và trả về câu trả lời."""
+    def is_rebuilding(self) -> bool:
+        """Kiểm tra có rebuild nền đang chạy hay không."""
+        return self._rebuild_task is not None and not self._rebuild_task.done()
+
+    def is_busy(self) -> bool:
+        """Service đang rebuild, đang cập nhật index (giữ _update_lock) hoặc có truy vấn đang chạy."""
+        return self.is_rebuilding() or self._update_lock.locked() or self._active_queries > 0
+
+    @contextmanager
+    def _track_query(self):
+        """Đếm truy vấn đang chạy để registry không evict service giữa chừng."""
+        self._active_queries += 1
         try:
-            if self.index is None or self.index.ntotal == 0:
-                logger.info("Index is empty, rebuilding from database...")
-                await self._rebuild_index_from_database()
-            
-            if self.index is None or self.index.ntotal == 0:
-                return "Không có dữ liệu để truy vấn. Vui lòng upload tài liệu trước."
-            
-            optimize_search_params(self.index, num_queries=1)
-            
-            query_embedding = self.model.encode([question])
-            query_embedding = np.array(query_embedding, dtype='float32')
-            
-            if np.any(np.isnan(query_embedding)) or np.any(np.isinf(query_embedding)):
-                logger.warning("Invalid query embedding, cleaning...")
-                query_embedding = np.nan_to_num(query_embedding, nan=0.0, posinf=0.0, neginf=0.0)
-            
-            search_k = min(k, self.index.ntotal)
-            D, I = self.index.search(query_embedding, k=search_k)
-            
-            context_chunks = []
-            chunk_scores = []
-            
-            for i, idx in enumerate(I[0]):
-                if idx < len(self.chunk_id_mapping) and idx >= 0:
-                    chunk_mapping = self.chunk_id_mapping[idx]
-                    chunk_id = chunk_mapping.get('chunk_id')
-                    if chunk_id:
-                        chunk_content = self.vector_db.get_chunk_by_id(chunk_id)
-                        if chunk_content:
-                            context_chunks.append(chunk_content)
-                            chunk_scores.append(D[0][i])
+            yield
+        finally:
+            self._active_queries -= 1
+
+    def schedule_rebuild(self) -> asyncio.Task:
+        """Khởi chạy rebuild nền nếu chưa có rebuild nào đang chạy (single-flight)."""
+        if not self.is_rebuilding():
+            self._rebuild_task = asyncio.get_running_loop().create_task(self._run_rebuild())
+            self._rebuild_task.add_done_callback(self._on_rebuild_done)
+        return self._rebuild_task
+
+    @staticmethod
+    def _on_rebuild_done(task: asyncio.Task) -> None:
+        """Ghi log lỗi của rebuild nền không có ai chờ kết quả."""
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background index rebuild failed: {task.exception()}")
+
+    async def _rebuild_index_from_database(self) -> None:
+        """Xây dựng lại FAISS index từ database và chờ tới khi snapshot mới được publish.
+
+        Các lời gọi đồng thời dùng chung một lần rebuild; trong lúc build, truy vấn
+        vẫn dùng snapshot cũ.
+        """
+        await asyncio.shield(self.schedule_rebuild())
+
+    async def _run_rebuild(self) -> None:
+        """Build snapshot shadow từ database rồi publish."""
+        async with self._update_lock:
+            try:
+                timings = BuildTimings()
+                if config.RAG_BUILD_TMP_DIR:
+                    os.makedirs(config.RAG_BUILD_TMP_DIR, exist_ok=True)
+                with tempfile.TemporaryDirectory(prefix="rag-rebuild-", dir=config.RAG_BUILD_TMP_DIR or None) as work_dir:
+                    # Mỗi lần build (kể cả khi build lại trên generation mới hơn) ghi vào thư mục riêng
+                    snapshot = await self._publish_on_latest(
+                        lambda base: self._build_snapshot_from_database(tempfile.mkdtemp(dir=work_dir), timings),
+                        timings
+                    )
+                self._index_needs_rebuild = False
+                self._record_build(timings, "full")
+                
+                info = get_index_info(snapshot.index)
+                logger.info(f"FAISS index rebuilt successfully: {info}")
+            except Exception as e:
+                logger.error(f"Error rebuilding FAISS index: {str(e)}", exc_info=True)
+                raise
+
+    async def _build_snapshot_from_database(self, work_dir: str, timings: Optional[BuildTimings] = None) -> IndexSnapshot:
+        """Tạo index và mapping mới từ toàn bộ chunks trong database với tối ưu hóa.
+
+        Chunks được đọc từng trang RAG_REBUILD_PAGE_SIZE dòng; nội dung được ghi
+        thẳng vào chunk store trong work_dir và vector vào ma trận memmap tạm, nên
+        bộ nhớ dùng khi rebuild không tăng theo kích thước corpus.
+        """
+        timings = timings if timings is not None else BuildTimings()
+        num_chunks = self.vector_db.count_chunks(self.collection_id)
+        
+        if num_chunks == 0:
+            logger.info("No chunks found in database, building an empty index")
+            index = self._create_empty_index()
+            return IndexSnapshot(
+                index, ChunkStore(), self._build_index_metadata(index, 0), vector_store=self._new_vector_store()
+            )
+        
+        logger.info(f"Rebuilding optimized FAISS index from {num_chunks} chunks")
+        writer = ChunkStoreWriter(os.path.join(work_dir, "chunks"))
+        vector_writer = self._new_vector_store(os.path.join(work_dir, "vectors"))
+        pages = self.vector_db.iter_chunks(self.collection_id, config.RAG_REBUILD_PAGE_SIZE)
+        index = await self._build_from_pages(
+            pages, writer.append, timings, num_chunks, config.RAG_NUM_SHARDS,
+            add_vectors=vector_writer.append if vector_writer is not None else None
+        )
+        chunk_store = await run_inference(writer.close)
+        vector_store = await run_inference(vector_writer.close) if vector_writer is not None else None
+        num_chunks = len(chunk_store)
+        
+        metadata = self._build_index_metadata(index, num_chunks)
+        previous_metadata = self.index_metadata
+        if previous_metadata.get("search_params") and previous_metadata.get("index_tier") == metadata["index_tier"]:
+            metadata["search_params"] = previous_metadata["search_params"]
+        self._apply_search_params(index, metadata)
+        return IndexSnapshot(index, chunk_store, metadata, vector_store=vector_store)
+
+    def _iter_corpus_vectors(self, chunk_store: ChunkStore, block_size: int = 5000, ids: Optional[np.ndarray] = None):
+        """Đọc vector của toàn bộ corpus (hoặc các chunk ids) theo khối (phần lớn lấy từ cache embedding)."""
+        ids = ids if ids is not None else chunk_store.ids()
+        for start in range(0, len(ids), block_size):
+            block_ids = ids[start:start + block_size]
+            texts = [chunk_store.get(int(chunk_id))['content'] for chunk_id in block_ids]
+            yield block_ids, self.embedder.encode(texts)
+
+    def _tune_snapshot(self, snapshot: IndexSnapshot, k: int, target_recall: float, sample_size: int) -> Dict[str, Any]:
+        """Lấy mẫu chunk làm query, tính ground truth chính xác rồi quét tham số search."""
+        ids = snapshot.chunk_store.ids()
+        query_ids = np.random.default_rng().choice(ids, size=min(sample_size, len(ids)), replace=False)
+        query_vectors = self.embedder.encode([snapshot.chunk_store.get(int(chunk_id))['content'] for chunk_id in query_ids])
+        _, exact_ids = exact_knn(query_vectors, self._iter_corpus_vectors(snapshot.chunk_store), k + 1)
+        return tune_search_params(snapshot.index, query_ids, query_vectors, exact_ids, k, target_recall)
+
+    async def tune_search_params(
+        self,
+        k: Optional[int] = None,
+        target_recall: Optional[float] = None,
+        sample_size: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Tìm efSearch/nprobe rẻ nhất đạt recall mục tiêu rồi publish snapshot mới dùng tham số đó.
+
+        Quá trình quét dùng SearchParameters cho từng lần search nên không ảnh hưởng
+        tới các truy vấn đang chạy trên index hiện tại. Snapshot đang dùng không bị
+        sửa: tham số mới nằm trong metadata của snapshot mới và được áp dụng lên
+        index map lại từ file khi publish (hoặc lên bản sao nếu không dùng mmap).
+        """
+        k = k or config.RAG_TUNE_K
+        target_recall = target_recall or config.RAG_TUNE_TARGET_RECALL
+        sample_size = sample_size or config.RAG_TUNE_SAMPLE_SIZE
+        
+        async with self._update_lock:
+            snapshot = self._snapshot
+            if snapshot.is_empty():
+                return {"tuned": False, "reason": "Index is empty"}
+            if get_search_param_name(snapshot.index) is None:
+                return {"tuned": False, "reason": "Index type has no tunable search parameter"}
             
-            if not context_chunks:
-                return "Không tìm thấy thông tin liên quan trong tài liệu đã upload."
+            result = await run_inference(self._tune_snapshot, snapshot, k, target_recall, sample_size)
+            if not result.get("tuned"):
+                return result
             
-            score_threshold = np.mean(chunk_scores) if chunk_scores else float('inf')
-            filtered_chunks = [
-                chunk for chunk, score in zip(context_chunks, chunk_scores)
-                if score <= score_threshold * 1.2
+            metadata = dict(snapshot.metadata)
+            metadata["search_params"] = {key: value for key, value in result.items() if key != "sweep"}
+            index = snapshot.index
+            if not config.FAISS_MMAP_ENABLED or self.use_gpu:
+                # Không map lại từ file khi publish: snapshot mới cần index riêng để đổi tham số search
+                index = await run_inference(clone_index, snapshot.index)
+                apply_search_params(index, metadata["search_params"])
+            try:
+                await run_inference(
+                    self._publish_snapshot,
+                    IndexSnapshot(index, snapshot.chunk_store, metadata, vector_store=snapshot.vector_store),
+                    snapshot.generation
+                )
+            except GenerationConflictError as e:
+                # Tham số được đo trên generation cũ, không áp dụng cho generation mới
+                logger.warning(f"{e}; discarding tuned search parameters")
+                await run_inference(self._reload_from_manifest)
+                return {"tuned": False, "reason": "Index changed while tuning, run tuning again"}
+            return result
+
+    def _compression_report(self, snapshot: IndexSnapshot, k: int, sample_size: int, max_vectors: int) -> Dict[str, Any]:
+        """Lấy mẫu corpus rồi đo recall@k và bộ nhớ của từng chế độ nén trên cùng mẫu."""
+        rng = np.random.default_rng()
+        ids = snapshot.chunk_store.ids()
+        if len(ids) > max_vectors:
+            ids = np.sort(rng.choice(ids, size=max_vectors, replace=False))
+        if snapshot.vector_store is not None:
+            vectors, found = snapshot.vector_store.get_many(ids)
+            vectors = vectors[found]
+        else:
+            vectors = np.vstack([block for _, block in self._iter_corpus_vectors(snapshot.chunk_store, ids=ids)])
+        queries = vectors[rng.choice(len(vectors), size=min(sample_size, len(vectors)), replace=False)]
+        return {
+            "num_vectors": int(len(vectors)),
+            "num_queries": int(len(queries)),
+            "k": k,
+            "rerank_factor": config.RAG_RERANK_FACTOR,
+            "configured": config.RAG_VECTOR_COMPRESSION,
+            "modes": evaluate_compression(vectors, queries, k, config.RAG_RERANK_FACTOR),
+        }
+
+    async def compression_report(
+        self,
+        k: Optional[int] = None,
+        sample_size: Optional[int] = None,
+        max_vectors: int = 20000
+    ) -> Dict[str, Any]:
+        """Báo cáo recall@k (trước/sau re-rank) và byte mỗi vector của none/fp16/sq8/pq trên corpus hiện tại."""
+        k = k or config.RAG_TUNE_K
+        sample_size = sample_size or config.RAG_TUNE_SAMPLE_SIZE
+        snapshot = self._snapshot
+        if snapshot.is_empty():
+            raise ValueError("Index is empty")
+        return await run_inference(self._compression_report, snapshot, k, sample_size, max_vectors)
+
+    async def rollback_index(self) -> bool:
+        """Quay lại snapshot trước đó; snapshot hiện tại được giữ lại làm bản rollback.
+
+        Generation của snapshot trước được ghim trong manifest nên không bị dọn;
+        nếu thư mục của nó vẫn không còn thì báo lỗi trước khi thay đổi bất cứ thứ
+        gì. Nếu worker khác đã publish generation mới hơn, rollback bị từ chối
+        (GenerationConflictError) và worker chuyển sang generation đó.
+
+        Chunk thay đổi sau snapshot trước sẽ được đồng bộ lại ở lần cập nhật file
+        hoặc rebuild kế tiếp.
+        """
+        async with self._update_lock:
+            previous = self._previous_snapshot
+            if previous is None:
+                return False
+            if previous.generation is not None and not os.path.isdir(
+                generation_dir(previous.generation, self.collection_id)
+            ):
+                raise ValueError(
+                    f"Index generation {previous.generation} has already been removed, cannot roll back to it"
+                )
+            try:
+                await run_inference(self._publish_snapshot, previous, self._snapshot.generation)
+            except GenerationConflictError:
+                await run_inference(self._reload_from_manifest)
+                raise
+            logger.info(f"Rolled back to index snapshot with {previous.num_vectors} vectors")
+            return True
+
+    def _resolve_hits(
+        self,
+        id_rows: np.ndarray,
+        distance_rows: np.ndarray,
+        chunk_store: Optional[ChunkStore] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Chuyển kết quả search (mỗi dòng một query) thành thông tin chunk từ mapping trong bộ nhớ.
+
+        Chỉ khi mapping thiếu nội dung mới đọc database, gom mọi query vào một truy vấn IN (...).
+        """
+        chunk_store = chunk_store if chunk_store is not None else self.chunk_id_mapping
+        results = []
+        missing_ids = set()
+        for ids, distances in zip(id_rows, distance_rows):
+            hits = []
+            for chunk_id, distance in zip(ids, distances):
+                if chunk_id < 0:
+                    continue
+                chunk_mapping = chunk_store.get(int(chunk_id))
+                if chunk_mapping is None:
+                    continue
+                if not chunk_mapping.get('content'):
+                    missing_ids.add(int(chunk_id))
+                hits.append({
+                    "chunk_id": int(chunk_id),
+                    "content": chunk_mapping.get('content'),
+                    "source": chunk_mapping.get('source', ''),
+                    "chunk_index": chunk_mapping.get('chunk_index', 0),
+                    "score": float(distance),
+                })
+            results.append(hits)
+        
+        if missing_ids:
+            logger.debug(f"Reading {len(missing_ids)} chunk contents from database")
+            with span("rag.read_chunks", num_chunks=len(missing_ids)):
+                db_contents = self.vector_db.get_chunks_by_ids(list(missing_ids))
+            for hits in results:
+                for hit in hits:
+                    if not hit["content"]:
+                        hit["content"] = db_contents.get(hit["chunk_id"])
+        
+        return [[hit for hit in hits if hit["content"]] for hits in results]
+
+    @staticmethod
+    def _fetch_k(k: int, diversify: bool) -> int:
+        """Số ứng viên lấy từ index: nhiều hơn k khi cần chọn lại bằng MMR hoặc reranker."""
+        if not diversify:
+            return k
+        fetch_k = k * max(1, config.RAG_MMR_FETCH_FACTOR) if config.RAG_MMR_ENABLED else k
+        if get_reranker() is not None:
+            fetch_k = max(fetch_k, config.RAG_RERANKER_TOP_N)
+        return fetch_k
+
+    async def _rerank_hits(self, question: str, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Chấm lại top-N hit bằng cross-encoder nếu bật, giữ nguyên thứ tự nếu quá giới hạn thời gian.
+
+        Khi timeout, lượt chấm vẫn chạy xong trong executor và điểm được cache cho lần hỏi sau.
+        """
+        reranker = get_reranker()
+        if reranker is None or len(hits) < 2:
+            return hits
+        with span("rag.rerank", num_candidates=min(len(hits), reranker.top_n)) as rerank_span:
+            try:
+                return await asyncio.wait_for(
+                    run_inference(reranker.rerank, question, hits),
+                    timeout=config.RAG_RERANKER_TIMEOUT_MS / 1000
+                )
+            except asyncio.TimeoutError:
+                reranker.record_timeout()
+                rerank_span.set_attribute("timed_out", True)
+                logger.warning(f"Reranking exceeded {config.RAG_RERANKER_TIMEOUT_MS:.0f}ms, using FAISS order")
+                return hits
+
+    def _candidate_vectors(self, hits: List[Dict[str, Any]], snapshot: IndexSnapshot) -> np.ndarray:
+        """Embedding của các hit, không encode lại nếu tránh được.
+
+        Thứ tự ưu tiên: vector chính xác trong vector store, vector reconstruct từ
+        index, cuối cùng là encode nội dung (thường trúng cache embedding).
+        """
+        ids = np.array([hit["chunk_id"] for hit in hits], dtype='int64')
+        if snapshot.vector_store is not None:
+            vectors, found = snapshot.vector_store.get_many(ids)
+            if found.all():
+                return vectors
+        try:
+            return reconstruct_vectors(snapshot.index, ids)
+        except RuntimeError:
+            return self.embedder.encode([hit["content"] for hit in hits])
+
+    def _diversify_hits(
+        self,
+        query_vector: np.ndarray,
+        hits: List[Dict[str, Any]],
+        snapshot: IndexSnapshot,
+        k: int
+    ) -> List[Dict[str, Any]]:
+        """Chọn k hit vừa liên quan vừa ít trùng lặp bằng MMR trên embedding của các ứng viên.
+
+        Hit đã rerank dùng điểm cross-encoder (qua sigmoid) làm độ liên quan thay cho cosine.
+        """
+        if len(hits) <= 1:
+            return hits[:k]
+        vectors = self._candidate_vectors(hits, snapshot)
+        relevance = None
+        if all("rerank_score" in hit for hit in hits):
+            relevance = 1.0 / (1.0 + np.exp(-np.array([hit["rerank_score"] for hit in hits], dtype='float32')))
+        return [hits[i] for i in mmr_select(query_vector, vectors, k, config.RAG_MMR_LAMBDA, relevance)]
+
+    @staticmethod
+    def _context_from_hits(hits: List[Dict[str, Any]]) -> List[str]:
+        """Giữ các hit có khoảng cách không quá 1.2 lần trung bình (tối đa 3), gộp các chunk liền kề.
+
+        Hit đã được cross-encoder xếp hạng lại thì giữ theo thứ tự đó, không lọc theo khoảng cách.
+        """
+        if hits and all("rerank_score" in hit for hit in hits):
+            selected = hits[:3]
+        else:
+            scores = [hit["score"] for hit in hits]
+            score_threshold = np.mean(scores) if scores else float('inf')
+            selected = [hit for hit in hits if hit["score"] <= score_threshold * 1.2][:3]
+        if config.RAG_MERGE_ADJACENT_CHUNKS:
+            selected = merge_adjacent_hits(selected, config.CHUNK_OVERLAP)
+        return [hit["content"] for hit in selected]
+
+    async def retrieve_batch(
+        self,
+        questions: List[str],
+        k: int = 5,
+        search_filter: Optional[SearchFilter] = None,
+        diversify: bool = False
+    ) -> List[List[Dict[str, Any]]]:
+        """Tìm top-k chunk cho nhiều câu hỏi: encode một lần theo batch, một lần index.search.
+
+        Với diversify, mỗi câu hỏi lấy nhiều ứng viên hơn rồi chọn lại k chunk bằng MMR.
+        """
+        with self._track_query():
+            return await self._retrieve_batch(questions, k, search_filter, diversify)
+
+    async def _retrieve_batch(
+        self,
+        questions: List[str],
+        k: int,
+        search_filter: Optional[SearchFilter],
+        diversify: bool
+    ) -> List[List[Dict[str, Any]]]:
+        """Phần thân của retrieve_batch."""
+        snapshot = self._snapshot
+        if not questions or snapshot.is_empty():
+            return [[] for _ in questions]
+        
+        chunk_ids = await self._resolve_filter_ids(search_filter, snapshot.chunk_store)
+        if chunk_ids is not None and chunk_ids.size == 0:
+            return [[] for _ in questions]
+        
+        with span("rag.encode_queries", num_queries=len(questions)):
+            query_embeddings = await run_inference(self._encode_queries, questions)
+        fetch_k = self._fetch_k(k, diversify)
+        with span("rag.search", k=fetch_k, num_queries=len(questions)):
+            D, I = await self._search_snapshot(query_embeddings, fetch_k, snapshot, chunk_ids)
+        hits_per_question = self._resolve_hits(I, D, snapshot.chunk_store)
+        if diversify:
+            hits_per_question = [
+                await self._rerank_hits(question, hits) for question, hits in zip(questions, hits_per_question)
+            ]
+        if diversify and config.RAG_MMR_ENABLED:
+            hits_per_question = [
+                await run_inference(self._diversify_hits, query_vector, hits, snapshot, k)
+                for query_vector, hits in zip(query_embeddings, hits_per_question)
             ]
+        elif diversify:
+            # Reranker có thể đã lấy thêm ứng viên: chỉ trả về k hit đầu
+            hits_per_question = [hits[:k] for hits in hits_per_question]
+        return hits_per_question
+
+    async def query_batch(
+        self,
+        questions: List[str],
+        k: int = 5,
+        generate: bool = False,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Dict[str, Any]:
+        """Truy vấn nhiều câu hỏi cùng lúc, tùy chọn sinh câu trả lời bằng LLM cho từng câu hỏi."""
+        with self._track_query():
+            return await self._query_batch(questions, k, generate, search_filter)
+
+    async def _query_batch(
+        self,
+        questions: List[str],
+        k: int,
+        generate: bool,
+        search_filter: Optional[SearchFilter]
+    ) -> Dict[str, Any]:
+        """Phần thân của query_batch."""
+        start_time = time.perf_counter()
+        hits_per_question = await self.retrieve_batch(questions, k, search_filter, diversify=generate)
+        retrieval_ms = (time.perf_counter() - start_time) * 1000
+        
+        results = [
+            {"question": question, "chunks": hits}
+            for question, hits in zip(questions, hits_per_question)
+        ]
+        
+        generation_ms = 0.0
+        if generate:
+            generation_start = time.perf_counter()
+            semaphore = asyncio.Semaphore(config.RAG_BATCH_GENERATION_CONCURRENCY)
             
-            context = "\n\n".join(filtered_chunks[:3])
+            async def answer(result: Dict[str, Any]) -> None:
+                chunks = result["chunks"]
+                if not chunks:
+                    result["response"] = "Không tìm thấy thông tin liên quan trong tài liệu đã upload."
+                    return
+                context_chunks = self._context_from_hits(chunks)
+                async with semaphore:
+                    result["response"] = await self.llm.generateContent(
+                        prompt=result["question"],
+                        rag_response="\n\n".join(context_chunks)
+                    )
             
+            await asyncio.gather(*(answer(result) for result in results))
+            generation_ms = (time.perf_counter() - generation_start) * 1000
+        
+        logger.info(
+            f"Batch query of {len(questions)} questions: retrieval {retrieval_ms:.1f}ms, "
+            f"generation {generation_ms:.1f}ms"
+        )
+        return {
+            "results": results,
+            "num_questions": len(questions),
+            "timings_ms": {
+                "retrieval": round(retrieval_ms, 3),
+                "generation": round(generation_ms, 3),
+            },
+        }
+
+    @traced("rag.retrieve")
+    async def _retrieve_context(
+        self,
+        question: str,
+        k: int = 5,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Tìm ngữ cảnh cho câu hỏi; trả về (context, None) hoặc (None, thông báo cho người dùng)."""
+        snapshot = self._snapshot
+        if snapshot.is_empty():
+            if not self.is_rebuilding() and self.vector_db.count_chunks(self.collection_id) == 0:
+                return None, "Không có dữ liệu để truy vấn. Vui lòng upload tài liệu trước."
+            if not self.is_rebuilding():
+                logger.info("Index is empty, starting background rebuild from database...")
+                self.schedule_rebuild()
+            return None, "Index đang được xây dựng, vui lòng thử lại sau giây lát."
+        
+        chunk_ids = await self._resolve_filter_ids(search_filter, snapshot.chunk_store)
+        if chunk_ids is not None and chunk_ids.size == 0:
+            return None, "Không có tài liệu nào khớp với bộ lọc đã chọn."
+        
+        with span("rag.encode_query"):
+            query_embedding = (await self.query_embedder.encode(question)).reshape(1, -1)
+        fetch_k = self._fetch_k(k, True)
+        with span("rag.search", k=fetch_k, num_vectors=snapshot.num_vectors, filtered=chunk_ids is not None,
+                  exact_rerank=snapshot.vector_store is not None):
+            D, I = await self._search_snapshot(query_embedding, fetch_k, snapshot, chunk_ids)
+        
+        with span("rag.resolve_hits") as resolve_span:
+            hits = self._resolve_hits(I, D, snapshot.chunk_store)[0]
+            resolve_span.set_attribute("num_hits", len(hits))
+        
+        if not hits:
+            return None, "Không tìm thấy thông tin liên quan trong tài liệu đã upload."
+        
+        num_candidates = len(hits)
+        hits = await self._rerank_hits(question, hits)
+        if config.RAG_MMR_ENABLED:
+            with span("rag.diversify", num_candidates=len(hits)):
+                hits = await run_inference(self._diversify_hits, query_embedding[0], hits, snapshot, k)
+        filtered_chunks = self._context_from_hits(hits)
+        
+        try:
+            logger.info(f"Found {num_candidates} candidate chunks, kept {len(hits)}, using {len(filtered_chunks)} passages")
+        except UnicodeEncodeError:
+            logger.info(f"Found {num_candidates} candidate chunks")
+        
+        return "\n\n".join(filtered_chunks), None
+
+    @traced("rag.query")
+    async def query(self, question: str, k: int = 5, search_filter: Optional[SearchFilter] = None) -> str:
+        """Truy vấn hệ thống RAG với câu hỏi đầu vào và trả về câu trả lời."""
+        with self._track_query():
             try:
-                logger.info(f"Found {len(context_chunks)} relevant chunks, using {len(filtered_chunks[:3])}")
-            except UnicodeEncodeError:
-                logger.info(f"Found {len(context_chunks)} relevant chunks")
-            
-            response = await self.llm.generateContent(
-                prompt=question,
-                rag_response=context
-            )
+                context, message = await self._retrieve_context(question, k, search_filter)
+                if context is None:
+                    return message
+                
+                response = await self.llm.generateContent(
+                    prompt=question,
+                    rag_response=context
+                )
+                
+                return response
+                
+            except Exception as e:
+                logger.error(f"Error in RAG query: {str(e)}", exc_info=True)
+                return f"Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi: {str(e)}"
+
+    async def query_stream(
+        self,
+        question: str,
+        k: int = 5,
+        search_filter: Optional[SearchFilter] = None
+    ) -> AsyncIterator[str]:
+        """Giống query nhưng trả từng đoạn câu trả lời ngay khi LLM sinh ra."""
+        with self._track_query():
+            try:
+                context, message = await self._retrieve_context(question, k, search_filter)
+            except Exception as e:
+                logger.error(f"Error in RAG query: {str(e)}", exc_info=True)
+                yield f"Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi: {str(e)}"
+                return
             
-            return response
+            if context is None:
+                yield message
+                return
             
-        except Exception as e:
-            logger.error(f"Error in RAG query: {str(e)}", exc_info=True)
-            return f"Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi: {str(e)}"
+            async for text in self.llm.generateContentStream(prompt=question, rag_response=context):
+                yield text
 
     def get_index_statistics(self) -> Dict[str, Any]:
         """Lấy thống kê về FAISS index."""
@@ -336,9 +1503,53 @@ class RAGService:
         
         stats = get_index_info(self.index)
         stats.update({
+            "collection_id": self.collection_id,
             "mapping_size": len(self.chunk_id_mapping),
+            "mapping_memory": self.chunk_id_mapping.memory_usage(),
+            "index_tier": self.index_metadata.get("index_tier"),
+            "search_params": self.index_metadata.get("search_params"),
+            "vector_compression": self.index_metadata.get("vector_compression", COMPRESSION_NONE),
+            "exact_vectors_memory": (
+                self._snapshot.vector_store.memory_usage() if self._snapshot.vector_store is not None else None
+            ),
+            "embedding_backend": self.embedding_backend,
+            "embedding_agreement": getattr(self.model, 'agreement', None),
             "optimal_batch_size": self.optimal_batch_size,
             "gpu_available": self.use_gpu,
         })
         
+        stats["snapshot"] = self._snapshot.describe()
+        stats["previous_snapshot"] = (
+            self._previous_snapshot.describe() if self._previous_snapshot is not None else None
+        )
+        manifest = read_manifest(self.collection_id)
+        stats["worker"] = {
+            "pid": os.getpid(),
+            "generation": self._snapshot.generation,
+            "manifest_generation": manifest["generation"] if manifest else None,
+            "last_reload_at": self._last_reload_at,
+            "reload_poll_seconds": config.INDEX_RELOAD_POLL_SECONDS,
+        }
+        stats["rebuild_in_progress"] = self.is_rebuilding()
+        stats["last_build"] = self._last_build
+        reranker = get_reranker()
+        stats["reranker"] = reranker.get_stats() if reranker is not None else None
+        stats["query_batching"] = self.query_embedder.get_stats()
+        stats["inference_executor"] = inference_executor.get_stats()
+        if self.embedder.cache is not None:
+            stats["embedding_cache"] = self.embedder.cache.get_stats()
+        if self.embedder.query_cache is not None:
+            stats["query_embedding_cache"] = self.embedder.query_cache.get_stats()
+        
         return stats
+
+    async def close(self) -> None:
+        """Dừng các task nền của riêng service này (dùng khi evict collection)."""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        await self.query_embedder.shutdown()
+
+    async def shutdown(self) -> None:
+        """Dừng các worker nền của RAGService."""
+        await self.close()
+        inference_executor.shutdown(wait=False)
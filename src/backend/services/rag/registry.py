@@ -0,0 +1,241 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config.app_config import AppConfig
+from services.rag.rag import RAGService
+from services.rag.embedding_backends import (
+    TORCH_BACKEND, TorchEmbeddingBackend, create_embedding_backend, check_backend_agreement
+)
+from utils.faiss_utils import estimate_index_memory
+from utils.collection_utils import DEFAULT_COLLECTION, collection_upload_dir, validate_collection_id
+from services.rag.executor import run_inference
+
+config = AppConfig()
+
+logger = logging.getLogger(__name__)
+
+
+class RAGServiceRegistry:
+    """Registry dùng chung cho toàn process: một model embedding, một index, một mapping.
+
+    Mọi router và AppManager lấy RAGService qua registry này thay vì tự khởi tạo,
+    nên upload file và truy vấn luôn dùng cùng một index.
+
+    Collection khác mặc định có RAGService riêng (index riêng, chung model), được
+    load khi có request đầu tiên và bị evict theo LRU hoặc khi nhàn rỗi quá lâu,
+    nên bộ nhớ chỉ tỉ lệ với số collection đang hoạt động.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._model: Optional[Any] = None
+        self._rag_service: Optional[RAGService] = None
+        self._collections: "OrderedDict[str, RAGService]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._collections_lock: Optional[asyncio.Lock] = None
+
+    def get_embedding_model(self) -> Any:
+        """Lấy embedding backend dùng chung, load ở lần gọi đầu tiên."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load_embedding_backend()
+        return self._model
+
+    def _load_embedding_backend(self) -> Any:
+        """Load backend theo cấu hình và kiểm tra độ khớp với PyTorch nếu khác torch.
+
+        Nếu cosine nhỏ nhất thấp hơn ngưỡng, dùng lại PyTorch để không làm giảm
+        chất lượng tìm kiếm.
+        """
+        logger.info(f"Loading embedding model {config.EMBEDDING_MODEL} ({config.EMBEDDING_BACKEND} backend)...")
+        try:
+            backend = create_embedding_backend(
+                config.EMBEDDING_BACKEND,
+                config.EMBEDDING_MODEL,
+                config.EMBEDDING_ONNX_DIR,
+                config.EMBEDDING_ONNX_THREADS
+            )
+        except ImportError as e:
+            logger.error(f"{e}, falling back to {TORCH_BACKEND} backend")
+            return TorchEmbeddingBackend(config.EMBEDDING_MODEL)
+
+        if backend.name == TORCH_BACKEND or not config.EMBEDDING_VERIFY_BACKEND:
+            return backend
+
+        reference = TorchEmbeddingBackend(config.EMBEDDING_MODEL)
+        agreement = check_backend_agreement(backend, reference, config.EMBEDDING_AGREEMENT_THRESHOLD)
+        logger.info(f"Embedding backend agreement with {TORCH_BACKEND}: {agreement}")
+        if not agreement["passed"]:
+            logger.error(
+                f"{backend.name} backend min cosine {agreement['min_cosine']} is below "
+                f"{agreement['threshold']}, falling back to {TORCH_BACKEND} backend"
+            )
+            reference.agreement = agreement
+            return reference
+        backend.agreement = agreement
+        return backend
+
+    def get_rag_service(self) -> RAGService:
+        """Lấy RAGService dùng chung, khởi tạo ở lần gọi đầu tiên.
+
+        Lần gọi đầu load model và index (chặn luồng gọi); code async dùng load_rag_service().
+        """
+        if self._rag_service is None:
+            model = self.get_embedding_model()
+            with self._lock:
+                if self._rag_service is None:
+                    self._rag_service = RAGService(upload_dir=config.UPLOAD_DIR, model=model)
+        return self._rag_service
+
+    async def load_rag_service(self) -> RAGService:
+        """Như get_rag_service nhưng load model và index trên inference executor, không chặn event loop."""
+        if self._rag_service is not None:
+            return self._rag_service
+        return await run_inference(self.get_rag_service)
+
+    def is_initialized(self) -> bool:
+        """Kiểm tra RAGService đã được khởi tạo chưa."""
+        return self._rag_service is not None
+
+    async def get_collection_service(self, collection_id: str) -> RAGService:
+        """Lấy RAGService của collection, load index khi cần và evict collection ít dùng nhất."""
+        validate_collection_id(collection_id)
+        if collection_id == DEFAULT_COLLECTION:
+            return await self.load_rag_service()
+
+        if self._collections_lock is None:
+            self._collections_lock = asyncio.Lock()
+        async with self._collections_lock:
+            service = self._collections.get(collection_id)
+            if service is None:
+                logger.info(f"Loading index of collection '{collection_id}'")
+                model = await run_inference(self.get_embedding_model)
+                service = await run_inference(
+                    RAGService, collection_upload_dir(collection_id), model, collection_id
+                )
+                service.start_index_watcher()
+                self._collections[collection_id] = service
+            self._collections.move_to_end(collection_id)
+            self._last_used[collection_id] = time.time()
+            evicted = self._pop_evictable(keep=collection_id)
+
+        for evicted_id, evicted_service in evicted:
+            logger.info(f"Evicted index of collection '{evicted_id}'")
+            await evicted_service.close()
+        return service
+
+    def _pop_evictable(self, keep: str) -> List[Any]:
+        """Gỡ các collection vượt RAG_MAX_ACTIVE_COLLECTIONS (LRU) hoặc nhàn rỗi quá lâu."""
+        now = time.time()
+        evicted = []
+        for collection_id in list(self._collections):
+            if collection_id == keep:
+                continue
+            over_capacity = len(self._collections) > max(1, config.RAG_MAX_ACTIVE_COLLECTIONS)
+            idle = (
+                config.RAG_COLLECTION_IDLE_SECONDS > 0
+                and now - self._last_used.get(collection_id, now) > config.RAG_COLLECTION_IDLE_SECONDS
+            )
+            service = self._collections[collection_id]
+            # Service đang cập nhật index hoặc có truy vấn đang chạy được giữ lại tới lần evict sau
+            if (over_capacity or idle) and not service.is_busy():
+                evicted.append((collection_id, self._collections.pop(collection_id)))
+                self._last_used.pop(collection_id, None)
+        return evicted
+
+    def active_collections(self) -> List[Dict[str, Any]]:
+        """Các collection đang có index trong bộ nhớ, từ ít dùng tới dùng gần nhất."""
+        return [
+            {
+                "collection_id": collection_id,
+                "num_vectors": service._snapshot.num_vectors,
+                "last_used_at": self._last_used.get(collection_id),
+            }
+            for collection_id, service in self._collections.items()
+        ]
+
+    async def shutdown_collections(self) -> None:
+        """Dừng task nền của mọi collection đang load."""
+        collections = list(self._collections.values())
+        self._collections.clear()
+        self._last_used.clear()
+        for service in collections:
+            await service.close()
+
+    def get_memory_footprint(self) -> Dict[str, Any]:
+        """Ước lượng bộ nhớ dùng bởi model, index và chunk mapping."""
+        footprint: Dict[str, Any] = {
+            "model_loaded": self._model is not None,
+            "service_initialized": self._rag_service is not None,
+            "model_bytes": 0,
+            "index_bytes": 0,
+            "mapping_bytes": 0,
+        }
+
+        if self._model is not None:
+            footprint["model_bytes"] = self._model.memory_bytes()
+            footprint["embedding_backend"] = self._model.name
+
+        service = self._rag_service
+        if service is not None:
+            if service.index is not None:
+                index_bytes = estimate_index_memory(service.index)
+                footprint["index_mmapped"] = service._snapshot.mmapped
+                if service._snapshot.mmapped:
+                    # Index map từ file: nằm trong page cache dùng chung giữa các worker
+                    footprint["index_mapped_bytes"] = index_bytes
+                else:
+                    footprint["index_bytes"] = index_bytes
+            mapping_memory = service.chunk_id_mapping.memory_usage()
+            footprint["mapping_bytes"] = mapping_memory["overlay_bytes"]
+            footprint["mapping_mapped_bytes"] = mapping_memory["mapped_bytes"]
+            vector_store = service.vector_store
+            if vector_store is not None:
+                # Vector chính xác để re-rank: map từ file, chỉ các dòng được đọc nằm trong page cache
+                vector_memory = vector_store.memory_usage()
+                footprint["mapping_bytes"] += vector_memory["overlay_bytes"]
+                footprint["exact_vectors_mapped_bytes"] = vector_memory["mapped_bytes"]
+
+        collections = []
+        for collection_id, collection_service in list(self._collections.items()):
+            entry = {"collection_id": collection_id, "index_bytes": 0, "index_mapped_bytes": 0}
+            if collection_service.index is not None:
+                index_bytes = estimate_index_memory(collection_service.index)
+                entry["index_mapped_bytes" if collection_service._snapshot.mmapped else "index_bytes"] = index_bytes
+            entry["mapping_bytes"] = collection_service.chunk_id_mapping.memory_usage()["overlay_bytes"]
+            collections.append(entry)
+        footprint["collections"] = collections
+        footprint["collections_bytes"] = sum(entry["index_bytes"] + entry["mapping_bytes"] for entry in collections)
+
+        footprint["total_bytes"] = (
+            footprint["model_bytes"] + footprint["index_bytes"] + footprint["mapping_bytes"]
+            + footprint["collections_bytes"]
+        )
+        footprint["total_mb"] = round(footprint["total_bytes"] / (1024 ** 2), 2)
+
+        try:
+            import psutil
+            footprint["process_rss_mb"] = round(psutil.Process(os.getpid()).memory_info().rss / (1024 ** 2), 2)
+        except ImportError:
+            logger.debug("psutil not available, skipping process RSS")
+
+        return footprint
+
+
+rag_registry = RAGServiceRegistry()
+
+
+async def get_rag_service() -> RAGService:
+    """Lấy RAGService dùng chung của process (lần đầu được load trên inference executor)."""
+    return await rag_registry.load_rag_service()
+
+
+async def get_collection_service(collection_id: str) -> RAGService:
+    """Lấy RAGService của một collection."""
+    return await rag_registry.get_collection_service(collection_id)
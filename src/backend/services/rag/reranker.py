@@ -0,0 +1,140 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.app_config import AppConfig
+
+config = AppConfig()
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Chấm lại top-N ứng viên bằng cross-encoder nhỏ trên CPU.
+
+    Mỗi lần rerank chấm mọi cặp (câu hỏi, chunk) chưa có trong cache bằng một
+    lượt forward theo batch. Điểm được cache theo (hash câu hỏi, chunk id) với
+    giới hạn LRU, nên câu hỏi lặp lại không phải chạy model lần nữa.
+    Model được load ở lần dùng đầu tiên.
+    """
+
+    def __init__(self, model_name: str, top_n: int = 20, cache_size: int = 10000, max_length: int = 512) -> None:
+        self.model_name = model_name
+        self.top_n = max(1, top_n)
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self._model: Optional[Any] = None
+        self._load_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._stats = {"calls": 0, "scored_pairs": 0, "cache_hits": 0, "timeouts": 0, "model_ms": 0.0}
+
+    def _get_model(self) -> Any:
+        """Load cross-encoder trên CPU ở lần gọi đầu tiên."""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    logger.info(f"Loading cross-encoder reranker {self.model_name}...")
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+        return self._model
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        """Khóa cache của câu hỏi (đã bỏ khoảng trắng hai đầu)."""
+        return hashlib.sha1(query.strip().encode('utf-8')).hexdigest()
+
+    def score(self, query: str, hits: List[Dict[str, Any]]) -> np.ndarray:
+        """Điểm cross-encoder của từng hit; chỉ các cặp chưa cache được đưa vào model (một batch)."""
+        key = self.query_key(query)
+        scores = np.empty(len(hits), dtype='float32')
+        missing = []
+        with self._cache_lock:
+            for position, hit in enumerate(hits):
+                cached = self._cache.get((key, hit["chunk_id"]))
+                if cached is None:
+                    missing.append(position)
+                else:
+                    self._cache.move_to_end((key, hit["chunk_id"]))
+                    scores[position] = cached
+            self._stats["calls"] += 1
+            self._stats["cache_hits"] += len(hits) - len(missing)
+
+        if missing:
+            start = time.perf_counter()
+            pairs = [(query, hits[position]["content"]) for position in missing]
+            predicted = np.asarray(
+                self._get_model().predict(pairs, batch_size=len(pairs), show_progress_bar=False),
+                dtype='float32'
+            ).reshape(-1)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._cache_lock:
+                for position, value in zip(missing, predicted):
+                    scores[position] = value
+                    self._cache[(key, hits[position]["chunk_id"])] = float(value)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self._stats["scored_pairs"] += len(missing)
+                self._stats["model_ms"] += elapsed_ms
+        return scores
+
+    def rerank(self, query: str, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Sắp xếp lại top-N hit theo điểm cross-encoder (hit mới có thêm rerank_score).
+
+        Chỉ trả về N hit đã chấm; hit gốc không bị sửa.
+        """
+        candidates = hits[:self.top_n]
+        if not candidates:
+            return []
+        scores = self.score(query, candidates)
+        order = np.argsort(-scores, kind='stable')
+        return [{**candidates[position], "rerank_score": float(scores[position])} for position in order]
+
+    def record_timeout(self) -> None:
+        """Đếm lần rerank vượt giới hạn thời gian (kết quả vẫn được cache khi xong)."""
+        with self._cache_lock:
+            self._stats["timeouts"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê cho /rag/index-stats."""
+        with self._cache_lock:
+            stats = dict(self._stats)
+            stats["cache_size"] = len(self._cache)
+        stats["model"] = self.model_name
+        stats["model_loaded"] = self._model is not None
+        stats["top_n"] = self.top_n
+        stats["model_ms"] = round(stats["model_ms"], 3)
+        return stats
+
+
+_reranker: Optional[CrossEncoderReranker] = None
+_reranker_unavailable = False
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Optional[CrossEncoderReranker]:
+    """Reranker dùng chung cho mọi RAGService, None nếu tắt hoặc thiếu sentence-transformers."""
+    global _reranker, _reranker_unavailable
+    if not config.RAG_RERANKER_ENABLED or _reranker_unavailable:
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                try:
+                    import sentence_transformers  # noqa: F401
+                except ImportError:
+                    logger.error("sentence-transformers is not installed, cross-encoder reranking disabled")
+                    _reranker_unavailable = True
+                    return None
+                _reranker = CrossEncoderReranker(
+                    config.RAG_RERANKER_MODEL,
+                    top_n=config.RAG_RERANKER_TOP_N,
+                    cache_size=config.RAG_RERANKER_CACHE_SIZE
+                )
+    return _reranker
@@ -0,0 +1,352 @@
+import os
+import re
+import json
+import shutil
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "segments.json"
+
+_SEGMENT_FILE_PATTERN = re.compile(r'^(seg-\d+\.|deleted-\d+\.npy$)')
+
+
+def load_array(path: str, mmap_mode: Optional[str]) -> np.ndarray:
+    """Load file .npy, map từ đĩa khi có thể (mảng rỗng không map được)."""
+    try:
+        return np.load(path, mmap_mode=mmap_mode)
+    except (ValueError, OSError):
+        return np.load(path)
+
+
+def load_raw(path: str, dtype: str, shape: Tuple[int, ...], mmap: bool) -> np.ndarray:
+    """Map (hoặc đọc) file nhị phân thô có kiểu và kích thước biết trước (file rỗng không map được)."""
+    if os.path.getsize(path) == 0:
+        return np.empty(shape, dtype=dtype)
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+    return np.fromfile(path, dtype=dtype).reshape(shape)
+
+
+def write_array(path: str, array: np.ndarray) -> None:
+    """Ghi mảng ra file .npy qua file tạm rồi os.replace."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def write_json(path: str, data: Any) -> None:
+    """Ghi JSON qua file tạm rồi os.replace."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def write_state(
+    directory: str,
+    segment_names: List[str],
+    deleted_name: Optional[str],
+    next_segment: int,
+    **extra: Any
+) -> None:
+    """Ghi segments.json (danh sách segment, file tombstone và các trường riêng của store)."""
+    write_json(os.path.join(directory, STATE_FILE), {
+        "segments": segment_names,
+        "deleted": deleted_name,
+        "next_segment": next_segment,
+        **extra,
+    })
+
+
+def segment_name(number: int) -> str:
+    """Tên segment thứ number trong thư mục store."""
+    return f"seg-{number:06d}"
+
+
+def link_or_copy(source: str, target: str) -> None:
+    """Hard-link file sang thư mục khác, copy nếu không link được (khác filesystem)."""
+    if os.path.exists(target):
+        return
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class Segment:
+    """Một segment bất biến trên đĩa: cột ids.npy (chunk id tăng dần) cùng các file dữ liệu của store."""
+
+    FILES: Tuple[str, ...] = ("ids.npy",)
+
+    def __init__(self, name: str, ids: np.ndarray) -> None:
+        self.name = name
+        self.ids = ids
+
+    def file_names(self) -> List[str]:
+        return [f"{self.name}.{suffix}" for suffix in self.FILES]
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def position(self, chunk_id: int) -> int:
+        """Vị trí của chunk id trong segment, -1 nếu không có."""
+        if self.ids.shape[0] == 0:
+            return -1
+        position = int(np.searchsorted(self.ids, chunk_id))
+        if position < self.ids.shape[0] and int(self.ids[position]) == chunk_id:
+            return position
+        return -1
+
+    def positions(self, chunk_ids: np.ndarray) -> np.ndarray:
+        """Vị trí của từng chunk id trong segment (-1 nếu không có)."""
+        positions = np.full(chunk_ids.shape[0], -1, dtype='int64')
+        if self.ids.shape[0] == 0 or chunk_ids.shape[0] == 0:
+            return positions
+        candidates = np.minimum(np.searchsorted(self.ids, chunk_ids), self.ids.shape[0] - 1)
+        found = np.asarray(self.ids)[candidates] == chunk_ids
+        positions[found] = candidates[found]
+        return positions
+
+    def live_positions(self, dead: np.ndarray) -> np.ndarray:
+        """Vị trí các dòng chưa bị xóa (theo danh sách id đã xóa)."""
+        keep = np.arange(len(self))
+        if dead.shape[0]:
+            keep = keep[~np.isin(self.ids, dead)]
+        return keep
+
+    def nbytes(self) -> int:
+        return int(np.asarray(self.ids).nbytes)
+
+
+class SegmentedStore:
+    """Phần chung của các store dạng cột theo chunk id (ChunkStore, VectorStore).
+
+    Định dạng trên đĩa (một thư mục):
+    - seg-NNNNNN.*: các segment bất biến, mỗi segment có ids.npy (int64 đã sắp
+      xếp) và các file dữ liệu cùng thứ tự
+    - deleted-NNNNNN.npy: chunk id đã xóa khỏi các segment (tombstone)
+    - segments.json: danh sách segment và file tombstone đang dùng, ghi sau cùng
+
+    Các thay đổi gia tăng (add/remove) được giữ trong overlay nhỏ trên bộ nhớ.
+    save() chỉ ghi overlay thành một segment mới cùng tombstone, các segment cũ
+    được giữ nguyên (hard-link khi lưu sang thư mục khác). Khi có quá nhiều
+    segment hoặc quá nhiều dòng đã xóa, các segment được gộp lại thành một.
+
+    Lớp con định nghĩa _load_segment() và _write_segment() cho các cột của mình.
+    """
+
+    _SEGMENT_CLASS = Segment
+    _MAX_SEGMENTS = 8
+    _COMPACT_FRACTION = 0.25
+
+    def __init__(self) -> None:
+        self._segments: List[Segment] = []
+        self._deleted = np.empty(0, dtype='int64')
+        self._added: Dict[int, Any] = {}
+        self._removed: Set[int] = set()
+        self._next_segment = 1
+        self._mmap = True
+        self.directory: Optional[str] = None
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        """Kiểm tra thư mục có chứa một store đã lưu hay không."""
+        return os.path.exists(os.path.join(directory, STATE_FILE))
+
+    @staticmethod
+    def read_state(directory: str) -> Dict[str, Any]:
+        """Đọc segments.json của store."""
+        with open(os.path.join(directory, STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _load_segment(self, directory: str, name: str, mmap: bool) -> Segment:
+        raise NotImplementedError
+
+    def _write_segment(
+        self,
+        directory: str,
+        name: str,
+        segments: List[Segment],
+        dead: np.ndarray,
+        added: Dict[int, Any]
+    ) -> int:
+        """Ghi một segment mới từ các dòng còn sống của segments và overlay, trả về số dòng."""
+        raise NotImplementedError
+
+    def _load_state(self, directory: str, state: Dict[str, Any], mmap: bool) -> None:
+        """Map các segment và tombstone mà state trỏ tới."""
+        self._segments = [self._load_segment(directory, name, mmap) for name in state["segments"]]
+        if state.get("deleted"):
+            self._deleted = np.load(os.path.join(directory, state["deleted"]))
+        self._next_segment = int(state.get("next_segment", 1))
+        self._mmap = mmap
+        self.directory = directory
+
+    def _copy_state(self, store: "SegmentedStore") -> None:
+        """Chép trạng thái sang store khác: dùng chung các segment (chỉ đọc), sao chép overlay."""
+        store._segments = list(self._segments)
+        store._deleted = self._deleted
+        store._next_segment = self._next_segment
+        store._mmap = self._mmap
+        store._added = dict(self._added)
+        store._removed = set(self._removed)
+        store.directory = self.directory
+
+    # ==================== LOOKUP ====================
+
+    def _is_deleted(self, chunk_id: int) -> bool:
+        """Chunk id đã bị xóa khỏi các segment (tombstone đã lưu hoặc trong overlay)."""
+        if chunk_id in self._removed:
+            return True
+        position = int(np.searchsorted(self._deleted, chunk_id))
+        return position < self._deleted.shape[0] and int(self._deleted[position]) == chunk_id
+
+    def _find_base(self, chunk_id: int) -> Tuple[Optional[Segment], int]:
+        """Segment và vị trí của chunk id còn sống trên đĩa, (None, -1) nếu không có."""
+        if not self._segments or self._is_deleted(chunk_id):
+            return None, -1
+        for segment in self._segments:
+            position = segment.position(chunk_id)
+            if position >= 0:
+                return segment, position
+        return None, -1
+
+    def _find_base_many(self, chunk_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(chỉ số segment, vị trí) của từng chunk id còn sống trên đĩa, -1 nếu không có."""
+        segment_indices = np.full(chunk_ids.shape[0], -1, dtype='int64')
+        positions = np.full(chunk_ids.shape[0], -1, dtype='int64')
+        if not self._segments or chunk_ids.shape[0] == 0:
+            return segment_indices, positions
+        dead = self._dead_ids()
+        alive = ~np.isin(chunk_ids, dead) if dead.shape[0] else np.ones(chunk_ids.shape[0], dtype=bool)
+        for segment_index, segment in enumerate(self._segments):
+            todo = np.flatnonzero(alive & (segment_indices < 0))
+            if todo.size == 0:
+                break
+            found = segment.positions(chunk_ids[todo])
+            hit = found >= 0
+            segment_indices[todo[hit]] = segment_index
+            positions[todo[hit]] = found[hit]
+        return segment_indices, positions
+
+    def _dead_ids(self) -> np.ndarray:
+        """Tất cả chunk id đã xóa khỏi các segment (đã sắp xếp)."""
+        if not self._removed:
+            return self._deleted
+        removed = np.fromiter(self._removed, dtype='int64', count=len(self._removed))
+        return np.union1d(self._deleted, removed)
+
+    def __len__(self) -> int:
+        base = sum(len(segment) for segment in self._segments)
+        return base - int(self._deleted.shape[0]) - len(self._removed) + len(self._added)
+
+    def __contains__(self, chunk_id: Any) -> bool:
+        chunk_id = int(chunk_id)
+        return chunk_id in self._added or self._find_base(chunk_id)[0] is not None
+
+    def ids(self) -> np.ndarray:
+        """Danh sách tất cả chunk id hiện có, sắp xếp tăng dần."""
+        parts = [np.asarray(segment.ids) for segment in self._segments]
+        if self._added:
+            parts.append(np.fromiter(self._added.keys(), dtype='int64', count=len(self._added)))
+        if not parts:
+            return np.empty(0, dtype='int64')
+        all_ids = np.concatenate(parts)
+        dead = self._dead_ids()
+        if dead.shape[0]:
+            base_count = all_ids.shape[0] - len(self._added)
+            keep = np.ones(all_ids.shape[0], dtype=bool)
+            keep[:base_count] = ~np.isin(all_ids[:base_count], dead)
+            all_ids = all_ids[keep]
+        all_ids.sort()
+        return all_ids
+
+    # ==================== MUTATION ====================
+
+    def _put(self, chunk_id: int, value: Any) -> None:
+        """Ghi giá trị của chunk id vào overlay; dòng cùng id trên đĩa bị thay thế."""
+        if chunk_id not in self._added and self._find_base(chunk_id)[0] is not None:
+            self._removed.add(chunk_id)
+        self._added[chunk_id] = value
+
+    def remove(self, chunk_ids: Iterable[int]) -> None:
+        """Đánh dấu xóa các chunk id."""
+        for chunk_id in chunk_ids:
+            chunk_id = int(chunk_id)
+            if self._added.pop(chunk_id, None) is None and self._find_base(chunk_id)[0] is not None:
+                self._removed.add(chunk_id)
+
+    # ==================== PERSISTENCE ====================
+
+    def _save_segments(self, directory: str, **state_extra: Any) -> Tuple[List[str], bool]:
+        """Ghi overlay (hoặc gộp toàn bộ) ra directory; trả về (các segment đang dùng, có gộp hay không).
+
+        segments.json được ghi sau cùng nên process đang map bản cũ vẫn đọc được
+        dữ liệu cũ cho tới khi tự load lại. Các file segment không còn được tham
+        chiếu bị xóa (chỉ unlink, process đang map vẫn đọc được).
+        """
+        os.makedirs(directory, exist_ok=True)
+        same_directory = self.directory is not None and os.path.abspath(self.directory) == os.path.abspath(directory)
+        dead = self._dead_ids()
+        base_rows = sum(len(segment) for segment in self._segments)
+        next_segment = self._next_segment
+        compact = (
+            len(self._segments) + (1 if self._added else 0) > self._MAX_SEGMENTS
+            or dead.shape[0] > base_rows * self._COMPACT_FRACTION
+        )
+
+        segment_names: List[str] = []
+        if compact:
+            name = segment_name(next_segment)
+            next_segment += 1
+            if self._write_segment(directory, name, self._segments, dead, self._added):
+                segment_names.append(name)
+            deleted = np.empty(0, dtype='int64')
+            logger.info(f"Compacted {len(self._segments)} segments of {type(self).__name__} into one")
+        else:
+            for segment in self._segments:
+                if not same_directory:
+                    for file_name in segment.file_names():
+                        link_or_copy(os.path.join(self.directory, file_name), os.path.join(directory, file_name))
+                segment_names.append(segment.name)
+            if self._added:
+                name = segment_name(next_segment)
+                next_segment += 1
+                if self._write_segment(directory, name, [], np.empty(0, dtype='int64'), self._added):
+                    segment_names.append(name)
+            deleted = dead
+
+        deleted_name = None
+        if deleted.shape[0]:
+            deleted_name = f"deleted-{next_segment:06d}.npy"
+            next_segment += 1
+            write_array(os.path.join(directory, deleted_name), deleted)
+
+        self._before_state(directory, segment_names, compact)
+        write_state(directory, segment_names, deleted_name, next_segment, **state_extra)
+        self._remove_unreferenced(directory, segment_names, deleted_name)
+        return segment_names, compact
+
+    def _before_state(self, directory: str, segment_names: List[str], compacted: bool) -> None:
+        """Ghi các file phụ của store (ví dụ bảng tên file) ngay trước segments.json."""
+
+    def _remove_unreferenced(self, directory: str, segment_names: List[str], deleted_name: Optional[str]) -> None:
+        """Xóa các file segment/tombstone không còn được segments.json tham chiếu."""
+        keep = {f"{name}.{suffix}" for name in segment_names for suffix in self._SEGMENT_CLASS.FILES}
+        if deleted_name:
+            keep.add(deleted_name)
+        for file_name in os.listdir(directory):
+            if _SEGMENT_FILE_PATTERN.match(file_name) and file_name not in keep:
+                try:
+                    os.remove(os.path.join(directory, file_name))
+                except OSError as e:
+                    logger.warning(f"Could not remove unused segment file {file_name}: {e}")
+
+    def mapped_bytes(self) -> int:
+        """Số byte của các segment và tombstone map từ đĩa."""
+        return sum(segment.nbytes() for segment in self._segments) + int(self._deleted.nbytes)
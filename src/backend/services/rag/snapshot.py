@@ -0,0 +1,54 @@
+import time
+from typing import Any, Dict, Optional
+
+from services.rag.chunk_store import ChunkStore
+from services.rag.vector_store import VectorStore
+
+
+class IndexSnapshot:
+    """Bộ ba (FAISS index, chunk mapping, metadata) được publish cùng lúc.
+
+    Khi index lưu vector nén, snapshot giữ thêm vector_store chứa vector chính xác để re-rank.
+
+    Snapshot đã publish không bao giờ bị sửa: rebuild và cập nhật gia tăng tạo
+    snapshot mới ở chế độ shadow rồi thay tham chiếu đang dùng trong một phép
+    gán, nên truy vấn luôn thấy một index hoàn chỉnh và nhất quán với mapping.
+    """
+
+    def __init__(
+        self,
+        index: Optional[Any] = None,
+        chunk_store: Optional[ChunkStore] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        mmapped: bool = False,
+        generation: Optional[int] = None,
+        vector_store: Optional[VectorStore] = None
+    ) -> None:
+        self.index = index
+        self.vector_store = vector_store
+        self.mmapped = mmapped
+        self.generation = generation
+        self.chunk_store = chunk_store if chunk_store is not None else ChunkStore()
+        self.metadata = metadata if metadata is not None else {}
+        self.created_at = time.time()
+
+    @property
+    def num_vectors(self) -> int:
+        """Số vector trong index của snapshot."""
+        return int(self.index.ntotal) if self.index is not None else 0
+
+    def is_empty(self) -> bool:
+        """Snapshot chưa có index hoặc index rỗng."""
+        return self.num_vectors == 0
+
+    def describe(self) -> Dict[str, Any]:
+        """Thông tin tóm tắt của snapshot."""
+        return {
+            "num_vectors": self.num_vectors,
+            "mapping_size": len(self.chunk_store),
+            "index_tier": self.metadata.get("index_tier"),
+            "mmapped": self.mmapped,
+            "exact_vectors": len(self.vector_store) if self.vector_store is not None else None,
+            "generation": self.generation,
+            "created_at": self.created_at,
+        }
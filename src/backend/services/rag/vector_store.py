@@ -0,0 +1,202 @@
+import os
+import logging
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from services.rag.segments import (
+    Segment, SegmentedStore, load_array, load_raw, segment_name, write_array, write_state
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _VectorSegment(Segment):
+    """Segment của VectorStore: ids.npy và ma trận float32 (n x dim) cùng thứ tự trong vectors.f32."""
+
+    FILES = ("ids.npy", "vectors.f32")
+
+    def __init__(self, name: str, ids: np.ndarray, vectors: np.ndarray) -> None:
+        super().__init__(name, ids)
+        self.vectors = vectors
+
+    @classmethod
+    def load(cls, directory: str, name: str, dim: int) -> "_VectorSegment":
+        """Map một segment từ thư mục."""
+        prefix = os.path.join(directory, name)
+        ids = load_array(f"{prefix}.ids.npy", 'r')
+        return cls(name, ids, load_raw(f"{prefix}.vectors.f32", 'float32', (int(ids.shape[0]), dim), True))
+
+    def nbytes(self) -> int:
+        return int(np.asarray(self.ids).nbytes) + int(self.vectors.nbytes)
+
+
+class VectorStore(SegmentedStore):
+    """Vector float32 chính xác theo chunk id, memory-map từ file phụ cạnh index.
+
+    Khi index chỉ lưu mã nén (SQ8, fp16, PQ), vector gốc được giữ ở đây để
+    re-rank tập ứng viên: chỉ các dòng được đọc mới vào page cache, không nằm
+    trên heap của process.
+
+    Dùng định dạng segment chung với ChunkStore (segments.json ghi thêm số
+    chiều), nên save() sau một cập nhật gia tăng chỉ ghi vector của các chunk
+    mới và danh sách tombstone, không ghi lại toàn bộ ma trận.
+    """
+
+    _SEGMENT_CLASS = _VectorSegment
+
+    def __init__(self, dim: int) -> None:
+        super().__init__()
+        self.dim = dim
+        self._added: Dict[int, np.ndarray] = {}
+
+    @classmethod
+    def load(cls, directory: str) -> "VectorStore":
+        """Map VectorStore từ thư mục."""
+        state = cls.read_state(directory)
+        store = cls(int(state["dim"]))
+        store._load_state(directory, state, True)
+        return store
+
+    def _load_segment(self, directory: str, name: str, mmap: bool) -> _VectorSegment:
+        return _VectorSegment.load(directory, name, self.dim)
+
+    def copy(self) -> "VectorStore":
+        """Bản sao để sửa độc lập: dùng chung phần map từ đĩa, sao chép overlay."""
+        store = VectorStore(self.dim)
+        self._copy_state(store)
+        return store
+
+    def get_many(self, ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Vector của các chunk id: (ma trận float32, mask các id tìm thấy)."""
+        ids = np.asarray(ids if isinstance(ids, np.ndarray) else list(ids), dtype='int64')
+        vectors = np.zeros((ids.shape[0], self.dim), dtype='float32')
+        segment_indices, positions = self._find_base_many(ids)
+        for segment_index in np.unique(segment_indices[segment_indices >= 0]).tolist():
+            rows = np.flatnonzero(segment_indices == segment_index)
+            # Đọc theo thứ tự vị trí để truy cập file map tuần tự
+            rows = rows[np.argsort(positions[rows])]
+            vectors[rows] = self._segments[segment_index].vectors[positions[rows]]
+        found = segment_indices >= 0
+        if self._added:
+            for row, chunk_id in enumerate(ids.tolist()):
+                vector = self._added.get(chunk_id)
+                if vector is not None:
+                    vectors[row] = vector
+                    found[row] = True
+        return vectors, found
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray) -> None:
+        """Thêm (hoặc thay) vector của các chunk id vào overlay."""
+        vectors = np.asarray(vectors, dtype='float32')
+        for row, chunk_id in enumerate(ids):
+            self._put(int(chunk_id), vectors[row].copy())
+
+    def save(self, directory: str) -> "VectorStore":
+        """Lưu store ra thư mục và trả về VectorStore mới map từ đó; store hiện tại không đổi.
+
+        Chỉ overlay được ghi thành segment mới, các segment cũ được giữ nguyên
+        hoặc hard-link sang thư mục mới (xem SegmentedStore._save_segments).
+        """
+        segment_names, _ = self._save_segments(directory, dim=self.dim)
+        store = VectorStore.load(directory)
+        logger.info(
+            f"Saved {len(store)} exact vectors to {directory} "
+            f"(+{len(self._added)} -{len(self._removed)}, {len(segment_names)} segments)"
+        )
+        return store
+
+    def _write_segment(
+        self,
+        directory: str,
+        name: str,
+        segments: List[_VectorSegment],
+        dead: np.ndarray,
+        added: Dict[int, np.ndarray],
+        block_size: int = 16384
+    ) -> int:
+        """Ghi một segment mới từ các dòng còn sống của segments cũ và overlay, trả về số dòng.
+
+        Các dòng được sắp theo chunk id rồi ghi từng khối block_size dòng, nên
+        bộ nhớ dùng khi gộp không tăng theo số vector.
+        """
+        ids_parts, source_parts, position_parts = [], [], []
+        for source, segment in enumerate(segments):
+            keep = segment.live_positions(dead)
+            ids_parts.append(np.asarray(segment.ids)[keep])
+            source_parts.append(np.full(keep.shape[0], source, dtype='int64'))
+            position_parts.append(keep)
+        added_ids = np.asarray(sorted(added), dtype='int64')
+        if added_ids.size:
+            ids_parts.append(added_ids)
+            source_parts.append(np.full(added_ids.shape[0], len(segments), dtype='int64'))
+            position_parts.append(np.arange(added_ids.shape[0]))
+        ids = np.concatenate(ids_parts) if ids_parts else np.empty(0, dtype='int64')
+        if ids.shape[0] == 0:
+            return 0
+
+        order = np.argsort(ids, kind='stable')
+        sources = np.concatenate(source_parts)[order]
+        positions = np.concatenate(position_parts)[order]
+        matrices = [segment.vectors for segment in segments]
+        if added_ids.size:
+            matrices.append(np.stack([added[int(chunk_id)] for chunk_id in added_ids]))
+
+        prefix = os.path.join(directory, name)
+        vectors_tmp = f"{prefix}.vectors.f32.tmp"
+        with open(vectors_tmp, 'wb') as f:
+            for start in range(0, order.shape[0], block_size):
+                block_sources = sources[start:start + block_size]
+                block_positions = positions[start:start + block_size]
+                block = np.empty((block_sources.shape[0], self.dim), dtype='float32')
+                for source in np.unique(block_sources).tolist():
+                    rows = block_sources == source
+                    block[rows] = matrices[source][block_positions[rows]]
+                f.write(block.tobytes())
+        os.replace(vectors_tmp, f"{prefix}.vectors.f32")
+        write_array(f"{prefix}.ids.npy", ids[order])
+        return int(ids.shape[0])
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Ước lượng bộ nhớ: phần map từ đĩa và overlay riêng của process."""
+        return {
+            "mapped_bytes": self.mapped_bytes(),
+            "overlay_bytes": len(self._added) * (self.dim * 4 + 112) + len(self._removed) * 32,
+        }
+
+
+class VectorStoreWriter:
+    """Ghi VectorStore thẳng ra đĩa theo từng khối (chunk id tăng dần), dùng khi rebuild toàn bộ.
+
+    Giống ChunkStoreWriter, kết quả là một segment duy nhất; chỉ cột chunk id nằm trong bộ nhớ.
+    """
+
+    def __init__(self, directory: str, dim: int) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self._prefix = os.path.join(directory, segment_name(1))
+        self._file = open(f"{self._prefix}.vectors.f32", 'wb')
+        self._ids = array('q')
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Ghi một khối vector cùng chunk id tương ứng."""
+        ids = np.asarray(ids, dtype='int64')
+        if ids.size and ((self._ids and ids[0] <= self._ids[-1]) or np.any(np.diff(ids) <= 0)):
+            raise ValueError("Chunk ids must be appended in increasing order")
+        self._file.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+        self._ids.frombytes(ids.tobytes())
+
+    def close(self) -> VectorStore:
+        """Ghi ids và segments.json rồi trả về VectorStore map từ thư mục vừa ghi."""
+        self._file.close()
+        segment_names = []
+        if self._ids:
+            write_array(f"{self._prefix}.ids.npy", np.frombuffer(self._ids, dtype='int64'))
+            segment_names.append(segment_name(1))
+        else:
+            os.remove(f"{self._prefix}.vectors.f32")
+        write_state(self.directory, segment_names, None, 2, dim=self.dim)
+        logger.info(f"Wrote {len(self._ids)} exact vectors to {self.directory}")
+        return VectorStore.load(self.directory)
@@ -4,6 +4,8 @@ import threading
 from typing import Optional, Tuple, List
 from contextlib import contextmanager
 
+from utils.collection_utils import DEFAULT_COLLECTION
+
 
 class DatabaseManager:
     """Quản lý các operations liên quan đến database SQLite."""
@@ -23,6 +25,7 @@ class DatabaseManager:
                     self._ensure_chunks_table(cursor)
                     self._ensure_conversations_table(cursor)
                     self._ensure_messages_table(cursor)
+                    self._migrate_collections(cursor)
                     self._ensure_indexes(cursor)
                     
                     self._migrate_legacy_documents_table(cursor)
@@ -58,10 +61,12 @@ class DatabaseManager:
             cursor.execute('''
                 CREATE TABLE files (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
+                    collection_id TEXT NOT NULL DEFAULT 'default',
+                    name TEXT NOT NULL,
                     size INTEGER NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(collection_id, name)
                 )
             ''')
             print("Đã tạo table 'files'")
@@ -73,6 +78,7 @@ class DatabaseManager:
                 CREATE TABLE chunks (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     file_id INTEGER NOT NULL,
+                    collection_id TEXT NOT NULL DEFAULT 'default',
                     content TEXT NOT NULL,
                     chunk_index INTEGER NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -117,7 +123,9 @@ class DatabaseManager:
             ("idx_conversations_user_id", "CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations (user_id)"),
             ("idx_conversations_updated_at", "CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at)"),
             ("idx_messages_conversation_id", "CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id)"),
-            ("idx_messages_timestamp", "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+            ("idx_messages_timestamp", "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)"),
+            ("idx_files_collection_id", "CREATE INDEX IF NOT EXISTS idx_files_collection_id ON files (collection_id)"),
+            ("idx_chunks_collection_id", "CREATE INDEX IF NOT EXISTS idx_chunks_collection_id ON chunks (collection_id)")
         ]
         
         for index_name, create_sql in indexes:
@@ -126,6 +134,47 @@ class DatabaseManager:
             except Exception as e:
                 print(f"Lỗi khi tạo index {index_name}: {e}")
 
+    def _column_exists(self, cursor: sqlite3.Cursor, table_name: str, column_name: str) -> bool:
+        """Kiểm tra xem table có cột column_name không."""
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        return any(row[1] == column_name for row in cursor.fetchall())
+
+    def _migrate_collections(self, cursor: sqlite3.Cursor) -> None:
+        """Thêm cột collection_id cho database tạo trước khi có collection.
+
+        Table files phải được tạo lại vì ràng buộc UNIQUE(name) đổi thành
+        UNIQUE(collection_id, name); dữ liệu cũ thuộc collection mặc định.
+        """
+        if not self._column_exists(cursor, 'files', 'collection_id'):
+            print("Thêm collection_id cho table 'files'...")
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'files'")
+            sequence = cursor.fetchone()
+            cursor.execute("""
+                CREATE TABLE files_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    collection_id TEXT NOT NULL DEFAULT 'default',
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(collection_id, name)
+                )
+            """)
+            cursor.execute("""
+                INSERT INTO files_new (id, collection_id, name, size, created_at, updated_at)
+                SELECT id, ?, name, size, created_at, updated_at FROM files
+            """, (DEFAULT_COLLECTION,))
+            cursor.execute("DROP TABLE files")
+            cursor.execute("ALTER TABLE files_new RENAME TO files")
+            if sequence is not None:
+                cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'files'", (sequence[0],))
+
+        if not self._column_exists(cursor, 'chunks', 'collection_id'):
+            print("Thêm collection_id cho table 'chunks'...")
+            cursor.execute(
+                "ALTER TABLE chunks ADD COLUMN collection_id TEXT NOT NULL DEFAULT 'default'"
+            )
+
     def _migrate_legacy_documents_table(self, cursor: sqlite3.Cursor) -> None:
         """Migrate dữ liệu từ table documents cũ (nếu tồn tại) sang files và chunks."""
         if not self._table_exists(cursor, 'documents'):
@@ -177,13 +226,16 @@ class DatabaseManager:
     def check_file_changed(
         self, 
         file_name: str, 
-        content_size: int
+        content_size: int,
+        collection_id: str = DEFAULT_COLLECTION
     ) -> Tuple[bool, Optional[int]]:
         """Kiểm tra xem file đã thay đổi so với bản lưu trữ trong database chưa."""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT id, size FROM files WHERE name = ?", (file_name,))
+                cursor.execute(
+                    "SELECT id, size FROM files WHERE collection_id = ? AND name = ?", (collection_id, file_name)
+                )
                 result = cursor.fetchone()
                 
                 if not result:
@@ -203,20 +255,30 @@ class DatabaseManager:
             print(f"Lỗi khi kiểm tra file {file_name}: {str(e)}")
             return True, None
 
-    def update_file_metadata(self, file_name: str, content_size: int) -> int:
+    def update_file_metadata(
+        self,
+        file_name: str,
+        content_size: int,
+        collection_id: str = DEFAULT_COLLECTION
+    ) -> int:
         """Cập nhật thông tin metadata của file trong database."""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
-                    INSERT OR REPLACE INTO files (name, size, created_at, updated_at)
-                    VALUES (?, ?, 
-                        COALESCE((SELECT created_at FROM files WHERE name = ?), CURRENT_TIMESTAMP),
+                    INSERT OR REPLACE INTO files (collection_id, name, size, created_at, updated_at)
+                    VALUES (?, ?, ?, 
+                        COALESCE(
+                            (SELECT created_at FROM files WHERE collection_id = ? AND name = ?),
+                            CURRENT_TIMESTAMP
+                        ),
                         CURRENT_TIMESTAMP)
-                """, (file_name, content_size, file_name))
+                """, (collection_id, file_name, content_size, collection_id, file_name))
                 
-                cursor.execute("SELECT id FROM files WHERE name = ?", (file_name,))
+                cursor.execute(
+                    "SELECT id FROM files WHERE collection_id = ? AND name = ?", (collection_id, file_name)
+                )
                 result = cursor.fetchone()
                 
                 conn.commit()
@@ -225,7 +287,12 @@ class DatabaseManager:
             print(f"Lỗi khi cập nhật metadata file {file_name}: {str(e)}")
             raise
 
-    def update_file_chunks(self, file_id: int, chunks: List[str]) -> None:
+    def update_file_chunks(
+        self,
+        file_id: int,
+        chunks: List[str],
+        collection_id: str = DEFAULT_COLLECTION
+    ) -> None:
         """Cập nhật các chunks của file trong database."""
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -233,13 +300,13 @@ class DatabaseManager:
             
             for chunk_index, chunk in enumerate(chunks):
                 cursor.execute("""
-                    INSERT INTO chunks (file_id, content, chunk_index, created_at)
-                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                """, (file_id, chunk, chunk_index))
+                    INSERT INTO chunks (file_id, collection_id, content, chunk_index, created_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """, (file_id, collection_id, chunk, chunk_index))
             
             conn.commit()
 
-    def delete_file_from_db(self, file_name: str) -> None:
+    def delete_file_from_db(self, file_name: str, collection_id: str = DEFAULT_COLLECTION) -> None:
         """Xóa dữ liệu của file khỏi database."""
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -247,7 +314,9 @@ class DatabaseManager:
             try:
                 cursor.execute("BEGIN TRANSACTION")
                 
-                cursor.execute("SELECT id FROM files WHERE name = ?", (file_name,))
+                cursor.execute(
+                    "SELECT id FROM files WHERE collection_id = ? AND name = ?", (collection_id, file_name)
+                )
                 result = cursor.fetchone()
                 
                 if result:
@@ -298,11 +367,11 @@ class DatabaseManager:
                 "database_size": os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
             }
 
-    def get_file_modification_times(self) -> dict:
-        """Lấy thời gian modification của tất cả files từ database."""
+    def get_file_modification_times(self, collection_id: str = DEFAULT_COLLECTION) -> dict:
+        """Lấy thời gian modification của tất cả files trong collection từ database."""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT name, updated_at FROM files")
+            cursor.execute("SELECT name, updated_at FROM files WHERE collection_id = ?", (collection_id,))
             
             file_mtimes = {}
             for row in cursor.fetchall():
@@ -1,10 +1,12 @@
 import os
 import threading
-from typing import List, Tuple, Optional
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Tuple, Optional
 
 from .database_manager import DatabaseManager
 from .text_processor import TextProcessor
 from services.file import get_async_file_processor
+from utils.collection_utils import DEFAULT_COLLECTION
 
 
 class VectorDBService:
@@ -73,21 +75,21 @@ class VectorDBService:
         """Thiết lập độ chồng lấn chunk mới."""
         return self.text_processor.set_chunk_overlap(chunk_overlap)
 
-    async def process_file(self, file_path: str) -> None:
+    async def process_file(self, file_path: str, collection_id: str = DEFAULT_COLLECTION) -> None:
         """Xử lý file và lưu vào database nếu nội dung thay đổi."""
-        return await self.file_processor.process_file(file_path)
+        return await self.file_processor.process_file(file_path, collection_id)
 
     async def update_from_upload(self) -> None:
         """Đồng bộ dữ liệu từ thư mục upload vào VectorDB."""
         return await self.file_processor.update_from_upload()
 
-    def delete_file_from_db(self, file_name: str) -> None:
+    def delete_file_from_db(self, file_name: str, collection_id: str = DEFAULT_COLLECTION) -> None:
         """Xóa dữ liệu của file khỏi database."""
-        return self.database_manager.delete_file_from_db(file_name)
+        return self.database_manager.delete_file_from_db(file_name, collection_id)
 
-    def delete_file(self, file_name: str) -> None:
+    def delete_file(self, file_name: str, collection_id: str = DEFAULT_COLLECTION) -> None:
         """Xóa file khỏi cả database và filesystem."""
-        return self.file_processor.delete_file(file_name)
+        return self.file_processor.delete_file(file_name, collection_id)
 
     def get_chunk_by_id(self, doc_id: int) -> Optional[str]:
         """Lấy nội dung chunk dựa trên ID."""
@@ -97,19 +99,142 @@ class VectorDBService:
             result = cursor.fetchone()
             return result[0] if result else None
 
-    def get_all_chunks(self) -> List[Tuple[int, str, str, int]]:
-        """Lấy tất cả các chunks từ cơ sở dữ liệu."""
+    def get_chunks_by_ids(self, chunk_ids: List[int]) -> Dict[int, str]:
+        """Lấy nội dung của nhiều chunk trong một truy vấn IN (...) duy nhất."""
+        if not chunk_ids:
+            return {}
+        placeholders = ",".join("?" for _ in chunk_ids)
+        with self.database_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, content FROM chunks WHERE id IN ({placeholders})",
+                [int(chunk_id) for chunk_id in chunk_ids]
+            )
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def get_all_chunks(self, collection_id: str = DEFAULT_COLLECTION) -> List[Tuple[int, str, str, int, int]]:
+        """Lấy tất cả các chunks của một collection từ cơ sở dữ liệu."""
         with self.database_manager.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT c.id, c.content, f.name as source, c.chunk_index
+                SELECT c.id, c.content, f.name as source, c.chunk_index, c.file_id
                 FROM chunks c
                 JOIN files f ON f.id = c.file_id
+                WHERE f.collection_id = ?
                 ORDER BY f.name, c.chunk_index
+            """, (collection_id,))
+            return cursor.fetchall()
+
+    def iter_chunks(
+        self,
+        collection_id: str = DEFAULT_COLLECTION,
+        page_size: int = 1000,
+        num_partitions: int = 1,
+        partition: int = 0,
+        partition_by: str = "file"
+    ) -> Iterator[List[Tuple[int, str, str, int, int]]]:
+        """Duyệt chunks của collection theo id tăng dần từng trang, cùng định dạng với get_all_chunks.
+
+        Mỗi trang là một truy vấn keyset (c.id > id cuối) trên primary key nên chỉ
+        trang hiện tại nằm trong bộ nhớ và không giữ khóa đọc giữa các trang.
+        """
+        conditions = ["f.collection_id = ?", "c.id > ?"]
+        if num_partitions > 1:
+            column = "c.file_id" if partition_by == "file" else "c.id"
+            conditions.append(f"{column} % {int(num_partitions)} = {int(partition)}")
+        sql = f"""
+            SELECT c.id, c.content, f.name as source, c.chunk_index, c.file_id
+            FROM chunks c
+            JOIN files f ON f.id = c.file_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY c.id
+            LIMIT ?
+        """
+        last_id = -1
+        with self.database_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            while True:
+                cursor.execute(sql, (collection_id, last_id, int(page_size)))
+                page = cursor.fetchall()
+                if not page:
+                    return
+                yield page
+                last_id = page[-1][0]
+
+    def count_chunks(self, collection_id: str = DEFAULT_COLLECTION) -> int:
+        """Đếm số chunks của một collection trong cơ sở dữ liệu."""
+        with self.database_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM chunks WHERE collection_id = ?", (collection_id,))
+            return cursor.fetchone()[0]
+
+    def list_collections(self) -> List[Tuple[str, int, int]]:
+        """Danh sách collection cùng số file và số chunk của mỗi collection."""
+        with self.database_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT f.collection_id, COUNT(DISTINCT f.id), COUNT(c.id)
+                FROM files f
+                LEFT JOIN chunks c ON c.file_id = f.id
+                GROUP BY f.collection_id
+                ORDER BY f.collection_id
             """)
             return cursor.fetchall()
 
-    def get_chunks_by_file(self, file_name: str) -> List[Tuple[int, str, int]]:
+    def get_chunks_by_file_names(
+        self,
+        file_names: List[str],
+        collection_id: str = DEFAULT_COLLECTION
+    ) -> List[Tuple[int, str, str, int, int]]:
+        """Lấy các chunks của một nhóm file, cùng định dạng với get_all_chunks."""
+        if not file_names:
+            return []
+        placeholders = ",".join("?" for _ in file_names)
+        with self.database_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT c.id, c.content, f.name as source, c.chunk_index, c.file_id
+                FROM chunks c
+                JOIN files f ON f.id = c.file_id
+                WHERE f.collection_id = ? AND f.name IN ({placeholders})
+                ORDER BY f.name, c.chunk_index
+            """, [collection_id, *file_names])
+            return cursor.fetchall()
+
+    def find_file_ids(
+        self,
+        file_names: Optional[List[str]] = None,
+        file_ids: Optional[List[int]] = None,
+        uploaded_after: Optional[datetime] = None,
+        uploaded_before: Optional[datetime] = None,
+        collection_id: str = DEFAULT_COLLECTION
+    ) -> List[int]:
+        """Tìm id các file trong collection khớp mọi điều kiện (tên, id, thời gian upload lần cuối theo UTC)."""
+        conditions = ["collection_id = ?"]
+        params: List = [collection_id]
+        if file_names:
+            conditions.append(f"name IN ({','.join('?' for _ in file_names)})")
+            params.extend(file_names)
+        if file_ids:
+            conditions.append(f"id IN ({','.join('?' for _ in file_ids)})")
+            params.extend(int(file_id) for file_id in file_ids)
+        for operator, moment in ((">=", uploaded_after), ("<=", uploaded_before)):
+            if moment is not None:
+                if moment.tzinfo is not None:
+                    moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+                conditions.append(f"updated_at {operator} ?")
+                params.append(moment.strftime("%Y-%m-%d %H:%M:%S"))
+        
+        with self.database_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT id FROM files WHERE {' AND '.join(conditions)}", params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def get_chunks_by_file(
+        self,
+        file_name: str,
+        collection_id: str = DEFAULT_COLLECTION
+    ) -> List[Tuple[int, str, int]]:
         """Lấy tất cả các chunks thuộc về một file cụ thể."""
         with self.database_manager.get_connection() as conn:
             cursor = conn.cursor()
@@ -117,20 +242,21 @@ class VectorDBService:
                 SELECT c.id, c.content, c.chunk_index
                 FROM chunks c
                 JOIN files f ON f.id = c.file_id
-                WHERE f.name = ?
+                WHERE f.collection_id = ? AND f.name = ?
                 ORDER BY c.chunk_index
-            """, (file_name,))
+            """, (collection_id, file_name))
             return cursor.fetchall()
 
-    def get_all_files(self) -> List[Tuple[int, str, int, str, str]]:
-        """Lấy danh sách tất cả các file đã được lưu trong database."""
+    def get_all_files(self, collection_id: str = DEFAULT_COLLECTION) -> List[Tuple[int, str, int, str, str]]:
+        """Lấy danh sách tất cả các file của collection đã được lưu trong database."""
         with self.database_manager.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT id, name, size, created_at, updated_at
                 FROM files
+                WHERE collection_id = ?
                 ORDER BY name
-            """)
+            """, (collection_id,))
             return cursor.fetchall()
 
     def get_configuration(self) -> dict:
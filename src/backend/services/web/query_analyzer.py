@@ -2,6 +2,7 @@ import re
 from typing import Dict, Union, List
 from models.llm import LLM
 from services.text_processing import TextProcessing
+from utils.tracing import traced
 
 class SearchQueryAnalyzer:
     
@@ -9,6 +10,7 @@ class SearchQueryAnalyzer:
         self.llm = LLM()
         self.text_processing = TextProcessing()
 
+    @traced("web.analyze_query")
     async def analyze(self, prompt: str) -> Dict[str, Union[str, List[str]]]:
         """Phân tích prompt để trích xuất thông tin tìm kiếm."""
         simple_time_keywords = {
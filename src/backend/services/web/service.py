@@ -2,6 +2,7 @@ from typing import List, Dict, Any
 from clients.google_search_client import GoogleSearchClient
 from services.web.query_analyzer import SearchQueryAnalyzer
 from services.web.content_extractor import WebContentExtractor
+from utils.tracing import traced
 
 class WebSearchService:
     def __init__(self):
@@ -9,6 +10,7 @@ class WebSearchService:
         self.analyzer = SearchQueryAnalyzer()
         self.extractor = WebContentExtractor()
 
+    @traced("web.perform_search")
     async def perform_search(self, prompt: str) -> Dict[str, Any]:
         """Thực hiện tìm kiếm thông minh dựa trên phân tích prompt."""
         try:
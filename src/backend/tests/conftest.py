@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Các module backend được import theo đường dẫn tương đối với src/backend (như khi chạy main.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.app_config import AppConfig  # noqa: E402
+
+
+@pytest.fixture
+def index_dirs(tmp_path, monkeypatch):
+    """Trỏ mọi thư mục index/collection của AppConfig vào thư mục tạm của test."""
+    monkeypatch.setattr(AppConfig, "INDEX_GENERATIONS_DIR", str(tmp_path / "generations"))
+    monkeypatch.setattr(AppConfig, "INDEX_MANIFEST_PATH", str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(AppConfig, "COLLECTIONS_DIR", str(tmp_path / "collections"))
+    return tmp_path
@@ -0,0 +1,37 @@
+import asyncio
+
+import numpy as np
+
+from services.rag.batching import MicroBatchEmbedder
+
+
+def test_concurrent_requests_share_one_batch():
+    batches = []
+
+    def encode(texts):
+        batches.append(list(texts))
+        return np.asarray([[len(text), 1.0] for text in texts], dtype='float32')
+
+    async def run():
+        embedder = MicroBatchEmbedder(encode, max_batch_size=8, max_wait_ms=20)
+        vectors = await asyncio.gather(*(embedder.encode("x" * size) for size in (1, 2, 3)))
+        await embedder.shutdown()
+        return vectors
+
+    vectors = asyncio.run(run())
+
+    assert batches == [["x", "xx", "xxx"]]
+    assert [float(vector[0]) for vector in vectors] == [1.0, 2.0, 3.0]
+
+
+def test_encode_error_reaches_every_waiter():
+    def encode(texts):
+        raise RuntimeError("encoder failed")
+
+    async def run():
+        embedder = MicroBatchEmbedder(encode, max_wait_ms=10)
+        results = await asyncio.gather(embedder.encode("a"), embedder.encode("b"), return_exceptions=True)
+        await embedder.shutdown()
+        return results
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
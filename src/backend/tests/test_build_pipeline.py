@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+from services.rag.build_pipeline import BuildTimings, EncodedCorpus
+
+DIM = 4
+
+
+def test_encoded_corpus_round_trip_and_cleanup(tmp_path):
+    vectors = np.random.default_rng(0).random((10, DIM), dtype='float32')
+    with EncodedCorpus(DIM, str(tmp_path)) as corpus:
+        corpus.append(vectors[:6])
+        corpus.append(vectors[6:])
+        corpus.finish()
+        path = corpus.path
+
+        assert len(corpus) == 10 and os.path.dirname(path) == str(tmp_path)
+        np.testing.assert_array_equal(corpus.rows(2, 5), vectors[2:5])
+        np.testing.assert_array_equal(corpus.take(np.array([7, 1])), vectors[[1, 7]])
+
+    assert not os.path.exists(path)
+
+
+def test_sample_stays_inside_rows_without_repeats(tmp_path):
+    with EncodedCorpus(DIM, str(tmp_path)) as corpus:
+        corpus.append(np.arange(100, dtype='float32').repeat(DIM).reshape(100, DIM))
+        corpus.finish()
+        rows = np.arange(10, 60)
+
+        sample = corpus.sample(rows, 20, seed=1)
+        everything = corpus.sample(rows, 500, seed=1)
+
+    picked = sample[:, 0].astype(int)
+    assert len(set(picked.tolist())) == 20 and np.isin(picked, rows).all()
+    assert everything.shape == (50, DIM)
+
+
+def test_empty_corpus(tmp_path):
+    with EncodedCorpus(DIM, str(tmp_path)) as corpus:
+        corpus.finish()
+        assert len(corpus) == 0 and corpus.rows(0, 0).shape == (0, DIM)
+
+
+def test_append_rejects_wrong_dimension(tmp_path):
+    with EncodedCorpus(DIM, str(tmp_path)) as corpus:
+        with pytest.raises(ValueError):
+            corpus.append(np.zeros((2, DIM + 1), dtype='float32'))
+
+
+def test_build_timings_accumulate_phases():
+    timings = BuildTimings(num_vectors=3)
+    with timings.phase("encode"):
+        pass
+    with timings.phase("persist"):
+        pass
+    with timings.phase("persist"):
+        pass
+
+    report = timings.to_dict()
+    assert list(report["phases"]) == ["encode", "persist"]
+    assert report["num_vectors"] == 3 and report["total_seconds"] >= 0
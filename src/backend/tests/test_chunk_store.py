@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pytest
+
+from services.rag.chunk_store import ChunkStore, ChunkStoreWriter
+
+
+def _rows(ids, file_id=1, source="a.txt"):
+    return [(chunk_id, f"nội dung {chunk_id}", source, chunk_id % 10, file_id) for chunk_id in ids]
+
+
+def _segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("seg-"))
+
+
+def test_round_trip_with_overlay(tmp_path):
+    store = ChunkStore.from_rows(_rows(range(1, 6)) + _rows([10, 11], file_id=2, source="b.txt"))
+    loaded = store.save(str(tmp_path / "v1"))
+
+    assert len(loaded) == 7
+    assert loaded.get(3) == {'chunk_id': 3, 'content': "nội dung 3", 'source': "a.txt", 'chunk_index': 3, 'file_id': 1}
+    assert loaded.ids_for_files(["b.txt"]) == [10, 11]
+
+    loaded.remove([2, 10])
+    loaded.add(_rows([20], file_id=3, source="c.txt"))
+    assert 2 not in loaded and 20 in loaded
+    loaded.save(str(tmp_path / "v2"))
+
+    reloaded = ChunkStore.load(str(tmp_path / "v2"))
+    np.testing.assert_array_equal(reloaded.ids(), [1, 3, 4, 5, 11, 20])
+    assert len(reloaded) == 6
+    assert reloaded.get(20)["source"] == "c.txt"
+    assert reloaded.get(2) is None
+    assert reloaded.ids_for_files(["a.txt", "b.txt"]) == [1, 3, 4, 5, 11]
+
+
+def test_save_returns_new_store_and_leaves_original_untouched(tmp_path):
+    base = ChunkStore.from_rows(_rows(range(1, 101))).save(str(tmp_path / "store"))
+    base.remove([1])
+    base.add(_rows([200]))
+
+    saved = base.save(str(tmp_path / "store"))
+
+    assert saved is not base
+    assert 1 not in saved and 200 in saved
+    # Store cũ (có thể đang được snapshot khác giữ) vẫn đọc được dữ liệu cũ
+    assert base.get(2)["content"] == "nội dung 2"
+    assert base.get(200)["content"] == "nội dung 200"
+
+
+def test_incremental_save_only_writes_the_delta(tmp_path):
+    directory = str(tmp_path / "store")
+    store = ChunkStore.from_rows(_rows(range(1, 1001))).save(directory)
+    first_segment = _segment_files(directory)
+    inodes = {name: os.stat(os.path.join(directory, name)).st_ino for name in first_segment}
+
+    store.remove([5, 6])
+    store.add(_rows([2000, 2001]))
+    store = store.save(directory)
+
+    # Segment cũ giữ nguyên file, chỉ thêm một segment cho phần thêm mới
+    files = _segment_files(directory)
+    assert set(first_segment) < set(files)
+    assert all(os.stat(os.path.join(directory, name)).st_ino == inodes[name] for name in first_segment)
+    assert len(files) == 2 * len(first_segment)
+    assert len(store) == 1000
+    assert store.get(2001)["content"] == "nội dung 2001"
+    assert store.get(5) is None
+
+
+def test_saving_to_new_directory_hard_links_segments(tmp_path):
+    store = ChunkStore.from_rows(_rows(range(1, 51))).save(str(tmp_path / "g1"))
+    store.add(_rows([60]))
+
+    copied = store.save(str(tmp_path / "g2"))
+
+    for name in _segment_files(str(tmp_path / "g1")):
+        assert os.path.samefile(tmp_path / "g1" / name, tmp_path / "g2" / name)
+    assert len(copied) == 51
+
+
+def test_compaction_after_many_deletes_preserves_contents(tmp_path):
+    directory = str(tmp_path / "store")
+    store = ChunkStore.from_rows(_rows(range(1, 101))).save(directory)
+    store.add(_rows(range(101, 121), file_id=2, source="b.txt"))
+    store = store.save(directory)
+
+    store.remove(range(1, 51))
+    store = store.save(directory)
+
+    assert not [name for name in os.listdir(directory) if name.startswith("deleted-")]
+    assert len({name.split(".")[0] for name in _segment_files(directory)}) == 1
+    np.testing.assert_array_equal(store.ids(), np.arange(51, 121))
+    for chunk_id in (51, 77, 100, 101, 120):
+        assert store.get(chunk_id)["content"] == f"nội dung {chunk_id}"
+    assert store.get(120)["source"] == "b.txt"
+
+
+def test_too_many_segments_are_merged(tmp_path):
+    directory = str(tmp_path / "store")
+    store = ChunkStore()
+    for start in range(0, 100, 10):
+        store.add(_rows(range(start + 1, start + 11)))
+        store = store.save(directory)
+
+    assert len({name.split(".")[0] for name in _segment_files(directory)}) <= ChunkStore._MAX_SEGMENTS
+    np.testing.assert_array_equal(store.ids(), np.arange(1, 101))
+    assert store.get(55)["content"] == "nội dung 55"
+
+
+def test_copy_is_independent_of_the_original(tmp_path):
+    base = ChunkStore.from_rows(_rows(range(1, 11))).save(str(tmp_path / "store"))
+    base.add(_rows([50]))
+
+    copy = base.copy()
+    copy.remove([1, 50])
+    copy.add(_rows([60]))
+
+    assert 1 in base and 50 in base and 60 not in base
+    assert 1 not in copy and 50 not in copy and 60 in copy
+    assert len(base) == 11 and len(copy) == 10
+
+
+def test_ids_for_file_ids_spans_segments_and_overlay(tmp_path):
+    directory = str(tmp_path / "store")
+    store = ChunkStore.from_rows(_rows(range(1, 6), file_id=1) + _rows(range(6, 9), file_id=2, source="b.txt"))
+    store = store.save(directory)
+    store.add(_rows([20, 21], file_id=2, source="b.txt"))
+    store = store.save(directory)
+    store.remove([7])
+    store.add(_rows([30], file_id=3, source="c.txt"))
+
+    np.testing.assert_array_equal(store.ids_for_file_ids([2]), [6, 8, 20, 21])
+    np.testing.assert_array_equal(store.ids_for_file_ids([3, 1]), [1, 2, 3, 4, 5, 30])
+    assert store.ids_for_file_ids([]).size == 0
+    assert store.ids_for_files(["b.txt", "c.txt"]) == [6, 8, 20, 21, 30]
+
+
+def test_writer_streams_pages_into_one_segment(tmp_path):
+    writer = ChunkStoreWriter(str(tmp_path / "scratch"))
+    writer.append(_rows(range(1, 4)))
+    writer.append(_rows([7, 9], file_id=2, source="b.txt"))
+    with pytest.raises(ValueError):
+        writer.append(_rows([8]))
+    store = writer.close()
+
+    assert _segment_files(str(tmp_path / "scratch")) == [
+        "seg-000001.chunk_indices.npy", "seg-000001.file_ids.npy", "seg-000001.ids.npy",
+        "seg-000001.spans.npy", "seg-000001.texts.bin",
+    ]
+    np.testing.assert_array_equal(store.ids(), [1, 2, 3, 7, 9])
+    assert store.get(9) == {'chunk_id': 9, 'content': "nội dung 9", 'source': "b.txt", 'chunk_index': 9, 'file_id': 2}
+
+    # Lưu sang generation mới chỉ hard-link segment vừa ghi
+    saved = store.save(str(tmp_path / "g1"))
+    assert os.path.samefile(tmp_path / "scratch" / "seg-000001.texts.bin", tmp_path / "g1" / "seg-000001.texts.bin")
+    assert saved.get(2)['content'] == "nội dung 2"
+
+
+def test_writer_without_rows_gives_empty_store(tmp_path):
+    store = ChunkStoreWriter(str(tmp_path)).close()
+
+    assert len(store) == 0 and store.ids().size == 0
@@ -0,0 +1,66 @@
+from services.llm.context_packer import ContextPacker, estimate_tokens, parse_shares
+
+
+def _packer(budget: int, shares=None) -> ContextPacker:
+    return ContextPacker(budget_tokens=budget, shares=shares or {"rag": 0.5, "web": 0.5}, chars_per_token=4.0)
+
+
+def test_sources_within_budget_are_kept_whole():
+    packed = _packer(1000).pack("câu hỏi", {"rag": "đoạn một\n\nđoạn hai", "web": "kết quả web"})
+
+    assert packed.get("rag") == "đoạn một\n\nđoạn hai"
+    assert packed.get("web") == "kết quả web"
+    assert packed.report["sources"]["rag"]["dropped_segments"] == 0
+
+
+def test_packed_context_respects_budget_and_shares():
+    rag = "\n\n".join(f"đoạn rag số {i} " + "x" * 200 for i in range(20))
+    web = "\n".join(f"kết quả web {i} " + "y" * 200 for i in range(20))
+
+    packed = _packer(400).pack("câu hỏi", {"rag": rag, "web": web})
+
+    assert packed.report["used_tokens"] <= 400
+    for name in ("rag", "web"):
+        entry = packed.report["sources"][name]
+        assert entry["used_tokens"] <= entry["budget_tokens"] <= 200
+        assert entry["dropped_segments"] > 0
+    # rag giữ các đoạn đầu tiên theo thứ tự xếp hạng của retrieval
+    assert packed.get("rag").startswith("đoạn rag số 0 ")
+
+
+def test_unused_share_goes_to_other_sources():
+    long_rag = "\n\n".join("z" * 400 for _ in range(10))
+
+    packed = _packer(1000).pack("câu hỏi", {"rag": long_rag, "web": "ngắn"})
+
+    assert packed.report["sources"]["web"]["budget_tokens"] == estimate_tokens("ngắn", 4.0)
+    assert packed.report["sources"]["rag"]["budget_tokens"] == 1000 - estimate_tokens("ngắn", 4.0)
+
+
+def test_web_segments_ranked_by_question_terms():
+    web = "\n".join(["thời tiết hôm nay nắng", "giá vàng tăng mạnh", "bóng đá cuối tuần"])
+
+    packed = _packer(8, {"web": 1.0}).pack("giá vàng có tăng không", {"web": web})
+
+    assert packed.get("web") == "giá vàng tăng mạnh"
+
+
+def test_parse_shares_ignores_invalid_entries():
+    assert parse_shares("rag:0.4, file:0.3,web:abc,unknown:0.2,history:0") == {"rag": 0.4, "file": 0.3}
+
+
+def test_history_keeps_most_recent_messages():
+    history = "\n".join(f"tin nhắn {i} " + "h" * 40 for i in range(10))
+
+    packed = _packer(40, {"history": 1.0}).pack("câu hỏi", {"history": history})
+
+    kept = packed.get("history").split("\n")
+    assert kept[-1].startswith("tin nhắn 9 ") and not any(line.startswith("tin nhắn 0 ") for line in kept)
+    assert packed.report["sources"]["history"]["used_tokens"] <= 40
+
+
+def test_oversized_segment_is_truncated_to_budget():
+    packed = _packer(10, {"file": 1.0}).pack("câu hỏi", {"file": "a" * 1000})
+
+    assert packed.get("file") == "a" * 40
+    assert packed.report["sources"]["file"]["used_tokens"] == 10
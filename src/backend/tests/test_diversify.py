@@ -0,0 +1,53 @@
+import numpy as np
+
+from services.rag.diversify import merge_adjacent_hits, mmr_select
+
+TEXT = "Đoạn văn bản mẫu dùng để kiểm tra việc gộp các chunk liền kề có phần chồng lấn với nhau. " * 3
+
+
+def _chunks(size: int = 60, overlap: int = 15):
+    starts = range(0, len(TEXT) - overlap, size - overlap)
+    return [TEXT[start:start + size] for start in starts]
+
+
+def _hit(chunk_index: int, source: str = "a.txt", score: float = 0.0):
+    return {
+        "chunk_id": 100 + chunk_index if source == "a.txt" else 200 + chunk_index,
+        "content": _chunks()[chunk_index],
+        "source": source,
+        "chunk_index": chunk_index,
+        "score": score,
+    }
+
+
+def test_merge_is_transitive_regardless_of_hit_order():
+    merged = merge_adjacent_hits([_hit(1), _hit(3), _hit(2)], max_overlap=15)
+
+    assert len(merged) == 1
+    assert merged[0]["chunk_ids"] == [101, 102, 103]
+    assert merged[0]["content"] == TEXT[45:195]
+
+
+def test_merge_keeps_best_hit_order_and_separate_sources():
+    hits = [_hit(5, score=0.1), _hit(0, "b.txt", score=0.2), _hit(4, score=0.3), _hit(1, "b.txt", score=0.4)]
+
+    merged = merge_adjacent_hits(hits, max_overlap=15)
+
+    assert [passage["source"] for passage in merged] == ["a.txt", "b.txt"]
+    assert merged[0]["chunk_ids"] == [104, 105]
+    assert merged[0]["score"] == 0.1
+    assert merged[1]["chunk_ids"] == [200, 201]
+
+
+def test_non_adjacent_hits_are_not_merged():
+    hits = [_hit(0), _hit(2)]
+
+    assert merge_adjacent_hits(hits, max_overlap=15) == hits
+
+
+def test_mmr_prefers_diverse_candidates():
+    query = np.array([1.0, 0.0, 0.0], dtype='float32')
+    candidates = np.array([[1.0, 0.1, 0.0], [1.0, 0.11, 0.0], [0.7, 0.0, 0.7]], dtype='float32')
+
+    assert mmr_select(query, candidates, 2, lambda_mult=1.0) == [0, 1]
+    assert mmr_select(query, candidates, 2, lambda_mult=0.3) == [0, 2]
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from services.rag.embedding_backends import (
+    OnnxInt8EmbeddingBackend, TorchEmbeddingBackend, check_backend_agreement
+)
+
+
+class FixedBackend:
+    def __init__(self, name, vectors):
+        self.name = name
+        self.vectors = np.asarray(vectors, dtype='float32')
+
+    def encode(self, texts):
+        return self.vectors[:len(texts)].copy()
+
+
+def test_agreement_passes_only_above_threshold():
+    reference = FixedBackend("torch", [[1, 0], [0, 1]])
+    close = FixedBackend("onnx_int8", [[2, 0.01], [0.02, 3]])
+    far = FixedBackend("onnx_int8", [[1, 0], [1, 1]])
+
+    passed = check_backend_agreement(close, reference, 0.99, texts=["a", "b"])
+    failed = check_backend_agreement(far, reference, 0.99, texts=["a", "b"])
+
+    assert passed["passed"] and passed["min_cosine"] > 0.99
+    assert not failed["passed"]
+    assert failed["min_cosine"] == round(float(np.sqrt(0.5)), 6)
+
+
+def test_onnx_backend_mean_pools_over_attention_mask():
+    backend = OnnxInt8EmbeddingBackend.__new__(OnnxInt8EmbeddingBackend)
+    backend.max_seq_length = 8
+    backend.normalize = False
+    backend._dimension = 2
+    backend.tokenizer = lambda texts, **kwargs: {
+        "input_ids": np.zeros((2, 3), dtype='int64'),
+        "attention_mask": np.array([[1, 1, 0], [1, 1, 1]]),
+    }
+    hidden = np.array([
+        [[1, 2], [3, 4], [100, 100]],
+        [[1, 1], [2, 2], [3, 3]],
+    ], dtype='float32')
+    backend.model = lambda **inputs: SimpleNamespace(last_hidden_state=hidden)
+
+    embeddings = backend.encode(["a", "b"], batch_size=2)
+
+    # Token padding (mask = 0) không được tính vào trung bình
+    np.testing.assert_allclose(embeddings, [[2, 3], [2, 2]])
+
+
+def test_int8_vectors_use_a_separate_cache_namespace():
+    torch_backend = TorchEmbeddingBackend.__new__(TorchEmbeddingBackend)
+    torch_backend.model_name = "all-MiniLM-L6-v2"
+    onnx_backend = OnnxInt8EmbeddingBackend.__new__(OnnxInt8EmbeddingBackend)
+    onnx_backend.model_name = "all-MiniLM-L6-v2"
+
+    assert torch_backend.cache_namespace == "all-MiniLM-L6-v2"
+    assert onnx_backend.cache_namespace != torch_backend.cache_namespace
@@ -0,0 +1,103 @@
+import threading
+
+import numpy as np
+
+from services.rag.embedding_cache import CachedEmbedder, EmbeddingCache, QueryEmbeddingCache
+
+DIM = 8
+
+
+class FakeModel:
+    """Model giả: embedding suy ra từ hash của văn bản, đếm số văn bản đã encode."""
+
+    def __init__(self):
+        self.encoded = []
+        self._lock = threading.Lock()
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        with self._lock:
+            self.encoded.extend(texts)
+        return np.stack([
+            np.random.default_rng(abs(hash(text)) % (2 ** 32)).random(DIM, dtype='float32')
+            for text in texts
+        ])
+
+
+def test_corpus_encodes_reuse_persistent_cache(tmp_path):
+    path = str(tmp_path / "cache.db")
+    model = FakeModel()
+    first = CachedEmbedder(model, EmbeddingCache(path)).encode(["a", "b", "a"])
+
+    # Process khác (cache mới trên cùng file) không cần encode lại
+    cache = EmbeddingCache(path)
+    second = CachedEmbedder(model, cache).encode(["b", "a"])
+
+    assert model.encoded == ["a", "b"]
+    np.testing.assert_array_equal(first[[1, 0]], second)
+    assert cache.get_stats()["hits"] == 2
+
+
+def test_queries_never_touch_persistent_cache(tmp_path):
+    model = FakeModel()
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    embedder = CachedEmbedder(model, cache, query_cache=QueryEmbeddingCache(2))
+
+    embedder.encode_queries(["q1"])
+    embedder.encode_queries(["q1", "q2"])
+    embedder.encode_queries(["q3"])
+    embedder.encode_queries(["q1"])
+
+    assert cache.get_stats()["entries"] == 0
+    # q1 bị đẩy ra khi q3 vào (LRU 2 phần tử) nên phải encode lại
+    assert model.encoded == ["q1", "q2", "q3", "q1"]
+    stats = embedder.query_cache.get_stats()
+    assert stats["entries"] == 2
+    assert stats["hits"] == 1
+
+
+def test_max_rows_evicts_least_recently_used(tmp_path):
+    model = FakeModel()
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_rows=3)
+    embedder = CachedEmbedder(model, cache)
+
+    embedder.encode(["a", "b", "c"])
+    embedder.encode(["a"])  # a vừa được dùng lại, b là dòng cũ nhất
+    embedder.encode(["d"])
+
+    assert cache.get_stats()["entries"] == 3
+    assert set(cache.get_many([cache.make_key(t) for t in "abcd"])) == {
+        cache.make_key(t) for t in "acd"
+    }
+
+
+def test_counters_and_connections_are_per_thread_safe(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    embedder = CachedEmbedder(FakeModel(), cache)
+    embedder.encode([f"t{i}" for i in range(20)])
+    connections = []
+    barrier = threading.Barrier(4)
+
+    def worker():
+        with cache.get_connection() as first:
+            pass
+        for _ in range(50):
+            embedder.encode([f"t{i}" for i in range(20)])
+        with cache.get_connection() as last:
+            connections.append((first, last))
+        # Giữ mọi thread sống tới khi tất cả đã ghi nhận connection của mình
+        barrier.wait()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.get_stats()
+    assert stats["hits"] == 4 * 50 * 20
+    assert stats["misses"] == 20
+    assert all(first is last for first, last in connections)
+    assert len({id(first) for first, _ in connections}) == 4
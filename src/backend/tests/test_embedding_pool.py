@@ -0,0 +1,70 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from services.rag import embedding_pool
+from services.rag.embedding_pool import EmbeddingProcessPool
+
+
+def _pool(monkeypatch, num_workers=2, shard_size=4, delay=0.0):
+    """Pool dùng thread thay cho process, encode giả trả về độ dài văn bản."""
+    stats = {"shards": [], "in_flight": 0, "max_in_flight": 0}
+    lock = threading.Lock()
+
+    def fake_encode_shard(texts):
+        with lock:
+            stats["shards"].append(len(texts))
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        time.sleep(delay)
+        with lock:
+            stats["in_flight"] -= 1
+        return np.asarray([[len(text)] for text in texts], dtype='float32')
+
+    monkeypatch.setattr(embedding_pool, "_encode_shard", fake_encode_shard)
+    pool = EmbeddingProcessPool("fake-model", num_workers=num_workers, shard_size=shard_size)
+    pool._executor = ThreadPoolExecutor(max_workers=num_workers)
+    return pool, stats
+
+
+def test_encode_keeps_input_order_across_shards(monkeypatch):
+    pool, stats = _pool(monkeypatch)
+    texts = ["x" * size for size in range(1, 31)]
+
+    with pool:
+        embeddings = pool.encode(texts)
+
+    np.testing.assert_array_equal(embeddings[:, 0], np.arange(1, 31))
+    assert stats["shards"] == [4] * 7 + [2]
+
+
+def test_preferred_batch_keeps_every_worker_busy(monkeypatch):
+    pool, stats = _pool(monkeypatch, num_workers=3, shard_size=4, delay=0.01)
+
+    with pool:
+        pool.encode(["x"] * pool.preferred_batch_size)
+
+    # Một batch ưu tiên chia thành đủ shard cho mọi worker, mỗi worker hai lượt
+    assert len(stats["shards"]) == 3 * 2
+    assert stats["max_in_flight"] == 3
+
+
+def test_stream_bounds_queued_shards(monkeypatch):
+    pool, _ = _pool(monkeypatch, num_workers=2, shard_size=1)
+    submitted = []
+    original_submit = pool._executor.submit
+
+    def counting_submit(fn, texts):
+        submitted.append(texts)
+        return original_submit(fn, texts)
+
+    pool._executor.submit = counting_submit
+    stream = pool.encode_stream(["x"] * 20)
+    next(stream)
+
+    # Chỉ giữ tối đa 2 x số worker shard trong hàng đợi
+    assert len(submitted) == 4
+    list(stream)
+    pool.close()
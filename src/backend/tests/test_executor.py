@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import pytest
+
+from services.rag.executor import InferenceExecutor
+
+
+def test_work_runs_off_the_event_loop_thread():
+    executor = InferenceExecutor(max_workers=2)
+
+    async def run():
+        loop_thread = threading.get_ident()
+        worker_thread = await executor.run(threading.get_ident)
+        return loop_thread, worker_thread
+
+    loop_thread, worker_thread = asyncio.run(run())
+    executor.shutdown()
+
+    assert worker_thread != loop_thread
+
+
+def test_event_loop_stays_responsive_during_inference():
+    executor = InferenceExecutor(max_workers=1)
+    release = threading.Event()
+    ticks = []
+
+    async def ticker():
+        while not release.is_set():
+            ticks.append(1)
+            await asyncio.sleep(0.005)
+
+    async def run():
+        tick_task = asyncio.create_task(ticker())
+        work = asyncio.create_task(executor.run(release.wait, 1.0))
+        await asyncio.sleep(0.05)
+        release.set()
+        await work
+        await tick_task
+
+    asyncio.run(run())
+    executor.shutdown()
+
+    assert len(ticks) > 3
+
+
+def test_errors_propagate_and_executor_restarts_after_shutdown():
+    executor = InferenceExecutor(max_workers=1)
+
+    def fail():
+        raise ValueError("boom")
+
+    async def run():
+        with pytest.raises(ValueError):
+            await executor.run(fail)
+        executor.shutdown()
+        return await executor.run(lambda a, b=0: a + b, 1, b=2)
+
+    assert asyncio.run(run()) == 3
+    stats = executor.get_stats()
+    executor.shutdown()
+    assert stats["submitted"] == 2
+    assert stats["active"] == 0
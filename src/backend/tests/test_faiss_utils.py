@@ -0,0 +1,286 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from config.app_config import AppConfig
+from services.rag.vector_store import VectorStore
+from utils.faiss_utils import (
+    COMPRESSION_FP16, COMPRESSION_NONE, COMPRESSION_PQ, COMPRESSION_SQ8, clone_index, compact_index,
+    count_deleted_vectors, create_compressed_index, estimate_index_memory, evaluate_compression, exclude_deleted,
+    get_index_ids, read_index_file, remove_ids_from_index, rerank_exact, search_subset, write_index_file
+)
+
+DIM = 16
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).random((count, DIM), dtype='float32')
+
+
+def _build_index(kind: str, count: int = 400) -> faiss.Index:
+    if kind == "flat":
+        inner = faiss.IndexFlatL2(DIM)
+    elif kind == "hnsw":
+        inner = faiss.IndexHNSWFlat(DIM, 16)
+    elif kind == "hnsw_pq":
+        inner = faiss.IndexHNSWPQ(DIM, 4, 16)
+    elif kind == "ivf":
+        inner = faiss.IndexIVFFlat(faiss.IndexFlatL2(DIM), DIM, 8)
+    else:
+        inner = faiss.IndexIVFPQ(faiss.IndexFlatL2(DIM), DIM, 8, 4, 4)
+    vectors = _vectors(count)
+    if not inner.is_trained:
+        inner.train(vectors)
+    if hasattr(inner, 'nprobe'):
+        inner.nprobe = 8
+    index = faiss.IndexIDMap2(inner)
+    index.add_with_ids(vectors, np.arange(count, dtype='int64'))
+    return index
+
+
+def _search(index: faiss.Index, queries: np.ndarray, k: int) -> np.ndarray:
+    params = exclude_deleted(index) if count_deleted_vectors(index) else None
+    return index.search(queries, k, params=params)[1]
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "hnsw_pq", "ivf", "ivf_pq"])
+def test_removed_ids_never_returned(kind):
+    index = _build_index(kind)
+    removed = list(range(0, 40))
+
+    index = remove_ids_from_index(index, removed + [10_000])
+
+    ids = get_index_ids(index)
+    assert len(ids) == 360
+    assert set(removed).isdisjoint(ids.tolist())
+    # Truy vấn đúng bằng vector đã xóa: kết quả chỉ gồm id còn sống và vẫn đủ k
+    labels = _search(index, _vectors(400)[:40], 10)
+    assert (labels >= 40).all()
+
+
+@pytest.mark.parametrize("kind", ["hnsw", "hnsw_pq", "ivf_pq"])
+def test_deletes_are_lazy_below_threshold(kind, monkeypatch):
+    monkeypatch.setattr(AppConfig, "RAG_INDEX_COMPACT_FRACTION", 0.2)
+    index = _build_index(kind)
+
+    updated = remove_ids_from_index(index, range(40))
+
+    # Không dựng lại graph: cùng object, vector bị đánh dấu xóa vẫn nằm trong index
+    assert updated is index
+    assert updated.ntotal == 400
+    assert count_deleted_vectors(updated) == 40
+
+
+@pytest.mark.parametrize("kind", ["hnsw", "ivf"])
+def test_compacts_past_threshold(kind, monkeypatch):
+    monkeypatch.setattr(AppConfig, "RAG_INDEX_COMPACT_FRACTION", 0.2)
+    index = _build_index(kind)
+    queries = _vectors(400)[100:110]
+
+    index = remove_ids_from_index(index, range(40))
+    index = remove_ids_from_index(index, range(40, 100))
+
+    assert index.ntotal == 300
+    assert count_deleted_vectors(index) == 0
+    assert sorted(get_index_ids(index).tolist()) == list(range(100, 400))
+    # Vector được giữ nguyên khi compact nên truy vấn chính nó vẫn trả về đúng id
+    np.testing.assert_array_equal(_search(index, queries, 1)[:, 0], np.arange(100, 110))
+
+
+def test_deleted_ids_can_be_added_back():
+    index = _build_index("hnsw")
+    vectors = _vectors(400)
+
+    index = remove_ids_from_index(index, [5])
+    index.add_with_ids(vectors[5:6], np.array([5], dtype='int64'))
+
+    assert 5 in get_index_ids(index).tolist()
+    assert _search(index, vectors[5:6], 1)[0, 0] == 5
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf_pq"])
+def test_estimate_index_memory_tracks_serialized_size(kind):
+    index = _build_index(kind)
+    serialized = faiss.serialize_index(index).nbytes
+
+    estimate = estimate_index_memory(index)
+
+    # Ước lượng bỏ qua header/codebook nhưng phải cùng cỡ với dữ liệu thật
+    assert serialized * 0.5 <= estimate <= serialized * 2
+
+
+def _subset_ground_truth(queries: np.ndarray, subset: np.ndarray, k: int) -> np.ndarray:
+    _, positions = faiss.knn(queries, _vectors(400)[subset], k)
+    return subset[positions]
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf"])
+def test_search_subset_exact_and_selector_paths_agree(kind):
+    index = _build_index(kind)
+    subset = np.arange(3, 400, 7, dtype='int64')
+    queries = _vectors(5, seed=3)
+    expected = _subset_ground_truth(queries, subset, 5)
+
+    _, exact_ids = search_subset(index, queries, 5, subset, exact_threshold=len(subset))
+    _, selector_ids = search_subset(index, queries, 5, subset, exact_threshold=0)
+
+    np.testing.assert_array_equal(exact_ids, expected)
+    assert np.isin(selector_ids, subset).all()
+    if kind == "flat":
+        np.testing.assert_array_equal(selector_ids, expected)
+
+
+def test_search_subset_falls_back_to_selector_without_reconstruct():
+    index = faiss.IndexIDMap(faiss.IndexFlatL2(DIM))
+    index.add_with_ids(_vectors(400), np.arange(400, dtype='int64'))
+    subset = np.array([5, 50, 150, 350], dtype='int64')
+
+    _, ids = search_subset(index, _vectors(3, seed=4), 10, subset)
+
+    assert ids.shape == (3, 4)
+    assert (np.sort(ids, axis=1) == subset).all()
+
+
+def test_search_subset_ignores_deleted_vectors():
+    index = remove_ids_from_index(_build_index("hnsw"), list(range(0, 200)))
+    subset = np.arange(200, 260, dtype='int64')
+
+    _, exact_ids = search_subset(index, _vectors(400)[:10], 5, subset)
+    _, selector_ids = search_subset(index, _vectors(400)[:10], 5, subset, exact_threshold=0)
+
+    assert np.isin(exact_ids, subset).all() and np.isin(selector_ids, subset).all()
+    assert search_subset(index, _vectors(1), 5, np.empty(0, dtype='int64'))[1].tolist() == [[-1] * 5]
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf"])
+def test_incremental_update_on_mmapped_index(tmp_path, kind):
+    path = str(tmp_path / "index.bin")
+    write_index_file(_build_index(kind, 200), path)
+    mapped, mmapped = read_index_file(path, mmap=True)
+    assert mmapped
+
+    index = clone_index(mapped)
+    index.add_with_ids(_vectors(5, seed=1), np.arange(200, 205, dtype='int64'))
+    index = remove_ids_from_index(index, [0, 1, 202])
+    index.add_with_ids(_vectors(1, seed=2), np.array([300], dtype='int64'))
+
+    ids = set(get_index_ids(index).tolist())
+    assert len(ids) == 203
+    assert {0, 1, 202}.isdisjoint(ids)
+    assert {2, 200, 204, 300} <= ids
+    # Bản đang phục vụ truy vấn không bị đụng tới
+    assert mapped.ntotal == 200
+    assert set(get_index_ids(mapped).tolist()) == set(range(200))
+
+
+def test_clone_keeps_search_results(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_index_file(_build_index("hnsw", 200), path)
+    mapped, _ = read_index_file(path, mmap=True)
+    queries = _vectors(3, seed=2)
+
+    expected = mapped.search(queries, 5)
+    actual = clone_index(mapped).search(queries, 5)
+    np.testing.assert_array_equal(expected[1], actual[1])
+
+
+def test_write_index_file_replaces_instead_of_rewriting(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_index_file(_build_index("flat", 50), path)
+    mapped, _ = read_index_file(path, mmap=True)
+    inode = os.stat(path).st_ino
+
+    write_index_file(_build_index("flat", 80), path)
+
+    # Worker đang map file cũ vẫn giữ inode cũ và dữ liệu cũ
+    assert os.stat(path).st_ino != inode
+    assert mapped.ntotal == 50 and read_index_file(path, mmap=True)[0].ntotal == 80
+
+
+def _recall(found: np.ndarray, exact: np.ndarray) -> float:
+    hits = sum(len(set(found[row].tolist()) & set(exact[row].tolist())) for row in range(len(exact)))
+    return hits / float(exact.size)
+
+
+def _exact_store(vectors: np.ndarray) -> VectorStore:
+    store = VectorStore(DIM)
+    store.add(range(len(vectors)), vectors)
+    return store
+
+
+@pytest.mark.parametrize("compression, rerank_factor", [(COMPRESSION_SQ8, 4), (COMPRESSION_PQ, 10)])
+def test_rerank_exact_restores_recall_of_compressed_index(compression, rerank_factor):
+    corpus = _vectors(2000)
+    queries = _vectors(20, seed=5)
+    k = 10
+    index = create_compressed_index(DIM, len(corpus), compression, corpus)
+    index.add_with_ids(corpus, np.arange(len(corpus), dtype='int64'))
+    exact_ids = faiss.knn(queries, corpus, k)[1]
+
+    approx_ids = index.search(queries, k)[1]
+    candidate_ids = index.search(queries, k * rerank_factor)[1]
+    distances, reranked_ids = rerank_exact(queries, candidate_ids, _exact_store(corpus), k)
+
+    assert _recall(reranked_ids, exact_ids) >= _recall(approx_ids, exact_ids)
+    assert _recall(reranked_ids, exact_ids) >= 0.9
+    # Khoảng cách sau re-rank là khoảng cách L2 chính xác, tăng dần
+    expected = ((corpus[reranked_ids[0]] - queries[0]) ** 2).sum(axis=1)
+    np.testing.assert_allclose(distances[0], expected, rtol=1e-5)
+    assert (np.diff(distances, axis=1) >= 0).all()
+
+
+def test_rerank_exact_pads_missing_candidates():
+    store = _exact_store(_vectors(5))
+    candidate_ids = np.array([[3, -1, 42, 1]], dtype='int64')
+
+    distances, ids = rerank_exact(_vectors(1, seed=9), candidate_ids, store, 4)
+
+    assert sorted(ids[0, :2].tolist()) == [1, 3]
+    assert ids[0, 2:].tolist() == [-1, -1] and np.isinf(distances[0, 2:]).all()
+
+
+def test_compressed_index_falls_back_without_enough_training_data():
+    corpus = _vectors(50)
+
+    pq = create_compressed_index(DIM, len(corpus), COMPRESSION_PQ, corpus)
+    fp16 = create_compressed_index(DIM, len(corpus), COMPRESSION_SQ8)
+
+    assert isinstance(faiss.downcast_index(pq.index), faiss.IndexScalarQuantizer)
+    assert faiss.downcast_index(fp16.index).sq.qtype == faiss.ScalarQuantizer.QT_fp16
+
+
+def test_evaluate_compression_reports_each_mode():
+    report = evaluate_compression(_vectors(1500), _vectors(10, seed=4), 5, 4)
+
+    assert set(report) == {COMPRESSION_NONE, COMPRESSION_FP16, COMPRESSION_SQ8, COMPRESSION_PQ}
+    assert report[COMPRESSION_NONE]["recall_at_k"] == 1.0
+    assert report[COMPRESSION_FP16]["bytes_per_vector"] == DIM * 2
+    assert report[COMPRESSION_SQ8]["bytes_per_vector"] == DIM
+    assert report[COMPRESSION_PQ]["bytes_per_vector"] < DIM
+    for mode in (COMPRESSION_FP16, COMPRESSION_SQ8, COMPRESSION_PQ):
+        assert report[mode]["recall_at_k_reranked"] >= report[mode]["recall_at_k"]
+        assert report[mode]["exact_vectors_mapped_bytes"] == 1500 * DIM * 4
+
+
+def test_compaction_reencodes_exact_vectors_from_store():
+    corpus = _vectors(400)
+    index = create_compressed_index(DIM, len(corpus), COMPRESSION_SQ8, corpus)
+    index.add_with_ids(corpus, np.arange(len(corpus), dtype='int64'))
+    index = remove_ids_from_index(index, range(0, 40))
+
+    # Store giữ vector khác với mã trong index để biết compact lấy vector từ đâu
+    exact = _vectors(400, seed=7)
+    from_store = compact_index(index, _exact_store(exact))
+    from_codes = compact_index(index)
+
+    inner = faiss.downcast_index(from_store.index)
+    np.testing.assert_array_equal(faiss.vector_to_array(inner.codes), inner.sa_encode(exact[40:]).ravel())
+    np.testing.assert_allclose(from_codes.reconstruct_batch(np.arange(40, 400)), corpus[40:], atol=0.01)
+    np.testing.assert_array_equal(get_index_ids(from_store), np.arange(40, 400))
+
+    # Thiếu vector trong store: lùi về reconstruct từ index
+    partial = VectorStore(DIM)
+    partial.add(range(40, 100), exact[40:100])
+    assert compact_index(index, partial).ntotal == 360
@@ -0,0 +1,191 @@
+import os
+import threading
+
+import faiss
+import numpy as np
+import pytest
+
+from services.rag.chunk_store import ChunkStore
+from utils.faiss_utils import load_index_generation, save_index_to_disk
+from utils.index_manifest import (
+    GenerationConflictError, allocate_generation, collect_old_generations, generation_dir, generation_paths,
+    list_generations, publish_manifest, read_manifest, verify_checksum
+)
+
+DIM = 8
+
+
+def _current_generation():
+    manifest = read_manifest()
+    return manifest["generation"] if manifest else None
+
+
+def _build(num_vectors: int):
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(DIM))
+    ids = np.arange(num_vectors, dtype='int64')
+    index.add_with_ids(np.random.default_rng(num_vectors).random((num_vectors, DIM), dtype='float32'), ids)
+    chunk_store = ChunkStore.from_rows((int(chunk_id), f"chunk {chunk_id}", "a.txt", int(chunk_id), 1) for chunk_id in ids)
+    return index, chunk_store
+
+
+def _save_generation(num_vectors: int, base_generation=None, rollback_generation=None):
+    index, chunk_store = _build(num_vectors)
+    manifest, _ = save_index_to_disk(
+        index, chunk_store, {"index_tier": "flat"},
+        base_generation=_current_generation() if base_generation is None else base_generation,
+        rollback_generation=rollback_generation
+    )
+    return manifest
+
+
+def test_publish_and_load_generation(index_dirs):
+    manifest = _save_generation(10)
+
+    assert read_manifest()["generation"] == manifest["generation"]
+    assert verify_checksum(manifest)
+    index, chunk_store, metadata, _ = load_index_generation(manifest)
+    assert index.ntotal == 10
+    assert chunk_store.get(3)["content"] == "chunk 3"
+    assert metadata["index_tier"] == "flat"
+
+
+def test_each_publish_gets_a_newer_generation(index_dirs):
+    first = _save_generation(5)
+    second = _save_generation(6)
+
+    assert second["generation"] > first["generation"]
+    assert read_manifest()["generation"] == second["generation"]
+
+
+def test_publish_on_stale_base_is_rejected(index_dirs):
+    base = _save_generation(4)
+    newer = _save_generation(5)
+    stale, stale_dir = allocate_generation()
+    faiss.write_index(faiss.IndexFlatL2(DIM), generation_paths(stale_dir)["index"])
+
+    with pytest.raises(GenerationConflictError) as excinfo:
+        publish_manifest(stale, stale_dir, 0, base["generation"])
+
+    assert excinfo.value.current_generation == newer["generation"]
+    assert read_manifest()["generation"] == newer["generation"]
+
+
+def test_second_writer_on_same_base_must_rebuild(index_dirs):
+    base = _save_generation(3)["generation"]
+    first = _save_generation(4, base_generation=base)
+
+    with pytest.raises(GenerationConflictError):
+        _save_generation(5, base_generation=base)
+    # Generation của writer thua không được publish và bị xóa ngay
+    assert list_generations() == [base, first["generation"]]
+
+    retried = _save_generation(5, base_generation=first["generation"])
+    assert read_manifest()["generation"] == retried["generation"]
+    assert read_manifest()["num_vectors"] == 5
+
+
+def test_concurrent_writers_do_not_lose_updates(index_dirs):
+    _save_generation(1)
+    num_writers = 4
+    errors = []
+
+    def writer():
+        # Mỗi writer cộng thêm một vector vào generation mới nhất, dựng lại khi bị từ chối
+        try:
+            while True:
+                current = read_manifest()
+                try:
+                    _save_generation(current["num_vectors"] + 1, base_generation=current["generation"])
+                    return
+                except GenerationConflictError:
+                    continue
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer) for _ in range(num_writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert read_manifest()["num_vectors"] == 1 + num_writers
+
+
+def test_checksum_detects_modified_index(index_dirs):
+    manifest = _save_generation(10)
+    with open(generation_paths(manifest["directory"])["index"], 'ab') as f:
+        f.write(b"corrupt")
+
+    assert not verify_checksum(manifest)
+
+
+def test_load_checks_manifest_without_hashing(index_dirs):
+    manifest = _save_generation(10)
+
+    with pytest.raises(ValueError):
+        load_index_generation({**manifest, "num_vectors": 11})
+    os.remove(generation_paths(manifest["directory"])["index"])
+    with pytest.raises(ValueError):
+        load_index_generation(manifest)
+
+
+def test_collect_old_generations_keeps_newest(index_dirs):
+    manifests = [_save_generation(count) for count in range(3, 8)]
+    collect_old_generations(2)
+
+    assert list_generations() == [manifest["generation"] for manifest in manifests[-2:]]
+
+
+def test_collect_old_generations_keeps_rollback_generation(index_dirs):
+    pinned = _save_generation(3)["generation"]
+    for count in range(4, 8):
+        _save_generation(count, rollback_generation=pinned)
+    collect_old_generations(1)
+
+    assert os.path.isdir(generation_dir(pinned))
+    assert list_generations() == [pinned, read_manifest()["generation"]]
+
+
+def test_collect_old_generations_skips_generations_being_written(index_dirs):
+    published = _save_generation(3)["generation"]
+    in_progress = [allocate_generation()[0] for _ in range(3)]
+
+    collect_old_generations(1)
+
+    assert list_generations() == [published] + in_progress
+
+
+def test_writer_whose_generation_was_collected_gets_a_conflict(index_dirs, monkeypatch):
+    base = _save_generation(3)["generation"]
+    index, chunk_store = _build(4)
+    save = ChunkStore.save
+
+    def save_after_newer_publish(store, directory):
+        # Writer khác publish trong lúc generation này đang ghi, rồi dọn generation cũ
+        monkeypatch.setattr(ChunkStore, "save", save)
+        newer = _save_generation(5, base_generation=base)
+        collect_old_generations(1)
+        save_after_newer_publish.newer = newer["generation"]
+        return save(store, directory)
+
+    monkeypatch.setattr(ChunkStore, "save", save_after_newer_publish)
+    with pytest.raises(GenerationConflictError) as excinfo:
+        save_index_to_disk(index, chunk_store, {}, base_generation=base)
+
+    assert excinfo.value.current_generation == save_after_newer_publish.newer
+    assert read_manifest()["num_vectors"] == 5
+
+
+def test_collections_have_separate_generations(index_dirs):
+    default = _save_generation(3)
+    index, chunk_store = _build(4)
+    manifest, _ = save_index_to_disk(index, chunk_store, {"index_tier": "flat"}, collection_id="docs")
+
+    assert manifest["directory"].startswith(str(index_dirs / "collections" / "docs"))
+    assert read_manifest("docs")["num_vectors"] == 4
+    assert read_manifest()["generation"] == default["generation"] and read_manifest()["num_vectors"] == 3
+    # Base generation được so với manifest của chính collection đó
+    with pytest.raises(GenerationConflictError):
+        save_index_to_disk(index, chunk_store, {}, base_generation=None, collection_id="docs")
+    assert list_generations("docs") == [manifest["generation"]]
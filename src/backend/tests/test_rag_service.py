@@ -0,0 +1,463 @@
+import asyncio
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("google.generativeai")
+
+from config.app_config import AppConfig
+from services.rag.build_pipeline import BuildTimings, EncodedCorpus
+from services.rag.chunk_store import ChunkStore, ChunkStoreWriter
+from services.rag.embedding_cache import CachedEmbedder
+from services.rag.filters import SearchFilter
+from services.rag import rag as rag_module
+from services.rag.rag import RAGService
+from services.rag.snapshot import IndexSnapshot
+from services.rag.vector_store import VectorStore
+from utils.collection_utils import DEFAULT_COLLECTION
+from utils.faiss_utils import remove_ids_from_index
+from utils.index_manifest import list_generations, read_manifest
+from utils.sharded_index import ShardedIndex
+
+DIM = 4
+
+
+class FakeModel:
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        return np.array([[len(text), 1, 0, 0] for text in texts], dtype='float32')
+
+
+class FakeVectorDB:
+    def __init__(self, contents):
+        self.contents = contents
+        self.calls = []
+        self.file_ids = {1, 2}
+        self.rows = []
+
+    def find_file_ids(self, file_names=None, file_ids=None, uploaded_after=None, uploaded_before=None, collection_id=None):
+        return [file_id for file_id in (file_ids or []) if file_id in self.file_ids]
+
+    def get_chunks_by_file_names(self, file_names, collection_id=None):
+        return [row for row in self.rows if row[2] in file_names]
+
+    def count_chunks(self, collection_id=None):
+        return len(self.rows)
+
+    def iter_chunks(self, collection_id=None, page_size=1000, num_partitions=1, partition=0, partition_by="file"):
+        column = 4 if partition_by == "file" else 0
+        rows = sorted(row for row in self.rows if row[column] % num_partitions == partition)
+        for start in range(0, len(rows), page_size):
+            self.calls.append(("page", start))
+            yield rows[start:start + page_size]
+
+    def get_chunks_by_ids(self, chunk_ids):
+        self.calls.append(list(chunk_ids))
+        return {chunk_id: self.contents[chunk_id] for chunk_id in chunk_ids if chunk_id in self.contents}
+
+
+def _service(mapping, db_contents=None) -> RAGService:
+    service = RAGService.__new__(RAGService)
+    service._snapshot = IndexSnapshot(None, mapping)
+    service._previous_snapshot = None
+    service._swap_lock = threading.Lock()
+    service._active_queries = 0
+    service.collection_id = DEFAULT_COLLECTION
+    service.vector_db = FakeVectorDB(db_contents or {})
+    service.model = FakeModel()
+    service.embedder = CachedEmbedder(service.model)
+    service.embedding_backend = "torch"
+    service.optimal_batch_size = 2
+    service.use_gpu = False
+    return service
+
+
+def _rows(ids, file_id=1):
+    return [(chunk_id, "x" * chunk_id, f"{file_id}.txt", chunk_id, file_id) for chunk_id in ids]
+
+
+def _snapshot(service, ids, inner=None):
+    index = faiss.IndexIDMap2(inner if inner is not None else faiss.IndexFlatIP(DIM))
+    chunk_store = ChunkStore()
+    service._add_chunks_to_index(_rows(ids), index, chunk_store)
+    return IndexSnapshot(index, chunk_store, service._build_index_metadata(index, len(ids)))
+
+
+def test_hits_resolve_from_mapping_without_database():
+    service = _service({
+        1: {'chunk_id': 1, 'content': "một", 'source': "a.txt", 'chunk_index': 0},
+        2: {'chunk_id': 2, 'content': "hai", 'source': "a.txt", 'chunk_index': 1},
+    })
+
+    hits = service._resolve_hits(np.array([[2, -1, 1, 99]]), np.array([[0.1, 0.0, 0.2, 0.3]]))[0]
+
+    assert [hit["content"] for hit in hits] == ["hai", "một"]
+    assert [hit["score"] for hit in hits] == pytest.approx([0.1, 0.2])
+    assert service.vector_db.calls == []
+
+
+def test_missing_contents_are_read_in_one_query():
+    service = _service(
+        {
+            1: {'chunk_id': 1, 'content': None, 'source': "a.txt", 'chunk_index': 0},
+            2: {'chunk_id': 2, 'content': "hai", 'source': "a.txt", 'chunk_index': 1},
+            3: {'chunk_id': 3, 'content': None, 'source': "b.txt", 'chunk_index': 0},
+        },
+        db_contents={1: "một", 3: "ba"},
+    )
+
+    hits = service._resolve_hits(np.array([[3, 2, 1]]), np.array([[0.1, 0.2, 0.3]]))[0]
+
+    assert [hit["content"] for hit in hits] == ["ba", "hai", "một"]
+    assert len(service.vector_db.calls) == 1 and sorted(service.vector_db.calls[0]) == [1, 3]
+
+
+def test_incremental_snapshot_leaves_live_snapshot_untouched():
+    service = _service(ChunkStore())
+    base = _snapshot(service, [1, 2, 3])
+
+    updated = service._build_incremental_snapshot(base, [1], _rows([4]), 3)
+
+    assert base.index.ntotal == 3 and 1 in base.chunk_store and 4 not in base.chunk_store
+    assert updated.index.ntotal == 3 and 1 not in updated.chunk_store and 4 in updated.chunk_store
+    _, ids = updated.index.search(np.array([[4, 1, 0, 0]], dtype='float32'), 3)
+    assert 1 not in ids[0]
+
+
+def test_publish_swaps_snapshot_and_rollback_restores_previous(index_dirs, monkeypatch):
+    monkeypatch.setattr(AppConfig, "FAISS_MMAP_ENABLED", False)
+    service = _service(ChunkStore())
+    service._update_lock = asyncio.Lock()
+    first = _snapshot(service, [1, 2])
+    second = _snapshot(service, [1, 2, 3])
+
+    first_store = first.chunk_store
+    published = service._publish_snapshot(first, None)
+    service._publish_snapshot(second, published.generation)
+    assert service.index is second.index and service._previous_snapshot is published
+
+    assert asyncio.run(service.rollback_index())
+    assert service.index is published.index
+    assert len(service.chunk_id_mapping) == 2
+    assert read_manifest()["generation"] == service._snapshot.generation
+    # Snapshot cũ mà truy vấn có thể đang giữ không bị sửa khi publish
+    assert first.chunk_store is first_store and first.generation is None
+
+
+def test_concurrent_publish_from_another_worker_is_rebuilt_on(index_dirs, monkeypatch):
+    monkeypatch.setattr(AppConfig, "FAISS_MMAP_ENABLED", False)
+    worker_a, worker_b = _service(ChunkStore()), _service(ChunkStore())
+    worker_b.vector_db = worker_a.vector_db
+    for worker in (worker_a, worker_b):
+        worker._update_lock = asyncio.Lock()
+        worker._index_needs_rebuild = False
+        worker._last_reload_at = None
+    worker_a.vector_db.rows = _rows([1, 2, 3]) + _rows([10, 11], file_id=2) + _rows([20], file_id=3)
+    worker_a._publish_snapshot(_snapshot(worker_a, [1, 2, 3]), None)
+    worker_b._reload_from_manifest()
+
+    build = worker_b._build_incremental_snapshot
+    builds = []
+
+    def build_while_a_publishes(base, stale_ids, new_chunks, num_chunks):
+        # Worker A publish xong trong lúc worker B đang build trên cùng generation
+        if not builds:
+            asyncio.run(worker_a.update_index_for_files(["2.txt"]))
+        builds.append(base.generation)
+        return build(base, stale_ids, new_chunks, num_chunks)
+
+    monkeypatch.setattr(worker_b, "_build_incremental_snapshot", build_while_a_publishes)
+    asyncio.run(worker_b.update_index_for_files(["3.txt"]))
+
+    assert len(builds) == 2 and builds[1] > builds[0]
+    assert set(worker_b.chunk_id_mapping.ids().tolist()) == {1, 2, 3, 10, 11, 20}
+    assert read_manifest()["generation"] == worker_b._snapshot.generation
+    assert read_manifest()["num_vectors"] == 6
+    # Generation của lần publish bị từ chối không còn trên đĩa
+    assert worker_b._snapshot.generation in list_generations() and len(list_generations()) == 3
+
+
+def test_tuning_publishes_new_snapshot_without_touching_live_one(index_dirs, monkeypatch):
+    monkeypatch.setattr(AppConfig, "FAISS_MMAP_ENABLED", False)
+    service = _service(ChunkStore())
+    service._update_lock = asyncio.Lock()
+    inner = faiss.IndexHNSWFlat(DIM, 8)
+    inner.hnsw.efSearch = 16
+    live = _snapshot(service, list(range(1, 200)), inner)
+    service._snapshot = live
+
+    result = asyncio.run(service.tune_search_params(k=5, target_recall=0.5, sample_size=20))
+
+    assert result["tuned"]
+    assert service._snapshot is not live and service._previous_snapshot is live
+    assert "search_params" not in live.metadata and inner.hnsw.efSearch == 16
+    tuned_index = faiss.downcast_index(service.index.index)
+    assert tuned_index.hnsw.efSearch == result["efSearch"]
+    assert service.index_metadata["search_params"]["efSearch"] == result["efSearch"]
+
+
+def test_retrieve_batch_matches_per_query_search():
+    service = _service(ChunkStore())
+    snapshot = _snapshot(service, list(range(1, 40)))
+    snapshot.index = remove_ids_from_index(snapshot.index, [5, 6])
+    snapshot.chunk_store.remove([5, 6])
+    service._snapshot = snapshot
+    questions = ["x" * length for length in (3, 5, 6, 20, 38)]
+
+    batch = asyncio.run(service.retrieve_batch(questions, k=4))
+
+    for question, hits in zip(questions, batch):
+        D, I = service.search(service._encode_queries([question]), 4)
+        expected = service._resolve_hits(I, D)[0]
+        assert hits == expected and len(hits) == 4
+        assert not {5, 6} & {hit["chunk_id"] for hit in hits}
+
+
+def test_diversified_retrieval_reselects_from_wider_candidate_pool(monkeypatch):
+    monkeypatch.setattr(AppConfig, "RAG_MMR_FETCH_FACTOR", 3)
+    monkeypatch.setattr(AppConfig, "RAG_MMR_LAMBDA", 0.0)
+    service = _service(ChunkStore())
+    service._snapshot = _snapshot(service, list(range(1, 40)), faiss.IndexFlatL2(DIM))
+
+    plain = asyncio.run(service.retrieve_batch(["x" * 20], k=3))[0]
+    diverse = asyncio.run(service.retrieve_batch(["x" * 20], k=3, diversify=True))[0]
+
+    assert [hit["chunk_id"] for hit in plain] == [20, 19, 21]
+    # Ứng viên là 9 chunk gần nhất; lambda 0 chỉ giữ hit đầu rồi chọn các hit khác xa nhau nhất
+    diverse_ids = [hit["chunk_id"] for hit in diverse]
+    assert len(diverse_ids) == 3 and diverse_ids[0] == 20
+    assert set(diverse_ids) <= set(range(16, 25)) and diverse_ids != [20, 19, 21]
+
+
+class FakeReranker:
+    top_n = 6
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.timeouts = 0
+
+    def rerank(self, question, hits):
+        time.sleep(self.delay)
+        return [{**hit, "rerank_score": float(hit["chunk_id"])} for hit in sorted(hits, key=lambda hit: -hit["chunk_id"])]
+
+    def record_timeout(self):
+        self.timeouts += 1
+
+
+def _reranking_service(monkeypatch, reranker):
+    monkeypatch.setattr(rag_module, "get_reranker", lambda: reranker)
+    monkeypatch.setattr(AppConfig, "RAG_MMR_ENABLED", False)
+    monkeypatch.setattr(AppConfig, "RAG_RERANKER_TOP_N", 6)
+    service = _service(ChunkStore())
+    service._snapshot = _snapshot(service, list(range(1, 40)), faiss.IndexFlatL2(DIM))
+    return service
+
+
+def test_reranker_reorders_a_wider_candidate_pool(monkeypatch):
+    service = _reranking_service(monkeypatch, FakeReranker())
+
+    hits = asyncio.run(service.retrieve_batch(["x" * 20], k=3, diversify=True))[0]
+
+    # 6 ứng viên gần nhất (17..22) được chấm lại, chỉ trả về k hit
+    assert [hit["chunk_id"] for hit in hits] == [22, 21, 20]
+    assert all("rerank_score" in hit for hit in hits)
+
+
+def test_reranker_timeout_keeps_faiss_order(monkeypatch):
+    reranker = FakeReranker(delay=0.2)
+    service = _reranking_service(monkeypatch, reranker)
+    monkeypatch.setattr(AppConfig, "RAG_RERANKER_TIMEOUT_MS", 20)
+
+    hits = asyncio.run(service.retrieve_batch(["x" * 20], k=3, diversify=True))[0]
+
+    assert [hit["chunk_id"] for hit in hits] == [20, 19, 21]
+    assert not any("rerank_score" in hit for hit in hits)
+    assert reranker.timeouts == 1
+
+
+def test_candidate_vectors_prefer_exact_store_then_index():
+    service = _service(ChunkStore())
+    snapshot = _snapshot(service, [1, 2, 3], faiss.IndexFlatL2(DIM))
+    hits = [{"chunk_id": 3, "content": "xxx"}, {"chunk_id": 1, "content": "x"}]
+
+    np.testing.assert_array_equal(service._candidate_vectors(hits, snapshot), [[3, 1, 0, 0], [1, 1, 0, 0]])
+
+    snapshot.vector_store = VectorStore(DIM)
+    snapshot.vector_store.add([1, 3], np.array([[9, 9, 9, 9], [7, 7, 7, 7]], dtype='float32'))
+    np.testing.assert_array_equal(service._candidate_vectors(hits, snapshot), [[7, 7, 7, 7], [9, 9, 9, 9]])
+
+
+def test_sharded_incremental_update_matches_single_index():
+    service = _service(ChunkStore())
+    rows = [row for file_id in (1, 2, 3) for row in _rows(range(file_id * 10, file_id * 10 + 8), file_id)]
+    sharded = ShardedIndex([faiss.IndexIDMap2(faiss.IndexHNSWFlat(DIM, 8)) for _ in range(3)], "file")
+    single = faiss.IndexIDMap2(faiss.IndexHNSWFlat(DIM, 8))
+    bases = []
+    for index in (sharded, single):
+        chunk_store = ChunkStore()
+        service._add_chunks_to_index(rows, index, chunk_store)
+        bases.append(IndexSnapshot(index, chunk_store, service._build_index_metadata(index, len(rows))))
+
+    # Xóa mềm chunk của file 2 (chỉ nằm trong shard 2) và thêm chunk mới cho file 1
+    stale_ids = list(range(20, 28))
+    updated = [service._build_incremental_snapshot(base, stale_ids, _rows([40, 41], 1), 18) for base in bases]
+    queries = service._encode_queries(["x" * length for length in (12, 21, 25, 40)])
+
+    sharded_ids, single_ids = (service.search(queries, 5, snapshot)[1] for snapshot in updated)
+    np.testing.assert_array_equal(sharded_ids, single_ids)
+    assert not set(stale_ids) & set(sharded_ids.ravel().tolist())
+    assert updated[0].index.shards[0] is not sharded.shards[0] and sharded.ntotal == len(rows)
+
+
+def test_full_build_encodes_each_chunk_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(AppConfig, "RAG_BUILD_TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(AppConfig, "EMBEDDING_POOL_WORKERS", 1)
+    service = _service(ChunkStore())
+    service.optimal_batch_size = 64
+    encoded = []
+    encode = service.model.encode
+    service.model.encode = lambda texts, **kwargs: (encoded.extend(texts), encode(texts, **kwargs))[1]
+    # Hơn 1000 chunk nên có lấy mẫu train, mẫu phải đọc lại từ ma trận đã encode
+    rows = _rows(range(1, 1201))
+    pages = (rows[start:start + 500] for start in range(0, len(rows), 500))
+    writer = ChunkStoreWriter(str(tmp_path / "store"))
+
+    timings = BuildTimings()
+    index = asyncio.run(service._build_from_pages(pages, writer.append, timings, len(rows)))
+    chunk_store = writer.close()
+
+    assert sorted(encoded) == sorted(row[1] for row in rows)
+    assert index.ntotal == 1200 and len(chunk_store) == 1200 and timings.num_vectors == 1200
+    assert {"encode", "train", "add"} <= set(timings.phases)
+    assert os.listdir(tmp_path) == ["store"]
+
+
+
+def test_full_rebuild_streams_pages_into_published_generation(index_dirs, tmp_path, monkeypatch):
+    monkeypatch.setattr(AppConfig, "RAG_BUILD_TMP_DIR", str(tmp_path / "scratch"))
+    monkeypatch.setattr(AppConfig, "RAG_REBUILD_PAGE_SIZE", 4)
+    monkeypatch.setattr(AppConfig, "EMBEDDING_POOL_WORKERS", 1)
+    service = _service(ChunkStore())
+    service._update_lock = asyncio.Lock()
+    service._index_needs_rebuild = True
+    service._last_reload_at = None
+    service.vector_db.rows = _rows([3, 1, 2]) + _rows(range(10, 17), file_id=2)
+
+    asyncio.run(service._run_rebuild())
+
+    assert len(service.vector_db.calls) == 3  # 10 chunk, trang 4 dòng
+    assert read_manifest()["generation"] == service._snapshot.generation
+    assert read_manifest()["num_vectors"] == 10 and not service._index_needs_rebuild
+    np.testing.assert_array_equal(service.chunk_id_mapping.ids(), [1, 2, 3] + list(range(10, 17)))
+    assert service.chunk_id_mapping.get(12)['content'] == "x" * 12
+    assert os.listdir(tmp_path / "scratch") == []
+
+class FakePool:
+    preferred_batch_size = 50
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts):
+        self.batches.append(len(texts))
+        return FakeModel().encode(texts)
+
+
+def test_small_pages_are_regrouped_into_full_pool_batches(tmp_path):
+    service = _service(ChunkStore())
+    pool = FakePool()
+    rows = _rows(range(1, 131))
+    pages = (rows[start:start + 7] for start in range(0, len(rows), 7))
+    added = []
+
+    with EncodedCorpus(DIM, str(tmp_path)) as corpus:
+        ids, file_ids = service._encode_pages(pages, corpus, added.extend, pool)
+
+        # Mọi worker đều có việc: mỗi lần gọi pool nhận đủ preferred_batch_size dòng trừ lần cuối
+        assert pool.batches == [50, 50, 30]
+        np.testing.assert_array_equal(ids, [row[0] for row in rows])
+        assert added == rows and file_ids.tolist() == [1] * len(rows)
+        np.testing.assert_array_equal(corpus.rows(0, len(rows)), FakeModel().encode([row[1] for row in rows]))
+
+
+def test_retrieve_batch_reads_missing_contents_in_one_query():
+    service = _service(ChunkStore())
+    snapshot = _snapshot(service, [1, 2, 3])
+    snapshot.chunk_store = ChunkStore.from_rows([(chunk_id, None, "a.txt", 0, 1) for chunk_id in (1, 2, 3)])
+    service._snapshot = snapshot
+    service.vector_db = FakeVectorDB({1: "một", 2: "hai", 3: "ba"})
+
+    batch = asyncio.run(service.retrieve_batch(["x", "xx", "xxx"], k=3))
+
+    assert len(service.vector_db.calls) == 1
+    assert sorted(service.vector_db.calls[0]) == [1, 2, 3]
+    assert all(hit["content"] for hits in batch for hit in hits)
+
+
+def test_filtered_retrieval_only_returns_matching_files():
+    service = _service(ChunkStore())
+    snapshot = _snapshot(service, [])
+    service._add_chunks_to_index(_rows(range(1, 20), file_id=1) + _rows(range(20, 30), file_id=2), snapshot.index, snapshot.chunk_store)
+    service._snapshot = snapshot
+
+    filtered = asyncio.run(service.retrieve_batch(["x" * 40], k=5, search_filter=SearchFilter(file_ids=[1])))
+    unknown = asyncio.run(service.retrieve_batch(["x" * 40], k=5, search_filter=SearchFilter(file_ids=[9])))
+
+    assert [hit["chunk_id"] for hit in filtered[0]] == [19, 18, 17, 16, 15]
+    assert unknown == [[]]
+
+
+def test_published_index_is_mmapped_and_still_updatable(index_dirs, monkeypatch):
+    monkeypatch.setattr(AppConfig, "FAISS_MMAP_ENABLED", True)
+    service = _service(ChunkStore())
+    inner = faiss.IndexHNSWFlat(DIM, 8)
+
+    published = service._publish_snapshot(_snapshot(service, list(range(1, 50)), inner), None)
+    assert published.mmapped and service._snapshot is published
+
+    for new_id, stale_id in ((60, 1), (61, 2)):
+        snapshot = service._build_incremental_snapshot(service._snapshot, [stale_id], _rows([new_id]), 49)
+        service._publish_snapshot(snapshot, service._snapshot.generation)
+
+    ids = set(service.chunk_id_mapping.ids().tolist())
+    assert {60, 61} <= ids and not {1, 2} & ids
+    assert published.index.ntotal == 49 and 1 in published.chunk_store
+
+
+def test_compressed_index_keeps_exact_vectors_through_updates(index_dirs, tmp_path, monkeypatch):
+    monkeypatch.setattr(AppConfig, "RAG_BUILD_TMP_DIR", str(tmp_path / "scratch"))
+    monkeypatch.setattr(AppConfig, "RAG_VECTOR_COMPRESSION", "sq8")
+    monkeypatch.setattr(AppConfig, "FAISS_MMAP_ENABLED", False)
+    monkeypatch.setattr(AppConfig, "EMBEDDING_POOL_WORKERS", 1)
+    service = _service(ChunkStore())
+    service._update_lock = asyncio.Lock()
+    service._index_needs_rebuild = True
+    service._last_reload_at = None
+    service.vector_db.rows = _rows(range(1, 21))
+
+    asyncio.run(service._run_rebuild())
+    rebuilt = service._snapshot
+    assert rebuilt.vector_store is not None and len(rebuilt.vector_store) == 20
+    assert rebuilt.metadata["vector_compression"] == "sq8"
+
+    snapshot = service._build_incremental_snapshot(rebuilt, [5], _rows([30]), 20)
+    published = service._publish_snapshot(snapshot, rebuilt.generation)
+
+    # Vector chính xác đi theo generation được publish, kể cả sau khi load lại
+    assert published.vector_store is not None and 30 in published.vector_store and 5 not in published.vector_store
+    assert 5 in rebuilt.vector_store
+    reloaded = service._load_generation_snapshot(read_manifest())
+    np.testing.assert_array_equal(reloaded.vector_store.ids(), published.chunk_store.ids())
+
+    distances, ids = service.search(np.array([[30, 1, 0, 0]], dtype='float32'), 3)
+    assert ids[0].tolist() == [30, 20, 19]
+    np.testing.assert_allclose(distances[0], [0, 100, 121])
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("google.generativeai")
+
+from config.app_config import AppConfig
+from services.rag import registry as registry_module
+from services.rag.chunk_store import ChunkStore
+from services.rag.rag import RAGService
+from services.rag.registry import RAGServiceRegistry
+
+
+class FakeBackend:
+    def __init__(self, name="torch", vectors=None):
+        self.name = name
+        self.vectors = vectors
+
+    def encode(self, texts):
+        return np.tile(self.vectors, (len(texts), 1))
+
+    def memory_bytes(self):
+        return 0
+
+
+def test_model_and_service_are_created_once(monkeypatch):
+    created = {"models": 0, "services": 0}
+
+    def fake_backend(name, *args):
+        created["models"] += 1
+        return FakeBackend(name)
+
+    class FakeService:
+        def __init__(self, upload_dir, model):
+            created["services"] += 1
+            self.model = model
+            self.index = None
+            self.chunk_id_mapping = ChunkStore()
+            self.vector_store = None
+
+    monkeypatch.setattr(registry_module.config, "EMBEDDING_BACKEND", "torch")
+    monkeypatch.setattr(registry_module, "create_embedding_backend", fake_backend)
+    monkeypatch.setattr(registry_module, "RAGService", FakeService)
+    registry = RAGServiceRegistry()
+
+    services = []
+    threads = [threading.Thread(target=lambda: services.append(registry.get_rag_service())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created == {"models": 1, "services": 1}
+    assert all(service is services[0] for service in services)
+    assert services[0].model is registry.get_embedding_model()
+    assert registry.get_memory_footprint()["service_initialized"]
+
+
+@pytest.mark.parametrize("int8_vector, expected", [([1.0, 0.05], "onnx_int8"), ([0.0, 1.0], "torch")])
+def test_int8_backend_falls_back_to_torch_when_it_disagrees(monkeypatch, int8_vector, expected):
+    monkeypatch.setattr(registry_module.config, "EMBEDDING_BACKEND", "onnx_int8")
+    monkeypatch.setattr(registry_module.config, "EMBEDDING_VERIFY_BACKEND", True)
+    monkeypatch.setattr(registry_module.config, "EMBEDDING_AGREEMENT_THRESHOLD", 0.99)
+    monkeypatch.setattr(
+        registry_module, "create_embedding_backend",
+        lambda name, *args: FakeBackend(name, np.array(int8_vector, dtype='float32'))
+    )
+    monkeypatch.setattr(
+        registry_module, "TorchEmbeddingBackend",
+        lambda model_name: FakeBackend("torch", np.array([1.0, 0.0], dtype='float32'))
+    )
+
+    backend = RAGServiceRegistry().get_embedding_model()
+
+    assert backend.name == expected
+    assert backend.agreement["passed"] == (expected == "onnx_int8")
+
+
+def _idle_service() -> RAGService:
+    service = RAGService.__new__(RAGService)
+    service._rebuild_task = None
+    service._update_lock = asyncio.Lock()
+    service._active_queries = 0
+    return service
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(AppConfig, "RAG_MAX_ACTIVE_COLLECTIONS", 1)
+    monkeypatch.setattr(AppConfig, "RAG_COLLECTION_IDLE_SECONDS", 0)
+    registry = RAGServiceRegistry()
+    registry._collections["old"] = _idle_service()
+    registry._collections["new"] = _idle_service()
+    return registry
+
+
+def test_service_with_running_query_is_not_evicted(registry):
+    service = registry._collections["old"]
+
+    with service._track_query():
+        assert registry._pop_evictable(keep="new") == []
+    assert registry._pop_evictable(keep="new") == [("old", service)]
+
+
+def test_service_holding_update_lock_is_not_evicted(registry):
+    service = registry._collections["old"]
+
+    async def evict_while_updating():
+        async with service._update_lock:
+            return registry._pop_evictable(keep="new")
+
+    assert asyncio.run(evict_while_updating()) == []
+    assert "old" in registry._collections
@@ -0,0 +1,61 @@
+import numpy as np
+
+from services.rag.reranker import CrossEncoderReranker
+
+
+class FakeCrossEncoder:
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.batches.append(list(pairs))
+        # Điểm cao hơn cho chunk chứa nhiều từ của câu hỏi hơn
+        return np.array([len(set(query.split()) & set(content.split())) for query, content in pairs], dtype='float32')
+
+
+def _reranker(top_n=3, cache_size=100):
+    reranker = CrossEncoderReranker("fake", top_n=top_n, cache_size=cache_size)
+    reranker._model = FakeCrossEncoder()
+    return reranker
+
+
+def _hits(contents):
+    return [{"chunk_id": chunk_id, "content": content, "score": float(chunk_id)} for chunk_id, content in enumerate(contents)]
+
+
+def test_rerank_orders_top_n_by_cross_encoder_score():
+    reranker = _reranker(top_n=3)
+    hits = _hits(["mèo đen", "giá vàng hôm nay", "vàng", "giá vàng hôm nay tăng"])
+
+    reranked = reranker.rerank("giá vàng hôm nay", hits)
+
+    assert [hit["chunk_id"] for hit in reranked] == [1, 2, 0]
+    assert [hit["rerank_score"] for hit in reranked] == [4.0, 1.0, 0.0]
+    assert "rerank_score" not in hits[1]
+    assert len(reranker._model.batches) == 1 and len(reranker._model.batches[0]) == 3
+
+
+def test_scores_are_cached_per_question_and_chunk():
+    reranker = _reranker(top_n=5)
+    hits = _hits(["a b", "b c", "c d"])
+
+    reranker.rerank("b c", hits[:2])
+    reranker.rerank(" b c ", hits)
+    reranker.rerank("c d", hits[:1])
+
+    batches = reranker._model.batches
+    assert [len(batch) for batch in batches] == [2, 1, 1]
+    assert batches[1] == [(" b c ", "c d")]
+    stats = reranker.get_stats()
+    assert stats["cache_hits"] == 2 and stats["scored_pairs"] == 4 and stats["cache_size"] == 4
+
+
+def test_cache_is_bounded_lru():
+    reranker = _reranker(top_n=5, cache_size=2)
+    hits = _hits(["x", "y", "z"])
+
+    reranker.score("q", hits[:2])
+    reranker.score("q", hits[:1])  # chunk 0 dùng gần nhất
+    reranker.score("q", hits[2:])
+
+    assert set(reranker._cache) == {(reranker.query_key("q"), 0), (reranker.query_key("q"), 2)}
@@ -0,0 +1,95 @@
+import faiss
+import numpy as np
+import pytest
+
+from utils.faiss_utils import remove_ids_from_index
+from utils.search_tuner import (
+    EF_SEARCH_CANDIDATES, apply_search_params, exact_knn, get_search_param_candidates, tune_search_params
+)
+
+DIM = 32
+COUNT = 3000
+
+
+def _vectors(count=COUNT, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, DIM)).astype('float32')
+
+
+def _hnsw_index(vectors):
+    index = faiss.IndexIDMap2(faiss.IndexHNSWFlat(DIM, 8))
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    return index
+
+
+def _ivf_index(vectors):
+    inner = faiss.IndexIVFFlat(faiss.IndexFlatL2(DIM), DIM, 64)
+    inner.train(vectors)
+    index = faiss.IndexIDMap2(inner)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    return index
+
+
+def _ground_truth(vectors, ids, query_ids, k):
+    blocks = [(ids[start:start + 700], vectors[start:start + 700]) for start in range(0, len(ids), 700)]
+    return exact_knn(vectors[query_ids], blocks, k + 1)[1]
+
+
+def test_exact_knn_over_blocks_matches_single_pass():
+    vectors = _vectors(500)
+    ids = np.arange(500, dtype='int64') + 1000
+    queries = vectors[:20]
+
+    _, block_ids = exact_knn(queries, [(ids[:123], vectors[:123]), (ids[123:], vectors[123:])], 5)
+    _, positions = faiss.knn(queries, vectors, 5)
+
+    np.testing.assert_array_equal(block_ids, ids[positions])
+
+
+@pytest.mark.parametrize("build", [_hnsw_index, _ivf_index])
+def test_chooses_cheapest_value_meeting_target(build):
+    vectors = _vectors()
+    index = build(vectors)
+    query_ids = np.arange(0, COUNT, 30)
+    exact_ids = _ground_truth(vectors, np.arange(COUNT), query_ids, 10)
+
+    result = tune_search_params(index, query_ids, vectors[query_ids], exact_ids, k=10, target_recall=0.9)
+
+    name = result["param"]
+    assert result["target_met"] and result["recall"] >= 0.9
+    # Mọi giá trị rẻ hơn giá trị được chọn đều chưa đạt mục tiêu
+    assert all(entry["recall"] < 0.9 for entry in result["sweep"][:-1])
+    assert result["sweep"][-1][name] == result[name]
+    assert result[name] == get_search_param_candidates(index)[len(result["sweep"]) - 1]
+
+
+def test_unreachable_target_picks_highest_recall():
+    vectors = _vectors(1000)
+    index = _hnsw_index(vectors)
+    query_ids = np.arange(0, 1000, 25)
+    exact_ids = _ground_truth(vectors, np.arange(1000), query_ids, 10)
+
+    result = tune_search_params(index, query_ids, vectors[query_ids], exact_ids, k=10, target_recall=1.01)
+
+    assert not result["target_met"]
+    assert len(result["sweep"]) == len(EF_SEARCH_CANDIDATES)
+    assert result["recall"] == max(entry["recall"] for entry in result["sweep"])
+
+
+def test_sweep_skips_deleted_vectors():
+    vectors = _vectors(1000)
+    index = remove_ids_from_index(_hnsw_index(vectors), list(range(0, 1000, 10)))
+    live = np.array([chunk_id for chunk_id in range(1000) if chunk_id % 10], dtype='int64')
+    query_ids = live[::20]
+    exact_ids = _ground_truth(vectors[live], live, np.searchsorted(live, query_ids), 10)
+
+    result = tune_search_params(index, query_ids, vectors[query_ids], exact_ids, k=10, target_recall=0.99)
+
+    assert result["recall"] >= 0.99
+
+
+def test_apply_search_params_sets_index_parameter():
+    index = _ivf_index(_vectors())
+
+    assert apply_search_params(index, {"param": "nprobe", "nprobe": 12})
+    assert faiss.extract_index_ivf(index.index).nprobe == 12
+    assert not apply_search_params(index, {"efSearch": 64})
@@ -0,0 +1,125 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from services.rag.chunk_store import ChunkStore
+from utils.faiss_utils import (
+    clone_index, count_deleted_vectors, exclude_deleted, get_index_ids, load_index_generation, read_index_file,
+    remove_ids_from_index, save_index_to_disk, search_subset, write_index_file
+)
+from utils.index_manifest import shard_index_path
+from utils.sharded_index import SHARD_BY_FILE, SHARD_BY_HASH, ShardedIndex, merge_results
+
+DIM = 16
+NUM_SHARDS = 3
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).random((count, DIM), dtype='float32')
+
+
+def _sharded(make_shard, count: int = 300, shard_by: str = SHARD_BY_HASH) -> ShardedIndex:
+    index = ShardedIndex([faiss.IndexIDMap2(make_shard()) for _ in range(NUM_SHARDS)], shard_by)
+    index.add_with_ids(_vectors(count), np.arange(count, dtype='int64'))
+    return index
+
+
+def _hnsw():
+    shard = faiss.IndexHNSWFlat(DIM, 16)
+    shard.hnsw.efSearch = 128
+    return shard
+
+
+def test_sharded_search_matches_single_index():
+    single = faiss.IndexIDMap2(faiss.IndexFlatL2(DIM))
+    single.add_with_ids(_vectors(300), np.arange(300, dtype='int64'))
+    sharded = _sharded(lambda: faiss.IndexFlatL2(DIM))
+    queries = _vectors(5, seed=1)
+
+    expected_distances, expected_ids = single.search(queries, 10)
+    distances, ids = sharded.search(queries, 10)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+    assert [entry["searches"] for entry in sharded.describe_shards()] == [1] * NUM_SHARDS
+
+
+def test_merge_results_pads_when_shards_return_fewer_than_k():
+    first = (np.array([[0.1, 0.4]], dtype='float32'), np.array([[1, 4]], dtype='int64'))
+    second = (np.array([[0.2, np.inf]], dtype='float32'), np.array([[2, -1]], dtype='int64'))
+
+    distances, ids = merge_results([first, second], 4)
+
+    assert ids.tolist() == [[1, 2, 4, -1]]
+    assert distances[0, :3].tolist() == pytest.approx([0.1, 0.2, 0.4])
+
+
+def test_file_sharding_keeps_a_file_in_one_shard():
+    index = ShardedIndex([faiss.IndexIDMap2(faiss.IndexFlatL2(DIM)) for _ in range(NUM_SHARDS)], SHARD_BY_FILE)
+    file_ids = np.repeat([7, 8, 9], 4)
+    index.add_with_ids(_vectors(12), np.arange(12, dtype='int64'), file_ids)
+
+    for file_id in (7, 8, 9):
+        chunk_ids = np.arange(12)[file_ids == file_id]
+        assert np.isin(chunk_ids, index.shard_ids(file_id % NUM_SHARDS)).all()
+
+
+def test_removal_only_tombstones_owning_shards():
+    index = _sharded(_hnsw)
+    untouched = index.shards[2]
+    removed = [0, 3, 6, 1]  # shard 0 và 1 theo chunk_id mod 3
+
+    index = remove_ids_from_index(index, removed)
+
+    assert index.shards[2] is untouched and count_deleted_vectors(index) == len(removed)
+    assert set(removed).isdisjoint(get_index_ids(index).tolist())
+    assert set(removed).isdisjoint(index.shard_ids(0).tolist() + index.shard_ids(1).tolist())
+    _, ids = index.search(_vectors(300)[removed], 5, params=exclude_deleted(index))
+    assert set(removed).isdisjoint(ids.ravel().tolist())
+
+
+def test_search_subset_on_shards_matches_exact():
+    index = _sharded(lambda: faiss.IndexFlatL2(DIM))
+    subset = np.arange(0, 300, 7, dtype='int64')
+    queries = _vectors(4, seed=2)
+
+    _, ids = search_subset(index, queries, 5, subset)
+
+    exact = faiss.knn(queries, _vectors(300)[subset], 5)[1]
+    np.testing.assert_array_equal(ids, subset[exact])
+
+
+def test_clone_of_mmapped_shards_is_writable(tmp_path):
+    shards = []
+    for shard_id in range(2):
+        shard = faiss.IndexIDMap2(faiss.IndexFlatL2(DIM))
+        ids = np.arange(shard_id, 100, 2, dtype='int64')
+        shard.add_with_ids(_vectors(len(ids), seed=shard_id), ids)
+        path = str(tmp_path / f"shard-{shard_id}.bin")
+        write_index_file(shard, path)
+        shards.append(read_index_file(path, mmap=True)[0])
+    mapped = ShardedIndex(shards, SHARD_BY_HASH)
+
+    index = clone_index(mapped)
+    index.add_with_ids(_vectors(4, seed=3), np.arange(100, 104, dtype='int64'))
+    index = remove_ids_from_index(index, [0, 1, 101])
+
+    assert index.ntotal == 101
+    assert {0, 1, 101}.isdisjoint(get_index_ids(index).tolist())
+    assert mapped.ntotal == 100
+
+
+def test_sharded_generation_round_trip(index_dirs):
+    index = _sharded(lambda: faiss.IndexFlatL2(DIM), count=30)
+    chunk_store = ChunkStore.from_rows((chunk_id, f"chunk {chunk_id}", "a.txt", chunk_id, 1) for chunk_id in range(30))
+    manifest, _ = save_index_to_disk(index, chunk_store, {"index_tier": "flat"})
+
+    loaded, _, _, _ = load_index_generation(manifest)
+    assert isinstance(loaded, ShardedIndex) and loaded.num_shards == NUM_SHARDS
+    assert [shard.ntotal for shard in loaded.shards] == [shard.ntotal for shard in index.shards]
+
+    os.remove(shard_index_path(manifest["directory"], 1))
+    with pytest.raises(ValueError):
+        load_index_generation(manifest)
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("google.generativeai")
+
+from services.llm.generator import GeneratorService
+from utils.sse import sse_events
+
+
+class FailingLLM:
+    async def generateContentStream(self, *args, **kwargs):
+        yield "Một phần "
+        raise RuntimeError("model unavailable")
+
+
+class RecordingConversations:
+    def __init__(self):
+        self.messages = []
+
+    def format_conversation_for_context(self, conversation_id):
+        return None
+
+    def add_message(self, conversation_id, role, content):
+        self.messages.append((conversation_id, role, content))
+
+
+def _generator_service() -> GeneratorService:
+    service = GeneratorService.__new__(GeneratorService)
+    service.llm = FailingLLM()
+    service.conversation_service = RecordingConversations()
+    service.quick_responses = {}
+    return service
+
+
+async def _collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_stream_failure_emits_error_event_and_is_not_saved():
+    service = _generator_service()
+
+    events = asyncio.run(_collect(sse_events(service.generate_content_stream("Câu hỏi?", conversation_id="c1"))))
+
+    assert events[0].startswith("event: token")
+    assert events[-1].startswith("event: error")
+    assert "model unavailable" in events[-1]
+    assert service.conversation_service.messages == []
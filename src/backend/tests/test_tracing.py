@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from services.rag.executor import run_inference
+from utils.tracing import (
+    InMemorySpanExporter, TraceContextMiddleware, Tracer, parse_traceparent, span, traced, tracer
+)
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemorySpanExporter()
+    previous = tracer.exporter, tracer.exporter_name, tracer.use_otel
+    tracer.set_exporter(exporter)
+    yield exporter
+    tracer.exporter, tracer.exporter_name, tracer.use_otel = previous
+
+
+def test_spans_nest_across_the_inference_executor(exporter):
+    def work():
+        with span("thread"):
+            pass
+
+    @traced("outer")
+    async def outer():
+        with span("inner", k=5):
+            await run_inference(work)
+
+    asyncio.run(outer())
+
+    spans = {finished.name: finished for finished in exporter.get_finished_spans()}
+    assert set(spans) == {"outer", "inner", "thread"}
+    assert len({finished.trace_id for finished in spans.values()}) == 1
+    assert spans["thread"].parent_id == spans["inner"].span_id
+    assert spans["inner"].parent_id == spans["outer"].span_id
+    assert spans["inner"].attributes == {"k": 5}
+
+
+def test_remote_traceparent_becomes_parent():
+    local = Tracer("memory")
+    header = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+    with local.remote_context({"traceparent": header}):
+        with local.start_span("request") as request_span:
+            assert parse_traceparent(local.current_traceparent())[0] == "0af7651916cd43dd8448eb211c80319c"
+
+    assert request_span.trace_id == "0af7651916cd43dd8448eb211c80319c"
+    assert request_span.parent_id == "b7ad6b7169203331"
+
+
+def test_exception_is_recorded_on_span():
+    local = Tracer("memory")
+
+    with pytest.raises(ValueError):
+        with local.start_span("failing"):
+            raise ValueError("boom")
+
+    assert local.exporter.get_finished_spans()[0].status == "error"
+
+
+def test_invalid_traceparent_is_ignored():
+    assert parse_traceparent("garbage") is None
+    assert parse_traceparent("00-xyz-b7ad6b7169203331-01") is None
+
+
+def test_middleware_joins_client_trace_and_returns_traceparent(exporter):
+    async def app(scope, receive, send):
+        with span("handler"):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "method": "GET", "path": "/rag/query",
+        "headers": [(b"traceparent", b"00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01")],
+    }
+    asyncio.run(TraceContextMiddleware(app)(scope, None, send))
+
+    spans = {finished.name: finished for finished in exporter.get_finished_spans()}
+    request_span = spans["HTTP GET /rag/query"]
+    assert request_span.trace_id == "0af7651916cd43dd8448eb211c80319c"
+    assert request_span.parent_id == "b7ad6b7169203331"
+    assert spans["handler"].parent_id == request_span.span_id
+    assert request_span.attributes["http.status_code"] == 200
+    assert dict(sent[0]["headers"])[b"traceparent"] == request_span.traceparent.encode()
+    # Trace gần nhất trên /system/traces có span request là gốc
+    assert exporter.recent_traces(1)[0]["root"] == "HTTP GET /rag/query"
@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pytest
+
+from services.rag.vector_store import VectorStore, VectorStoreWriter
+
+DIM = 4
+
+
+def _vectors(ids):
+    return np.asarray([[chunk_id, chunk_id + 0.5, -chunk_id, 1.0] for chunk_id in ids], dtype='float32')
+
+
+def _store(ids):
+    store = VectorStore(DIM)
+    store.add(list(ids), _vectors(ids))
+    return store
+
+
+def _segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("seg-"))
+
+
+def test_round_trip_with_overlay(tmp_path):
+    loaded = _store([1, 2, 3]).save(str(tmp_path / "v1"))
+
+    assert len(loaded) == 3
+    vectors, found = loaded.get_many([3, 1, 99])
+    np.testing.assert_array_equal(found, [True, True, False])
+    np.testing.assert_array_equal(vectors[:2], _vectors([3, 1]))
+
+    loaded.remove([2])
+    loaded.add([5], _vectors([5]))
+    loaded.save(str(tmp_path / "v2"))
+
+    reloaded = VectorStore.load(str(tmp_path / "v2"))
+    assert reloaded.dim == DIM and len(reloaded) == 3
+    vectors, found = reloaded.get_many([1, 2, 5])
+    np.testing.assert_array_equal(found, [True, False, True])
+    np.testing.assert_array_equal(vectors[[0, 2]], _vectors([1, 5]))
+
+
+def test_copy_does_not_share_overlay(tmp_path):
+    store = _store([1, 2]).save(str(tmp_path / "store"))
+    store.add([3], _vectors([3]))
+
+    copy = store.copy()
+    copy.remove([1, 3])
+
+    assert store.get_many([1, 3])[1].all()
+    assert not copy.get_many([1, 3])[1].any()
+
+
+def test_incremental_save_only_writes_the_delta(tmp_path):
+    directory = str(tmp_path / "store")
+    store = _store(range(1, 1001)).save(directory)
+    first_segment = _segment_files(directory)
+    inodes = {name: os.stat(os.path.join(directory, name)).st_ino for name in first_segment}
+
+    store.remove([5, 6])
+    store.add([2000], _vectors([2000]))
+    store = store.save(directory)
+
+    files = _segment_files(directory)
+    assert all(os.stat(os.path.join(directory, name)).st_ino == inodes[name] for name in first_segment)
+    assert len(files) == 2 * len(first_segment)
+    assert os.path.getsize(os.path.join(directory, "seg-000002.vectors.f32")) == DIM * 4
+    assert len(store) == 999
+    vectors, found = store.get_many([4, 5, 2000])
+    np.testing.assert_array_equal(found, [True, False, True])
+    np.testing.assert_array_equal(vectors[[0, 2]], _vectors([4, 2000]))
+
+    # Generation mới dùng chung file segment qua hard link
+    copied = store.save(str(tmp_path / "g2"))
+    for name in files:
+        assert os.path.samefile(os.path.join(directory, name), tmp_path / "g2" / name)
+    assert len(copied) == 999
+
+
+def test_compaction_after_many_deletes_preserves_vectors(tmp_path):
+    directory = str(tmp_path / "store")
+    store = _store(range(1, 101)).save(directory)
+    store.add(list(range(101, 121)), _vectors(range(101, 121)))
+    store = store.save(directory)
+
+    store.remove(range(1, 51))
+    store = store.save(directory)
+
+    assert not [name for name in os.listdir(directory) if name.startswith("deleted-")]
+    assert len({name.split(".")[0] for name in _segment_files(directory)}) == 1
+    np.testing.assert_array_equal(store.ids(), np.arange(51, 121))
+    vectors, found = store.get_many(range(51, 121))
+    assert found.all()
+    np.testing.assert_array_equal(vectors, _vectors(range(51, 121)))
+
+
+def test_writer_matches_loaded_store(tmp_path):
+    writer = VectorStoreWriter(str(tmp_path / "written"), DIM)
+    writer.append(np.array([1, 4]), _vectors([1, 4]))
+    writer.append(np.array([9]), _vectors([9]))
+    with pytest.raises(ValueError):
+        writer.append(np.array([5]), _vectors([5]))
+    written = writer.close()
+
+    assert VectorStore.exists(str(tmp_path / "written"))
+    vectors, found = written.get_many([9, 4, 1])
+    assert found.all()
+    np.testing.assert_array_equal(vectors, _vectors([9, 4, 1]))
+    assert len(VectorStoreWriter(str(tmp_path / "empty"), DIM).close()) == 0
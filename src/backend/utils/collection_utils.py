@@ -0,0 +1,47 @@
+import os
+import re
+from typing import Dict
+
+from config.app_config import AppConfig
+
+config = AppConfig()
+
+# Collection mặc định chứa dữ liệu có từ trước khi có collection (upload/, index gốc)
+DEFAULT_COLLECTION = "default"
+
+_COLLECTION_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+def validate_collection_id(collection_id: str) -> str:
+    """Kiểm tra collection id (chữ, số, '_' và '-', tối đa 64 ký tự) vì nó được dùng làm tên thư mục."""
+    if not isinstance(collection_id, str) or not _COLLECTION_ID_PATTERN.match(collection_id):
+        raise ValueError(
+            f"Invalid collection id '{collection_id}': use letters, digits, '_' or '-' (max 64 characters)"
+        )
+    return collection_id
+
+
+def collection_root(collection_id: str) -> str:
+    """Thư mục dữ liệu riêng của một collection (không dùng cho collection mặc định)."""
+    return os.path.join(config.COLLECTIONS_DIR, validate_collection_id(collection_id))
+
+
+def collection_upload_dir(collection_id: str) -> str:
+    """Thư mục upload của collection; collection mặc định dùng UPLOAD_DIR như trước."""
+    if collection_id == DEFAULT_COLLECTION:
+        return config.UPLOAD_DIR
+    return os.path.join(collection_root(collection_id), "upload")
+
+
+def collection_index_paths(collection_id: str) -> Dict[str, str]:
+    """Thư mục generation và file manifest của index thuộc collection."""
+    if collection_id == DEFAULT_COLLECTION:
+        return {
+            "generations_dir": config.INDEX_GENERATIONS_DIR,
+            "manifest_path": config.INDEX_MANIFEST_PATH,
+        }
+    root = collection_root(collection_id)
+    return {
+        "generations_dir": os.path.join(root, "index_generations"),
+        "manifest_path": os.path.join(root, "index_manifest.json"),
+    }
@@ -1,15 +1,186 @@
 import os
+import json
+import time
+import shutil
 import faiss
 import numpy as np
-from typing import Any, Optional, Tuple
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 import logging
 
 from config.app_config import AppConfig
+from services.rag.chunk_store import ChunkStore
+from services.rag.vector_store import VectorStore
+from utils.index_manifest import (
+    GenerationConflictError, allocate_generation, collect_old_generations, generation_paths, publish_manifest,
+    read_manifest, shard_index_path, verify_checksum, verify_manifest_files
+)
+from utils.collection_utils import DEFAULT_COLLECTION
+from utils.sharded_index import ShardedIndex, index_shards, merge_results
 
 config = AppConfig()
 
 logger = logging.getLogger(__name__)
 
+# Selector chỉ nhận id >= 0: vector đã xóa mềm có id_map = -1 sẽ bị bỏ qua khi search
+_LIVE_IDS_SELECTOR = faiss.IDSelectorRange(0, np.iinfo('int64').max)
+
+# Chế độ lưu vector trong index: float32 đầy đủ hoặc mã nén kèm re-rank bằng vector chính xác
+COMPRESSION_NONE = "none"
+COMPRESSION_FP16 = "fp16"
+COMPRESSION_SQ8 = "sq8"
+COMPRESSION_PQ = "pq"
+COMPRESSION_MODES = (COMPRESSION_NONE, COMPRESSION_FP16, COMPRESSION_SQ8, COMPRESSION_PQ)
+
+# Số điểm train tối thiểu để codebook PQ 8 bit (256 centroid) có ý nghĩa
+_PQ_MIN_TRAINING_POINTS = 256 * 4
+
+def get_index_tier(num_vectors: int) -> str:
+    """Xác định loại index mà create_optimized_index sẽ chọn cho số lượng vectors."""
+    if num_vectors < 1000:
+        return "flat"
+    if num_vectors < 10000:
+        return "hnsw"
+    if num_vectors < 50000:
+        return "hnsw_pq"
+    return "ivf_pq"
+
+def is_id_mapped(index: Any) -> bool:
+    """Kiểm tra index có được bọc trong IndexIDMap (khóa theo chunks.id) hay không."""
+    if isinstance(index, ShardedIndex):
+        return all(is_id_mapped(shard) for shard in index.shards)
+    return index is not None and hasattr(index, 'id_map')
+
+def wrap_with_id_map(index: Any) -> Any:
+    """Bọc index trong IndexIDMap2 để thêm/xóa vector theo chunk id."""
+    if is_id_mapped(index):
+        return index
+    return faiss.IndexIDMap2(index)
+
+def unwrap_index(index: Any) -> Any:
+    """Lấy index bên trong IndexIDMap (nếu có) để truy cập tham số HNSW/IVF."""
+    if is_id_mapped(index):
+        return faiss.downcast_index(index.index)
+    return index
+
+def get_index_ids(index: Any) -> np.ndarray:
+    """Lấy danh sách chunk id đang có trong index (bỏ qua vector đã xóa mềm)."""
+    if isinstance(index, ShardedIndex):
+        return np.concatenate([get_index_ids(shard) for shard in index.shards])
+    if not is_id_mapped(index):
+        return np.arange(index.ntotal, dtype='int64')
+    ids = faiss.vector_to_array(index.id_map).astype('int64')
+    return ids[ids >= 0]
+
+def count_deleted_vectors(index: Any) -> int:
+    """Đếm số vector đã xóa mềm (id_map = -1) còn nằm trong index."""
+    if isinstance(index, ShardedIndex):
+        return sum(count_deleted_vectors(shard) for shard in index.shards)
+    if not is_id_mapped(index) or index.ntotal == 0:
+        return 0
+    return int(np.count_nonzero(faiss.vector_to_array(index.id_map) < 0))
+
+def exclude_deleted(index: Any, params: Optional[Any] = None) -> Any:
+    """Gắn selector bỏ qua vector đã xóa mềm vào tham số search của index.
+
+    Khi chưa có params, tạo đúng loại SearchParameters của index với
+    efSearch/nprobe hiện tại. Nếu params đã có selector riêng (danh sách id
+    được phép) thì giữ nguyên, vì danh sách đó chỉ chứa id còn sống.
+    Với ShardedIndex trả về danh sách tham số theo từng shard.
+    """
+    if isinstance(index, ShardedIndex):
+        shard_params = params if isinstance(params, list) else [params] * index.num_shards
+        return [exclude_deleted(shard, p) for shard, p in zip(index.shards, shard_params)]
+    if params is None:
+        inner = unwrap_index(index)
+        ivf = faiss.try_extract_index_ivf(inner)
+        if ivf is not None:
+            params = faiss.SearchParametersIVF()
+            params.nprobe = ivf.nprobe
+        elif hasattr(inner, 'hnsw'):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = inner.hnsw.efSearch
+        else:
+            params = faiss.SearchParameters()
+    if params.sel is None:
+        params.sel = _LIVE_IDS_SELECTOR
+    return params
+
+def compact_index(index: Any, vector_store: Optional[VectorStore] = None) -> Any:
+    """Dựng lại index chỉ với các vector còn sống, loại bỏ hẳn vector đã xóa mềm.
+
+    Vector lấy từ vector_store (vector chính xác) khi có, nếu không thì reconstruct
+    từ index nên không cần encode lại văn bản. Với index nén, reconstruct chỉ cho
+    bản giải mã xấp xỉ và mã hóa lại bản đó làm sai số cộng dồn sau mỗi lần compact.
+    """
+    current_ids = faiss.vector_to_array(index.id_map).astype('int64')
+    keep_mask = current_ids >= 0
+    live_ids = current_ids[keep_mask]
+    inner = unwrap_index(index)
+    
+    vectors = None
+    if vector_store is not None:
+        exact_vectors, found = vector_store.get_many(live_ids)
+        if found.all():
+            vectors = exact_vectors
+        else:
+            logger.warning(f"{int((~found).sum())} live vectors missing from exact vector store, reconstructing")
+    if vectors is None:
+        ivf = faiss.try_extract_index_ivf(inner)
+        if ivf is not None:
+            ivf.make_direct_map()
+        vectors = inner.reconstruct_n(0, inner.ntotal) if inner.ntotal > 0 else np.empty((0, index.d), dtype='float32')
+        vectors = vectors[keep_mask]
+    
+    new_inner = _heap_copy(inner)
+    new_inner.reset()
+    new_index = faiss.IndexIDMap2(new_inner)
+    if live_ids.size:
+        new_index.add_with_ids(vectors, live_ids)
+    
+    logger.info(f"Compacted index: dropped {int((~keep_mask).sum())} deleted vectors, kept {new_index.ntotal}")
+    return new_index
+
+def remove_ids_from_index(index: Any, ids: Iterable[int], vector_store: Optional[VectorStore] = None) -> Any:
+    """Xóa các chunk id khỏi index, trả về index sau khi xóa.
+
+    Chỉ IndexFlat xóa trực tiếp được: IndexIDMap dồn id_map sau khi xóa, khớp
+    với cách IndexFlat dồn vector, còn HNSW không hỗ trợ remove_ids và IVF giữ
+    nguyên nhãn vị trí khiến id_map bị lệch. Với các loại đó vector bị xóa mềm:
+    id trong id_map được đặt thành -1 và search bỏ qua chúng qua exclude_deleted.
+    Index chỉ được dựng lại khi tỷ lệ vector đã xóa vượt RAG_INDEX_COMPACT_FRACTION.
+    Với ShardedIndex, việc xóa (và compact) chỉ diễn ra trên shard chứa id cần xóa.
+    vector_store (nếu có) cung cấp vector chính xác khi compact index nén.
+    """
+    ids_array = np.asarray(list(ids), dtype='int64')
+    if ids_array.size == 0:
+        return index
+    
+    if isinstance(index, ShardedIndex):
+        for shard_id, shard in enumerate(index.shards):
+            shard_ids = np.intersect1d(ids_array, index.shard_ids(shard_id))
+            if shard_ids.size:
+                index.set_shard(shard_id, remove_ids_from_index(shard, shard_ids, vector_store))
+        return index
+    
+    if not is_id_mapped(index) or isinstance(unwrap_index(index), faiss.IndexFlat):
+        removed = index.remove_ids(ids_array)
+        logger.info(f"Removed {removed} vectors from index")
+        return index
+    
+    current_ids = faiss.vector_to_array(index.id_map).astype('int64')
+    delete_mask = np.isin(current_ids, ids_array)
+    if delete_mask.any():
+        current_ids[delete_mask] = -1
+        faiss.copy_array_to_vector(current_ids, index.id_map)
+        index.construct_rev_map()
+    
+    deleted = int(np.count_nonzero(current_ids < 0))
+    logger.info(f"Marked {int(delete_mask.sum())} vectors as deleted ({deleted}/{index.ntotal} in index)")
+    if deleted > index.ntotal * config.RAG_INDEX_COMPACT_FRACTION:
+        return compact_index(index, vector_store)
+    return index
+
 def create_new_index(vector_size: int, num_vectors: int = 0, use_gpu: bool = False) -> Any:
     """Tạo FAISS index mới với thuật toán tối ưu dựa trên số lượng vectors."""
     
@@ -35,10 +206,72 @@ def create_new_index(vector_size: int, num_vectors: int = 0, use_gpu: bool = Fal
         except Exception as e:
             logger.warning(f"Failed to move index to GPU: {e}")
     
-    return index
+    return wrap_with_id_map(index)
+
+def pq_subquantizers(vector_size: int) -> int:
+    """Số sub-quantizer PQ: khoảng 8 chiều mỗi byte mã, phải chia hết số chiều."""
+    m = max(1, vector_size // 8)
+    while vector_size % m:
+        m -= 1
+    return m
+
+def create_codec_index(vector_size: int, compression: str, hnsw: bool = False) -> Any:
+    """Index lưu mã nén theo compression (chưa train), dạng phẳng hoặc HNSW."""
+    if compression in (COMPRESSION_SQ8, COMPRESSION_FP16):
+        qtype = faiss.ScalarQuantizer.QT_8bit if compression == COMPRESSION_SQ8 else faiss.ScalarQuantizer.QT_fp16
+        if hnsw:
+            return faiss.IndexHNSWSQ(vector_size, qtype, 32)
+        return faiss.IndexScalarQuantizer(vector_size, qtype, faiss.METRIC_L2)
+    if compression == COMPRESSION_PQ:
+        m = pq_subquantizers(vector_size)
+        if hnsw:
+            return faiss.IndexHNSWPQ(vector_size, m, 32)
+        return faiss.IndexPQ(vector_size, m, 8)
+    if hnsw:
+        return faiss.IndexHNSWFlat(vector_size, 32)
+    return faiss.IndexFlatL2(vector_size)
+
+def create_compressed_index(
+    vector_size: int,
+    num_vectors: int,
+    compression: str,
+    training_vectors: Optional[np.ndarray] = None
+) -> Any:
+    """Index lưu mã SQ8/fp16/PQ thay cho float32 cho các tier flat/hnsw.
 
-def create_optimized_index(vector_size: int, num_vectors: int, training_vectors: Optional[np.ndarray] = None) -> Any:
-    """Tạo index được tối ưu hóa với training data."""
+    Khi không đủ dữ liệu train, PQ lùi về SQ8 rồi fp16 (fp16 không cần train).
+    """
+    num_training = 0 if training_vectors is None else len(training_vectors)
+    codec = compression
+    if codec == COMPRESSION_PQ and num_training < _PQ_MIN_TRAINING_POINTS:
+        codec = COMPRESSION_SQ8
+    if codec == COMPRESSION_SQ8 and num_training == 0:
+        codec = COMPRESSION_FP16
+    if codec != compression:
+        logger.info(f"Only {num_training} training vectors for {compression}, using {codec} codes")
+    
+    hnsw = num_vectors >= 1000
+    index = create_codec_index(vector_size, codec, hnsw)
+    if hnsw:
+        index.hnsw.efConstruction = 200
+        index.hnsw.efSearch = 50
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(training_vectors, dtype='float32'))
+    logger.info(f"Created {type(index).__name__} ({codec}) for {num_vectors} vectors")
+    return wrap_with_id_map(index)
+
+def create_optimized_index(
+    vector_size: int,
+    num_vectors: int,
+    training_vectors: Optional[np.ndarray] = None,
+    compression: str = COMPRESSION_NONE
+) -> Any:
+    """Tạo index được tối ưu hóa với training data.
+
+    Với compression khác none, tier flat/hnsw dùng mã nén; các tier lớn hơn vốn đã dùng PQ.
+    """
+    if compression != COMPRESSION_NONE and num_vectors < 10000:
+        return create_compressed_index(vector_size, num_vectors, compression, training_vectors)
     
     if num_vectors < 1000:
         return create_new_index(vector_size, num_vectors)
@@ -85,49 +318,260 @@ def create_optimized_index(vector_size: int, num_vectors: int, training_vectors:
             logger.info("Index training completed")
         except Exception as e:
             logger.error(f"Training failed: {e}")
-            return faiss.IndexFlatL2(vector_size)
+            return wrap_with_id_map(faiss.IndexFlatL2(vector_size))
     
-    return index
+    return wrap_with_id_map(index)
 
-def save_index_to_disk(index: Any, chunk_id_mapping: list) -> None:
-    """Lưu FAISS index và chunk mapping ra file với compression."""
+def training_sample_size(num_vectors: int) -> int:
+    """Số vector dùng để train quantizer: đủ 39 điểm cho mỗi centroid IVF và mỗi mã PQ 8 bit."""
+    nlist = min(int(np.sqrt(num_vectors)), 4096)
+    return min(num_vectors, max(min(num_vectors // 10, 10000), 39 * max(nlist, 256)))
+
+@contextmanager
+def faiss_threads(num_threads: int) -> Iterator[None]:
+    """Tạm đặt số thread OpenMP của FAISS (k-means khi train, add); 0 giữ mặc định."""
+    if num_threads <= 0:
+        yield
+        return
+    previous = faiss.omp_get_max_threads()
+    faiss.omp_set_num_threads(num_threads)
     try:
-        os.makedirs(os.path.dirname(config.FAISS_INDEX_PATH) or '.', exist_ok=True)
-        
-        faiss.write_index(index, config.FAISS_INDEX_PATH)
+        yield
+    finally:
+        faiss.omp_set_num_threads(previous)
+
+def _mmap_io_flags() -> int:
+    """Cờ đọc index qua mmap: zero-copy (MMAP_IFC) nếu bản FAISS hỗ trợ, chỉ đọc."""
+    mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+    return mmap_flag | faiss.IO_FLAG_READ_ONLY
+
+def write_index_file(index: Any, path: str) -> None:
+    """Ghi index ra file tạm rồi os.replace.
+
+    File index là bất biến sau khi ghi: các worker đang mmap bản cũ vẫn giữ inode
+    cũ, không bao giờ thấy file bị ghi đè dở dang.
+    """
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+def read_index_file(path: str, mmap: Optional[bool] = None) -> Tuple[Any, bool]:
+    """Đọc index, ưu tiên mmap để các worker dùng chung một bản trong page cache.
+
+    Trả về (index, mmapped). Loại index không hỗ trợ mmap được đọc bình thường vào heap.
+    """
+    mmap = config.FAISS_MMAP_ENABLED if mmap is None else mmap
+    if mmap:
+        try:
+            index = faiss.read_index(path, _mmap_io_flags())
+            logger.info(f"Memory-mapped FAISS index from {path}")
+            return index, True
+        except RuntimeError as e:
+            logger.warning(f"Could not memory-map index ({e}), reading it into memory")
+    return faiss.read_index(path), False
+
+def _heap_copy(index: Any) -> Any:
+    """Bản sao nằm hoàn toàn trên heap của một index FAISS.
+
+    faiss.clone_index giữ nguyên vùng nhớ mmap chỉ đọc của index load bằng
+    IO_FLAG_MMAP_IFC, nên add/remove trên bản clone làm process abort. Serialize
+    rồi deserialize luôn sao chép dữ liệu ra bộ nhớ riêng. Index GPU không
+    serialize được (và không bao giờ được mmap) nên dùng clone_index.
+    """
+    try:
+        return faiss.deserialize_index(faiss.serialize_index(index))
+    except RuntimeError:
+        return faiss.clone_index(index)
+
+def clone_index(index: Any) -> Any:
+    """Bản sao độc lập, ghi được của index (từng shard với ShardedIndex) để sửa mà không ảnh hưởng bản đang dùng."""
+    if isinstance(index, ShardedIndex):
+        return ShardedIndex([_heap_copy(shard) for shard in index.shards], index.shard_by, index.search_threads)
+    return _heap_copy(index)
+
+def write_generation_index(index: Any, directory: str) -> None:
+    """Ghi index vào thư mục generation: một file index.bin hoặc mỗi shard một file."""
+    if isinstance(index, ShardedIndex):
+        os.makedirs(generation_paths(directory)["shards"], exist_ok=True)
+        for shard_id, shard in enumerate(index.shards):
+            write_index_file(shard, shard_index_path(directory, shard_id))
+    else:
+        write_index_file(index, generation_paths(directory)["index"])
+
+def read_generation_index(manifest: Dict[str, Any]) -> Tuple[Any, bool]:
+    """Đọc index của generation trong manifest, trả về (index, mmapped)."""
+    directory = manifest["directory"]
+    num_shards = int(manifest.get("num_shards", 1))
+    if num_shards <= 1:
+        return read_index_file(generation_paths(directory)["index"])
+    shards = [read_index_file(shard_index_path(directory, shard_id)) for shard_id in range(num_shards)]
+    index = ShardedIndex([shard for shard, _ in shards], manifest["shard_by"], config.RAG_SHARD_SEARCH_THREADS)
+    return index, all(mmapped for _, mmapped in shards)
+
+def save_index_to_disk(
+    index: Any,
+    chunk_store: ChunkStore,
+    metadata: Optional[Dict[str, Any]] = None,
+    base_generation: Optional[int] = None,
+    rollback_generation: Optional[int] = None,
+    collection_id: str = DEFAULT_COLLECTION,
+    vector_store: Optional[VectorStore] = None
+) -> Tuple[Dict[str, Any], ChunkStore]:
+    """Lưu FAISS index, chunk store, vector chính xác (nếu có) và metadata thành một generation mới rồi publish manifest.
+
+    Mỗi generation nằm trong thư mục riêng và không bao giờ bị ghi lại, manifest
+    được ghi sau cùng để các worker khác chỉ thấy generation đã ghi xong.
+    base_generation là generation mà snapshot được dựng từ đó: nếu manifest đã
+    trỏ tới generation khác, generation vừa ghi bị xóa và GenerationConflictError
+    được ném ra để người gọi dựng lại trên generation mới nhất.
+    rollback_generation (generation đang phục vụ trước lần publish này) được ghim
+    trong manifest để dọn generation cũ không xóa mất bản rollback.
+
+    Trả về (manifest, ChunkStore đã lưu map từ thư mục generation); vector
+    chính xác được đọc lại bằng load_vector_store.
+    """
+    try:
+        generation, directory = allocate_generation(collection_id)
+        paths = generation_paths(directory)
         
-        np.savez_compressed(
-            config.CHUNK_MAPPING_PATH.replace('.npy', '.npz'), 
-            mapping=np.array(chunk_id_mapping, dtype=object)
-        )
+        try:
+            write_generation_index(index, directory)
+            
+            chunk_store = chunk_store.save(paths["chunk_store"])
+            if vector_store is not None:
+                vector_store.save(paths["vectors"])
+            
+            save_index_metadata(metadata or {}, directory)
+            
+            manifest = publish_manifest(
+                generation, directory, int(index.ntotal), base_generation,
+                num_shards=index.num_shards if isinstance(index, ShardedIndex) else 1,
+                shard_by=index.shard_by if isinstance(index, ShardedIndex) else None,
+                collection_id=collection_id,
+                rollback_generation=rollback_generation
+            )
+        except GenerationConflictError:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        except OSError:
+            current = read_manifest(collection_id)
+            current_generation = current["generation"] if current else None
+            if current_generation == base_generation:
+                raise
+            # Writer khác đã publish generation mới hơn và dọn generation đang ghi dở này:
+            # bản build này đằng nào cũng thua compare-and-swap
+            shutil.rmtree(directory, ignore_errors=True)
+            raise GenerationConflictError(generation, base_generation, current_generation)
+        logger.info(f"Saved index generation {generation} with {index.ntotal} vectors and {len(chunk_store)} mappings")
         
-        logger.info(f"Saved index with {index.ntotal} vectors and {len(chunk_id_mapping)} mappings")
+        collect_old_generations(config.INDEX_KEEP_GENERATIONS, collection_id)
+        return manifest, chunk_store
         
+    except GenerationConflictError:
+        raise
     except Exception as e:
         logger.error(f"Error saving index to disk: {e}")
         raise
 
-def load_index_and_mapping() -> Tuple[Any, list]:
-    """Load FAISS index và chunk mapping từ file."""
+def save_index_metadata(metadata: Dict[str, Any], directory: Optional[str] = None) -> None:
+    """Ghi metadata của index (loại index, backend, tham số search đã tinh chỉnh...).
+
+    directory là thư mục generation; None là file metadata dạng cũ.
+    """
+    path = generation_paths(directory)["metadata"] if directory else config.INDEX_METADATA_PATH
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def load_index_generation(manifest: Dict[str, Any]) -> Tuple[Any, ChunkStore, Dict[str, Any], bool]:
+    """Load generation mà manifest trỏ tới, trả về (index, chunk_store, metadata, index_mmapped).
+
+    Mặc định chỉ đối chiếu với manifest (file tồn tại, số vector khớp) để thời gian
+    load không phụ thuộc kích thước index; checksum đầy đủ chỉ chạy khi bật
+    INDEX_VERIFY_CHECKSUM.
+    """
+    paths = generation_paths(manifest["directory"])
+    if not verify_manifest_files(manifest):
+        raise ValueError(f"Index files of generation {manifest['generation']} are missing")
+    if config.INDEX_VERIFY_CHECKSUM and not verify_checksum(manifest):
+        raise ValueError(f"Checksum mismatch for index generation {manifest['generation']}")
+    
+    index, mmapped = read_generation_index(manifest)
+    if "num_vectors" in manifest and int(index.ntotal) != int(manifest["num_vectors"]):
+        raise ValueError(
+            f"Index generation {manifest['generation']} has {index.ntotal} vectors, "
+            f"manifest expects {manifest['num_vectors']}"
+        )
+    chunk_store = ChunkStore.load(paths["chunk_store"])
+    metadata = load_index_metadata(manifest["directory"])
+    logger.info(
+        f"Loaded index generation {manifest['generation']} with {index.ntotal} vectors "
+        f"and {len(chunk_store)} mappings"
+    )
+    return index, chunk_store, metadata, mmapped
+
+def load_vector_store(directory: str) -> Optional[VectorStore]:
+    """Map vector chính xác của generation nếu generation có lưu (chế độ nén)."""
+    path = generation_paths(directory)["vectors"]
+    return VectorStore.load(path) if VectorStore.exists(path) else None
+
+def mapping_exists() -> bool:
+    """Kiểm tra chunk mapping dạng cũ (ngoài thư mục generation) đã tồn tại trên đĩa chưa."""
+    return (
+        ChunkStore.exists(config.CHUNK_STORE_DIR)
+        or os.path.exists(config.CHUNK_MAPPING_PATH)
+        or os.path.exists(config.CHUNK_MAPPING_PATH.replace('.npy', '.npz'))
+    )
+
+def load_index_and_mapping() -> Tuple[Any, ChunkStore, bool]:
+    """Load FAISS index và chunk store dạng cũ, trả về (index, chunk_store, index_mmapped).
+
+    Index và chunk store được memory-map nên thời gian khởi động không phụ thuộc
+    kích thước corpus. Mapping pickle cũ (.npz) được chuyển đổi một lần sang dạng cột.
+    """
     try:
-        index = faiss.read_index(config.FAISS_INDEX_PATH)
+        index, mmapped = read_index_file(config.FAISS_INDEX_PATH)
         
-        npz_path = config.CHUNK_MAPPING_PATH.replace('.npy', '.npz')
-        if os.path.exists(npz_path):
-            data = np.load(npz_path, allow_pickle=True)
-            chunk_id_mapping = data['mapping'].tolist()
+        if ChunkStore.exists(config.CHUNK_STORE_DIR):
+            chunk_store = ChunkStore.load(config.CHUNK_STORE_DIR)
         else:
-            chunk_id_mapping = np.load(config.CHUNK_MAPPING_PATH, allow_pickle=True).tolist()
+            npz_path = config.CHUNK_MAPPING_PATH.replace('.npy', '.npz')
+            if os.path.exists(npz_path):
+                data = np.load(npz_path, allow_pickle=True)
+                mapping_entries = data['mapping'].tolist()
+            else:
+                mapping_entries = np.load(config.CHUNK_MAPPING_PATH, allow_pickle=True).tolist()
+            
+            logger.info("Converting legacy pickled chunk mapping to columnar chunk store")
+            chunk_store = ChunkStore.from_legacy_entries(mapping_entries).save(config.CHUNK_STORE_DIR)
         
-        logger.info(f"Loaded index with {index.ntotal} vectors and {len(chunk_id_mapping)} mappings")
-        return index, chunk_id_mapping
+        logger.info(f"Loaded index with {index.ntotal} vectors and {len(chunk_store)} mappings")
+        return index, chunk_store, mmapped
         
     except Exception as e:
         logger.error(f"Error loading index from disk: {e}")
         raise
 
+def load_index_metadata(directory: Optional[str] = None) -> Dict[str, Any]:
+    """Đọc metadata của index (loại index, số vectors...) nếu tồn tại."""
+    path = generation_paths(directory)["metadata"] if directory else config.INDEX_METADATA_PATH
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read index metadata: {e}")
+        return {}
+
 def optimize_search_params(index: Any, num_queries: int = 100) -> None:
-    """Tối ưu hóa tham số search cho index."""
+    """Tối ưu hóa tham số search cho index (từng shard với ShardedIndex)."""
+    if isinstance(index, ShardedIndex):
+        for shard in index.shards:
+            optimize_search_params(shard, num_queries)
+        return
+    index = unwrap_index(index)
     try:
         if hasattr(index, 'hnsw'):
             if num_queries < 10:
@@ -147,10 +591,228 @@ def optimize_search_params(index: Any, num_queries: int = 100) -> None:
     except Exception as e:
         logger.warning(f"Failed to optimize search params: {e}")
 
+def get_search_param_name(index: Any) -> Optional[str]:
+    """Tên tham số search có thể tinh chỉnh của index (efSearch, nprobe) hoặc None với index flat.
+
+    Với ShardedIndex chỉ có tên khi mọi shard tinh chỉnh được đều dùng chung một tham số.
+    """
+    if isinstance(index, ShardedIndex):
+        names = {get_search_param_name(shard) for shard in index.shards} - {None}
+        return names.pop() if len(names) == 1 else None
+    inner = unwrap_index(index)
+    if hasattr(inner, 'hnsw'):
+        return "efSearch"
+    if hasattr(inner, 'nprobe'):
+        return "nprobe"
+    return None
+
+def make_search_parameters(index: Any, value: Optional[int] = None, sel: Optional[Any] = None) -> Optional[Any]:
+    """Tạo SearchParameters cho một lần search mà không sửa index đang dùng.
+
+    value là efSearch/nprobe (mặc định lấy giá trị hiện tại của index), sel là IDSelector lọc chunk id.
+    Với ShardedIndex trả về danh sách tham số theo từng shard.
+    """
+    if isinstance(index, ShardedIndex):
+        name = get_search_param_name(index)
+        return [
+            make_search_parameters(shard, value if get_search_param_name(shard) == name else None, sel)
+            for shard in index.shards
+        ]
+    name = get_search_param_name(index)
+    inner = unwrap_index(index)
+    if name == "efSearch":
+        value = value if value is not None else inner.hnsw.efSearch
+        return faiss.SearchParametersHNSW(efSearch=int(value), sel=sel)
+    if name == "nprobe":
+        value = value if value is not None else inner.nprobe
+        return faiss.SearchParametersIVF(nprobe=int(value), sel=sel)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+def search_subset(
+    index: Any,
+    query_embeddings: np.ndarray,
+    k: int,
+    ids: np.ndarray,
+    exact_threshold: int = 2048
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Tìm kiếm chỉ trong một tập chunk id, lọc ngay trong FAISS thay vì lọc sau khi search.
+
+    Tập nhỏ được quét chính xác trên các vector reconstruct (chi phí tỉ lệ với kích
+    thước tập); tập lớn dùng IDSelectorBatch trong SearchParameters của index.
+    """
+    ids = np.ascontiguousarray(ids, dtype='int64')
+    num_queries = query_embeddings.shape[0]
+    if ids.size == 0:
+        return (np.full((num_queries, k), np.inf, dtype='float32'), np.full((num_queries, k), -1, dtype='int64'))
+    
+    if isinstance(index, ShardedIndex):
+        def search_shard(shard_id: int, shard: Any) -> Tuple[np.ndarray, np.ndarray]:
+            shard_subset = np.intersect1d(ids, index.shard_ids(shard_id), assume_unique=True)
+            return search_subset(shard, query_embeddings, k, shard_subset, exact_threshold)
+        return merge_results(index.map_shards(search_shard), k)
+    
+    search_k = min(k, int(ids.size))
+    if ids.size <= exact_threshold:
+        try:
+            vectors = index.reconstruct_batch(ids)
+            distances, positions = faiss.knn(
+                np.ascontiguousarray(query_embeddings, dtype='float32'), vectors, search_k, metric=index.metric_type
+            )
+            return distances, ids[positions]
+        except RuntimeError as e:
+            logger.debug(f"Index cannot reconstruct vectors ({e}), using id selector search")
+    
+    params = make_search_parameters(index, sel=faiss.IDSelectorBatch(ids))
+    return index.search(query_embeddings, search_k, params=params)
+
+def rerank_exact(
+    query_embeddings: np.ndarray,
+    candidate_ids: np.ndarray,
+    vector_store: VectorStore,
+    k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Tính lại khoảng cách L2 chính xác của các ứng viên bằng vector gốc rồi lấy top-k."""
+    num_queries = candidate_ids.shape[0]
+    distances = np.full((num_queries, k), np.inf, dtype='float32')
+    ids = np.full((num_queries, k), -1, dtype='int64')
+    
+    unique_ids = np.unique(candidate_ids[candidate_ids >= 0])
+    vectors, found = vector_store.get_many(unique_ids)
+    for row in range(num_queries):
+        row_ids = candidate_ids[row][candidate_ids[row] >= 0]
+        positions = np.searchsorted(unique_ids, row_ids)
+        row_ids, positions = row_ids[found[positions]], positions[found[positions]]
+        if row_ids.size == 0:
+            continue
+        diff = vectors[positions] - query_embeddings[row]
+        row_distances = np.einsum('ij,ij->i', diff, diff)
+        top = np.argsort(row_distances, kind='stable')[:k]
+        distances[row, :top.size] = row_distances[top]
+        ids[row, :top.size] = row_ids[top]
+    return distances, ids
+
+def reconstruct_vectors(index: Any, ids: np.ndarray) -> np.ndarray:
+    """Vector (đã giải mã) của các chunk id lấy lại từ index.
+
+    RuntimeError nếu index không reconstruct được theo id (IVF không có direct map,
+    index cũ không map theo chunk id, hoặc id không có trong index).
+    """
+    shards = index_shards(index)
+    if not all(is_id_mapped(shard) for shard in shards):
+        raise RuntimeError("Index is not keyed by chunk id")
+    vectors = np.empty((len(ids), index.d), dtype='float32')
+    for row, chunk_id in enumerate(ids):
+        for shard in shards:
+            try:
+                vectors[row] = shard.reconstruct(int(chunk_id))
+                break
+            except RuntimeError:
+                continue
+        else:
+            raise RuntimeError(f"Cannot reconstruct vector of chunk {chunk_id}")
+    return vectors
+
+def evaluate_compression(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    rerank_factor: int,
+    modes: Iterable[str] = COMPRESSION_MODES
+) -> Dict[str, Any]:
+    """Đo recall@k và bộ nhớ mỗi vector của từng chế độ nén trên cùng corpus và query.
+
+    Ground truth là kNN chính xác trên corpus; recall được đo trước và sau khi
+    re-rank k * rerank_factor ứng viên bằng vector chính xác.
+    """
+    corpus = np.ascontiguousarray(corpus, dtype='float32')
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    num_vectors, dim = corpus.shape
+    k = min(k, num_vectors)
+    candidates = min(k * max(1, rerank_factor), num_vectors)
+    _, exact_ids = faiss.knn(queries, corpus, k)
+    
+    side_store = VectorStore(dim)
+    side_store.add(np.arange(num_vectors), corpus)
+    baseline_bytes = dim * 4
+    
+    def recall(found_ids: np.ndarray) -> float:
+        hits = sum(len(set(found_ids[row, :k].tolist()) & set(exact_ids[row].tolist())) for row in range(len(queries)))
+        return round(hits / float(len(queries) * k), 4)
+    
+    report: Dict[str, Any] = {}
+    for mode in modes:
+        start = time.perf_counter()
+        index = create_codec_index(dim, mode)
+        if not index.is_trained:
+            index.train(corpus)
+        index.add(corpus)
+        train_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        _, approx_ids = index.search(queries, candidates)
+        search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        reranked_ids = rerank_exact(queries, approx_ids, side_store, k)[1] if mode != COMPRESSION_NONE else approx_ids
+        
+        code_bytes = int(getattr(index, 'code_size', baseline_bytes))
+        report[mode] = {
+            "index": type(index).__name__,
+            "bytes_per_vector": code_bytes,
+            "compression_ratio": round(baseline_bytes / code_bytes, 2),
+            "index_bytes": code_bytes * num_vectors,
+            "exact_vectors_mapped_bytes": baseline_bytes * num_vectors if mode != COMPRESSION_NONE else 0,
+            "recall_at_k": recall(approx_ids),
+            "recall_at_k_reranked": recall(reranked_ids),
+            "search_ms_per_query": round(search_ms, 3),
+            "build_seconds": round(train_seconds, 3),
+        }
+    return report
+
+def estimate_index_memory(index: Any) -> int:
+    """Ước lượng số byte bộ nhớ mà index đang chiếm (codes, đồ thị HNSW, id map)."""
+    if isinstance(index, ShardedIndex):
+        return sum(estimate_index_memory(shard) for shard in index.shards)
+    inner = unwrap_index(index)
+    ntotal = int(index.ntotal)
+    
+    code_size = getattr(inner, 'code_size', None)
+    if code_size is None and getattr(inner, 'storage', None) is not None:
+        code_size = getattr(faiss.downcast_index(inner.storage), 'code_size', None)
+    if code_size is None:
+        code_size = inner.d * 4
+    
+    total = ntotal * int(code_size)
+    if hasattr(inner, 'hnsw') and inner.hnsw is not None:
+        total += (inner.hnsw.neighbors.size() + inner.hnsw.levels.size() + inner.hnsw.offsets.size() * 2) * 4
+    if is_id_mapped(index):
+        # id_map (int64) và reverse map của IndexIDMap2
+        total += ntotal * 8 * 3
+    return total
+
 def get_index_info(index: Any) -> dict:
     """Lấy thông tin về FAISS index."""
+    if isinstance(index, ShardedIndex):
+        return {
+            "type": type(index).__name__,
+            "vector_size": index.d,
+            "num_vectors": index.ntotal,
+            "num_shards": index.num_shards,
+            "shard_by": index.shard_by,
+            "is_trained": index.is_trained,
+            "shards": [
+                dict(get_index_info(shard), **shard_stats, memory_bytes=estimate_index_memory(shard))
+                for shard, shard_stats in zip(index.shards, index.describe_shards())
+            ],
+        }
+    wrapper_type = type(index).__name__
+    id_mapped = is_id_mapped(index)
+    deleted_vectors = count_deleted_vectors(index)
+    index = unwrap_index(index)
     info = {
         "type": type(index).__name__,
+        "wrapper": wrapper_type if id_mapped else None,
+        "deleted_vectors": deleted_vectors,
         "vector_size": index.d,
         "num_vectors": index.ntotal,
         "is_trained": getattr(index, 'is_trained', True)
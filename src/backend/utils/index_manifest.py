@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config.app_config import AppConfig
+from utils.collection_utils import DEFAULT_COLLECTION, collection_index_paths
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có khóa file, dựa vào kiểm tra generation
+    fcntl = None
+
+config = AppConfig()
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+GENERATION_PREFIX = "gen-"
+INDEX_FILE_NAME = "index.bin"
+CHUNK_STORE_DIR_NAME = "chunks"
+METADATA_FILE_NAME = "metadata.json"
+SHARDS_DIR_NAME = "shards"
+VECTORS_DIR_NAME = "vectors"
+
+
+class GenerationConflictError(Exception):
+    """Manifest đã trỏ sang generation khác với generation mà bản build dựa vào."""
+
+    def __init__(self, generation: int, base_generation: Optional[int], current_generation: Optional[int]) -> None:
+        super().__init__(
+            f"Index generation {generation} was built on generation {base_generation}, "
+            f"but manifest now points to generation {current_generation}"
+        )
+        self.generation = generation
+        self.base_generation = base_generation
+        self.current_generation = current_generation
+
+
+def _generations_dir(collection_id: str) -> str:
+    """Thư mục chứa các generation của collection."""
+    return collection_index_paths(collection_id)["generations_dir"]
+
+
+def _manifest_path(collection_id: str) -> str:
+    """File manifest của collection."""
+    return collection_index_paths(collection_id)["manifest_path"]
+
+
+def generation_dir(generation: int, collection_id: str = DEFAULT_COLLECTION) -> str:
+    """Thư mục chứa snapshot của một generation."""
+    return os.path.join(_generations_dir(collection_id), f"{GENERATION_PREFIX}{generation:08d}")
+
+
+def generation_paths(directory: str) -> Dict[str, str]:
+    """Đường dẫn index, chunk store và metadata trong thư mục generation."""
+    return {
+        "index": os.path.join(directory, INDEX_FILE_NAME),
+        "chunk_store": os.path.join(directory, CHUNK_STORE_DIR_NAME),
+        "metadata": os.path.join(directory, METADATA_FILE_NAME),
+        "shards": os.path.join(directory, SHARDS_DIR_NAME),
+        "vectors": os.path.join(directory, VECTORS_DIR_NAME),
+    }
+
+
+def shard_index_path(directory: str, shard_id: int) -> str:
+    """File index của một shard trong thư mục generation."""
+    return os.path.join(directory, SHARDS_DIR_NAME, f"shard-{shard_id:03d}.bin")
+
+
+def index_files(directory: str, num_shards: int = 1) -> List[str]:
+    """Các file index của generation theo thứ tự shard."""
+    if num_shards <= 1:
+        return [generation_paths(directory)["index"]]
+    return [shard_index_path(directory, shard_id) for shard_id in range(num_shards)]
+
+
+def list_generations(collection_id: str = DEFAULT_COLLECTION) -> List[int]:
+    """Các generation đang có trên đĩa, tăng dần."""
+    generations_dir = _generations_dir(collection_id)
+    if not os.path.isdir(generations_dir):
+        return []
+    generations = []
+    for name in os.listdir(generations_dir):
+        if name.startswith(GENERATION_PREFIX) and name[len(GENERATION_PREFIX):].isdigit():
+            generations.append(int(name[len(GENERATION_PREFIX):]))
+    return sorted(generations)
+
+
+def allocate_generation(collection_id: str = DEFAULT_COLLECTION) -> Tuple[int, str]:
+    """Cấp generation mới bằng os.mkdir (nguyên tử), an toàn khi nhiều worker cùng ghi."""
+    os.makedirs(_generations_dir(collection_id), exist_ok=True)
+    manifest = read_manifest(collection_id)
+    existing = list_generations(collection_id)
+    generation = max([manifest["generation"] if manifest else 0] + existing) + 1
+    while True:
+        directory = generation_dir(generation, collection_id)
+        try:
+            os.mkdir(directory)
+            return generation, directory
+        except FileExistsError:
+            generation += 1
+
+
+def file_checksum(paths: List[str], block_size: int = 1 << 20) -> str:
+    """SHA-256 của các file (nối theo thứ tự), đọc theo khối để không nạp cả file vào bộ nhớ."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def verify_checksum(manifest: Dict[str, Any]) -> bool:
+    """Kiểm tra file index của generation khớp checksum trong manifest (đọc lại toàn bộ file)."""
+    expected = manifest.get("checksum")
+    if not expected:
+        return True
+    return file_checksum(index_files(manifest["directory"], int(manifest.get("num_shards", 1)))) == expected
+
+
+def verify_manifest_files(manifest: Dict[str, Any]) -> bool:
+    """Kiểm tra nhanh (chỉ stat) các file index mà manifest trỏ tới đều tồn tại."""
+    return all(
+        os.path.isfile(path) for path in index_files(manifest["directory"], int(manifest.get("num_shards", 1)))
+    )
+
+
+def read_manifest(collection_id: str = DEFAULT_COLLECTION) -> Optional[Dict[str, Any]]:
+    """Đọc manifest hiện tại; None nếu chưa có hoặc file hỏng."""
+    manifest_path = _manifest_path(collection_id)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest.get("generation"), int) else None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read index manifest: {e}")
+        return None
+
+
+def manifest_signature(collection_id: str = DEFAULT_COLLECTION) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime_ns, size) của manifest: đủ để phát hiện thay đổi chỉ bằng một lần stat."""
+    try:
+        stat = os.stat(_manifest_path(collection_id))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+@contextmanager
+def _manifest_lock(collection_id: str) -> Iterator[None]:
+    """Khóa độc quyền giữa các process khi cập nhật manifest (nếu hệ điều hành hỗ trợ)."""
+    if fcntl is None:
+        yield
+        return
+    with open(_manifest_path(collection_id) + ".lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def publish_manifest(
+    generation: int,
+    directory: str,
+    num_vectors: int,
+    base_generation: Optional[int],
+    num_shards: int = 1,
+    shard_by: Optional[str] = None,
+    collection_id: str = DEFAULT_COLLECTION,
+    rollback_generation: Optional[int] = None
+) -> Dict[str, Any]:
+    """Ghi manifest trỏ tới generation đã ghi xong (tmp + os.replace).
+
+    Manifest luôn được ghi sau cùng nên worker đọc manifest chỉ thấy generation
+    hoàn chỉnh. Việc ghi là compare-and-swap dưới khóa: chỉ thành công khi manifest
+    vẫn trỏ tới base_generation (generation mà bản build dựa vào, None nếu chưa có
+    manifest); ngược lại ném GenerationConflictError để người gọi dựng lại trên
+    generation mới thay vì ghi đè thay đổi của worker khác.
+    rollback_generation là generation được ghim cho rollback, không bị dọn.
+    """
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "generation": generation,
+        "directory": directory,
+        "checksum": file_checksum(index_files(directory, num_shards)),
+        "num_vectors": num_vectors,
+        "num_shards": num_shards,
+        "shard_by": shard_by,
+        "rollback_generation": rollback_generation,
+        "written_at": time.time(),
+        "writer_pid": os.getpid(),
+    }
+    manifest_path = _manifest_path(collection_id)
+    with _manifest_lock(collection_id):
+        current = read_manifest(collection_id)
+        current_generation = current["generation"] if current is not None else None
+        if current_generation != base_generation:
+            raise GenerationConflictError(generation, base_generation, current_generation)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+    logger.info(f"Published index generation {generation} ({num_vectors} vectors)")
+    return manifest
+
+
+def collect_old_generations(keep: int, collection_id: str = DEFAULT_COLLECTION) -> List[int]:
+    """Xóa các generation cũ, giữ lại `keep` generation mới nhất, generation trong manifest
+    và generation được ghim cho rollback.
+
+    Worker còn map file của generation đã xóa vẫn đọc được (inode còn tới khi unmap)
+    và sẽ chuyển sang generation mới ở lần poll kế tiếp. Generation mới hơn manifest
+    có thể đang được worker khác ghi nên không bao giờ bị xóa; generation cũ hơn
+    manifest mà chưa publish chỉ có thể là bản build sẽ thua compare-and-swap.
+    """
+    manifest = read_manifest(collection_id)
+    if manifest is None:
+        return []
+    pinned = {manifest["generation"], manifest.get("rollback_generation")}
+    generations = list_generations(collection_id)
+    removed = []
+    for generation in generations[:max(0, len(generations) - max(1, keep))]:
+        if generation in pinned or generation > manifest["generation"]:
+            continue
+        try:
+            shutil.rmtree(generation_dir(generation, collection_id))
+            removed.append(generation)
+        except OSError as e:
+            logger.warning(f"Could not remove index generation {generation}: {e}")
+    if removed:
+        logger.info(f"Removed old index generations: {removed}")
+    return removed
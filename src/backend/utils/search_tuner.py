@@ -0,0 +1,146 @@
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from utils.faiss_utils import count_deleted_vectors, exclude_deleted, get_search_param_name, make_search_parameters, unwrap_index
+from utils.sharded_index import index_shards
+
+logger = logging.getLogger(__name__)
+
+EF_SEARCH_CANDIDATES = [16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512]
+NPROBE_CANDIDATES = [1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96, 128, 256]
+
+
+def get_search_param_candidates(index: Any) -> List[int]:
+    """Các giá trị tham số sẽ được thử, tăng dần theo chi phí."""
+    name = get_search_param_name(index)
+    if name == "efSearch":
+        return list(EF_SEARCH_CANDIDATES)
+    if name == "nprobe":
+        nlist = min(
+            unwrap_index(shard).nlist for shard in index_shards(index) if get_search_param_name(shard) == name
+        )
+        return [value for value in NPROBE_CANDIDATES if value <= nlist] or [nlist]
+    return []
+
+
+def apply_search_params(index: Any, search_params: Optional[Dict[str, Any]]) -> bool:
+    """Áp dụng tham số search đã tinh chỉnh (lưu trong metadata) lên index (mọi shard cùng loại)."""
+    if not search_params:
+        return False
+    name = get_search_param_name(index)
+    if name is None or name not in search_params:
+        return False
+    value = int(search_params[name])
+    for shard in index_shards(index):
+        if get_search_param_name(shard) != name:
+            continue
+        inner = unwrap_index(shard)
+        if name == "efSearch":
+            inner.hnsw.efSearch = value
+        else:
+            inner.nprobe = min(value, inner.nlist)
+    logger.info(f"Applied tuned search parameter {name}={value}")
+    return True
+
+
+def exact_knn(
+    queries: np.ndarray,
+    corpus_blocks: Iterable[Tuple[np.ndarray, np.ndarray]],
+    k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Tìm k láng giềng chính xác (L2) trên corpus được đọc theo từng khối (ids, vectors)."""
+    num_queries = queries.shape[0]
+    best_distances = np.full((num_queries, k), np.inf, dtype='float32')
+    best_ids = np.full((num_queries, k), -1, dtype='int64')
+
+    for block_ids, block_vectors in corpus_blocks:
+        if len(block_ids) == 0:
+            continue
+        block_k = min(k, len(block_ids))
+        distances, positions = faiss.knn(queries, np.ascontiguousarray(block_vectors, dtype='float32'), block_k)
+        ids = np.asarray(block_ids, dtype='int64')[positions]
+
+        merged_distances = np.hstack([best_distances, distances])
+        merged_ids = np.hstack([best_ids, ids])
+        order = np.argsort(merged_distances, axis=1, kind='stable')[:, :k]
+        best_distances = np.take_along_axis(merged_distances, order, axis=1)
+        best_ids = np.take_along_axis(merged_ids, order, axis=1)
+
+    return best_distances, best_ids
+
+
+def _drop_self(ids: np.ndarray, query_ids: np.ndarray, k: int) -> List[np.ndarray]:
+    """Bỏ chính chunk dùng làm query khỏi kết quả để đo như một query chưa thấy."""
+    return [row[(row != query_id) & (row >= 0)][:k] for row, query_id in zip(ids, query_ids)]
+
+
+def recall_at_k(approx_ids: List[np.ndarray], exact_ids: List[np.ndarray], k: int) -> float:
+    """Tỉ lệ trung bình láng giềng chính xác được tìm thấy trong top-k."""
+    recalls = []
+    for approx, exact in zip(approx_ids, exact_ids):
+        if len(exact) == 0:
+            continue
+        recalls.append(len(np.intersect1d(approx[:k], exact[:k])) / min(k, len(exact)))
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+def tune_search_params(
+    index: Any,
+    query_ids: np.ndarray,
+    query_vectors: np.ndarray,
+    exact_ids: np.ndarray,
+    k: int = 10,
+    target_recall: float = 0.95
+) -> Dict[str, Any]:
+    """Quét efSearch/nprobe, đo recall@k so với search chính xác và độ trễ.
+
+    Query là các chunk lấy mẫu từ corpus; chính chunk đó bị loại khỏi cả kết quả
+    lẫn ground truth. Chọn giá trị rẻ nhất đạt target_recall, nếu không giá trị
+    nào đạt thì chọn giá trị cho recall cao nhất.
+    """
+    name = get_search_param_name(index)
+    if name is None:
+        return {"tuned": False, "reason": "Index type has no tunable search parameter"}
+
+    query_vectors = np.ascontiguousarray(query_vectors, dtype='float32')
+    expected = _drop_self(exact_ids, query_ids, k)
+    search_k = min(k + 1, int(index.ntotal))
+    has_deleted = count_deleted_vectors(index) > 0
+
+    sweep = []
+    for value in get_search_param_candidates(index):
+        params = make_search_parameters(index, value)
+        if has_deleted:
+            params = exclude_deleted(index, params)
+        start = time.perf_counter()
+        _, ids = index.search(query_vectors, search_k, params=params)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        sweep.append({
+            name: value,
+            "recall": round(recall_at_k(_drop_self(ids, query_ids, k), expected, k), 4),
+            "latency_ms_per_query": round(elapsed_ms / max(1, len(query_vectors)), 4),
+        })
+        if sweep[-1]["recall"] >= target_recall:
+            break
+
+    meeting = [entry for entry in sweep if entry["recall"] >= target_recall]
+    chosen = meeting[0] if meeting else max(sweep, key=lambda entry: entry["recall"])
+    logger.info(f"Search parameter sweep for {name}: {sweep}, chosen {chosen}")
+
+    return {
+        "tuned": True,
+        "param": name,
+        name: chosen[name],
+        "recall": chosen["recall"],
+        "latency_ms_per_query": chosen["latency_ms_per_query"],
+        "target_recall": target_recall,
+        "target_met": bool(meeting),
+        "k": k,
+        "num_queries": int(len(query_vectors)),
+        "sweep": sweep,
+        "tuned_at": time.time(),
+    }
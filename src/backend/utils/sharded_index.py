@@ -0,0 +1,179 @@
+import time
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SHARD_BY_FILE = "file"
+SHARD_BY_HASH = "hash"
+
+_search_pool: Optional[ThreadPoolExecutor] = None
+_search_pool_lock = threading.Lock()
+
+
+def _get_search_pool(max_workers: int) -> ThreadPoolExecutor:
+    """Thread pool dùng chung cho fan-out search (FAISS nhả GIL khi search)."""
+    global _search_pool
+    if _search_pool is None:
+        with _search_pool_lock:
+            if _search_pool is None:
+                _search_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="faiss-shard")
+    return _search_pool
+
+
+def assign_shards(keys: Sequence[int], num_shards: int) -> np.ndarray:
+    """Shard của từng khóa (file id hoặc chunk id)."""
+    return np.mod(np.asarray(keys, dtype='int64'), num_shards)
+
+
+def index_shards(index: Any) -> List[Any]:
+    """Danh sách index con: các shard nếu là ShardedIndex, ngược lại chính index đó."""
+    return index.shards if isinstance(index, ShardedIndex) else [index]
+
+
+def merge_results(results: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Gộp top-k của các shard bằng heap merge (mỗi dòng kết quả shard đã sắp xếp tăng dần)."""
+    num_queries = results[0][0].shape[0]
+    distances = np.full((num_queries, k), np.inf, dtype='float32')
+    ids = np.full((num_queries, k), -1, dtype='int64')
+    for row in range(num_queries):
+        shard_rows = [
+            [(float(distance), int(chunk_id)) for distance, chunk_id in zip(shard_distances[row], shard_ids[row]) if chunk_id >= 0]
+            for shard_distances, shard_ids in results
+        ]
+        for position, (distance, chunk_id) in enumerate(islice(heapq.merge(*shard_rows), k)):
+            distances[row, position] = distance
+            ids[row, position] = chunk_id
+    return distances, ids
+
+
+class ShardStats:
+    """Số lần search và độ trễ của một shard."""
+
+    def __init__(self) -> None:
+        self.searches = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float) -> None:
+        """Ghi nhận một lần search."""
+        self.searches += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Thống kê dạng dict cho /rag/index-stats."""
+        return {
+            "searches": self.searches,
+            "avg_latency_ms": round(self.total_ms / self.searches, 3) if self.searches else 0.0,
+            "max_latency_ms": round(self.max_ms, 3),
+        }
+
+
+class ShardedIndex:
+    """Nhiều FAISS index (shard) với cùng interface search/add_with_ids như một index.
+
+    Chunk được chia theo file id (mọi chunk của một file nằm cùng shard) hoặc theo
+    chunk id. Search chạy song song trên các shard rồi gộp top-k bằng heap; mỗi
+    shard có thể được rebuild độc lập qua replace_shard.
+    """
+
+    def __init__(self, shards: List[Any], shard_by: str = SHARD_BY_FILE, search_threads: int = 0) -> None:
+        self.shards = list(shards)
+        self.shard_by = shard_by
+        self.search_threads = search_threads or len(self.shards)
+        self.stats = [ShardStats() for _ in self.shards]
+        self._shard_ids: List[Optional[np.ndarray]] = [None] * len(self.shards)
+
+    @property
+    def num_shards(self) -> int:
+        """Số shard."""
+        return len(self.shards)
+
+    @property
+    def ntotal(self) -> int:
+        """Tổng số vector trên mọi shard."""
+        return sum(int(shard.ntotal) for shard in self.shards)
+
+    @property
+    def d(self) -> int:
+        """Số chiều vector."""
+        return self.shards[0].d
+
+    @property
+    def is_trained(self) -> bool:
+        """Mọi shard đã được train."""
+        return all(getattr(shard, 'is_trained', True) for shard in self.shards)
+
+    def shard_for(self, chunk_ids: Sequence[int], file_ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Shard của từng chunk theo cách chia đã cấu hình."""
+        keys = file_ids if self.shard_by == SHARD_BY_FILE and file_ids is not None else chunk_ids
+        return assign_shards(keys, self.num_shards)
+
+    def shard_ids(self, shard_id: int) -> np.ndarray:
+        """Chunk id (đã sắp xếp, bỏ qua vector đã xóa mềm) trong một shard, cache tới khi shard thay đổi."""
+        if self._shard_ids[shard_id] is None:
+            shard = self.shards[shard_id]
+            ids = faiss.vector_to_array(shard.id_map) if hasattr(shard, 'id_map') else np.arange(shard.ntotal)
+            ids = ids.astype('int64')
+            self._shard_ids[shard_id] = np.sort(ids[ids >= 0])
+        return self._shard_ids[shard_id]
+
+    def set_shard(self, shard_id: int, shard: Any) -> None:
+        """Thay shard tại chỗ (chỉ dùng trên bản sao chưa publish)."""
+        self.shards[shard_id] = shard
+        self.stats[shard_id] = ShardStats()
+        self._shard_ids[shard_id] = None
+
+    def replace_shard(self, shard_id: int, shard: Any) -> "ShardedIndex":
+        """ShardedIndex mới dùng chung các shard khác, chỉ thay một shard."""
+        replaced = ShardedIndex(self.shards, self.shard_by, self.search_threads)
+        replaced.stats = list(self.stats)
+        replaced._shard_ids = list(self._shard_ids)
+        replaced.set_shard(shard_id, shard)
+        return replaced
+
+    def add_with_ids(self, x: np.ndarray, ids: np.ndarray, file_ids: Optional[Sequence[int]] = None) -> None:
+        """Thêm vector vào shard tương ứng của từng chunk."""
+        ids = np.asarray(ids, dtype='int64')
+        targets = self.shard_for(ids, file_ids)
+        for shard_id in np.unique(targets):
+            mask = targets == shard_id
+            self.shards[shard_id].add_with_ids(np.ascontiguousarray(x[mask]), ids[mask])
+            self._shard_ids[shard_id] = None
+
+    def map_shards(self, fn: Callable[[int, Any], Any]) -> List[Any]:
+        """Chạy fn(shard_id, shard) song song trên mọi shard, ghi lại độ trễ từng shard."""
+        def run(shard_id: int) -> Any:
+            start = time.perf_counter()
+            try:
+                return fn(shard_id, self.shards[shard_id])
+            finally:
+                self.stats[shard_id].record((time.perf_counter() - start) * 1000)
+
+        pool = _get_search_pool(self.search_threads)
+        return list(pool.map(run, range(self.num_shards)))
+
+    def search(self, x: np.ndarray, k: int, params: Optional[Any] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Search trên mọi shard rồi gộp top-k; params là một SearchParameters hoặc danh sách theo shard."""
+        def search_shard(shard_id: int, shard: Any) -> Tuple[np.ndarray, np.ndarray]:
+            shard_params = params[shard_id] if isinstance(params, list) else params
+            if shard.ntotal == 0:
+                return np.empty((x.shape[0], 0), dtype='float32'), np.empty((x.shape[0], 0), dtype='int64')
+            return shard.search(x, min(k, int(shard.ntotal)), params=shard_params)
+
+        return merge_results(self.map_shards(search_shard), k)
+
+    def describe_shards(self) -> List[Dict[str, Any]]:
+        """Kích thước và độ trễ của từng shard."""
+        return [
+            {"shard": shard_id, "num_vectors": int(shard.ntotal), **self.stats[shard_id].to_dict()}
+            for shard_id, shard in enumerate(self.shards)
+        ]
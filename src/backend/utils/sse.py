@@ -0,0 +1,48 @@
+import json
+import time
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Định dạng một sự kiện Server-Sent Events với dữ liệu JSON."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def sse_events(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Chuyển luồng văn bản thành các sự kiện SSE: token, rồi done (kèm thời gian tới token đầu) hoặc error."""
+    start = time.perf_counter()
+    first_token_ms = None
+    num_chunks = 0
+    try:
+        async for text in chunks:
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - start) * 1000
+            num_chunks += 1
+            yield format_sse({"text": text}, event="token")
+    except Exception as e:
+        logger.error(f"Error while streaming response: {str(e)}")
+        yield format_sse({"error": str(e)}, event="error")
+        return
+
+    total_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"Streamed {num_chunks} chunks, first token after {first_token_ms or 0:.1f}ms, total {total_ms:.1f}ms")
+    yield format_sse({
+        "chunks": num_chunks,
+        "first_token_ms": round(first_token_ms, 3) if first_token_ms is not None else None,
+        "total_ms": round(total_ms, 3),
+    }, event="done")
+
+
+def sse_response(chunks: AsyncIterator[str]) -> StreamingResponse:
+    """Tạo StreamingResponse dạng text/event-stream, tắt buffering của proxy."""
+    return StreamingResponse(
+        sse_events(chunks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,368 @@
+import json
+import time
+import inspect
+import random
+import logging
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config.app_config import AppConfig
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry import context as otel_context
+    from opentelemetry.propagate import extract as otel_extract, inject as otel_inject
+except ImportError:
+    otel_trace = None
+
+config = AppConfig()
+
+logger = logging.getLogger(__name__)
+
+EXPORTER_NONE = "none"
+EXPORTER_LOG = "log"
+EXPORTER_MEMORY = "memory"
+EXPORTER_OTEL = "otel"
+
+TRACEPARENT_HEADER = "traceparent"
+
+
+class Span:
+    """Một span theo mô hình OpenTelemetry: trace id, span id, span cha, thời gian và thuộc tính."""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.events: List[Dict[str, Any]] = []
+        self.status = "ok"
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Gắn thuộc tính cho span."""
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        """Ghi một mốc thời gian trong span (ví dụ token đầu tiên của stream)."""
+        self.events.append({
+            "name": name,
+            "offset_ms": round((time.perf_counter() - self._start) * 1000, 3),
+            **attributes,
+        })
+
+    def record_exception(self, error: BaseException) -> None:
+        """Đánh dấu span lỗi kèm loại và thông điệp lỗi."""
+        self.status = "error"
+        self.attributes["error.type"] = type(error).__name__
+        self.attributes["error.message"] = str(error)
+
+    def end(self) -> None:
+        """Kết thúc span và ghi thời lượng."""
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._start) * 1000
+
+    @property
+    def traceparent(self) -> str:
+        """Header W3C traceparent trỏ tới span này."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Dạng dict cho log và API."""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": self.events,
+        }
+
+
+class _OtelSpan:
+    """Bọc span của OpenTelemetry SDK để dùng cùng giao diện với Span."""
+
+    def __init__(self, span: Any) -> None:
+        self._span = span
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if isinstance(value, (str, bool, int, float)):
+            self._span.set_attribute(key, value)
+        else:
+            self._span.set_attribute(key, json.dumps(value, default=str))
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self._span.add_event(name, attributes)
+
+    def record_exception(self, error: BaseException) -> None:
+        self._span.record_exception(error)
+        self._span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, str(error)))
+
+
+class _NoopSpan:
+    """Span rỗng khi tracing tắt."""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        pass
+
+    def record_exception(self, error: BaseException) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class InMemorySpanExporter:
+    """Giữ các span đã kết thúc trong bộ nhớ (giới hạn số lượng), dùng cho test và /system/traces."""
+
+    def __init__(self, max_spans: int = 5000) -> None:
+        self._spans: "deque[Span]" = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def get_finished_spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        """Các span đã kết thúc, theo thứ tự kết thúc; lọc theo trace nếu có trace_id."""
+        with self._lock:
+            spans = list(self._spans)
+        return [span for span in spans if trace_id is None or span.trace_id == trace_id]
+
+    def recent_traces(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Các trace gần nhất, mỗi trace gồm span gốc và toàn bộ span con."""
+        traces: Dict[str, List[Span]] = {}
+        for span in self.get_finished_spans():
+            traces.setdefault(span.trace_id, []).append(span)
+        result = []
+        for trace_id in list(traces)[-limit:][::-1]:
+            spans = sorted(traces[trace_id], key=lambda span: span.start_time)
+            span_ids = {span.span_id for span in spans}
+            roots = [span for span in spans if span.parent_id not in span_ids]
+            result.append({
+                "trace_id": trace_id,
+                "root": roots[0].name if roots else None,
+                "duration_ms": round(max(span.duration_ms or 0.0 for span in roots), 3) if roots else None,
+                "spans": [span.to_dict() for span in spans],
+            })
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+
+
+class LoggingSpanExporter:
+    """Ghi mỗi span đã kết thúc thành một dòng log."""
+
+    def export(self, span: Span) -> None:
+        logger.info(
+            f"span {span.name} {span.duration_ms:.1f}ms trace={span.trace_id} "
+            f"span={span.span_id} parent={span.parent_id} {json.dumps(span.attributes, default=str)}"
+        )
+
+
+class Tracer:
+    """Tracer nhẹ tương thích W3C trace context; span hiện tại nằm trong contextvar.
+
+    Với exporter "otel" (cần gói opentelemetry), span được tạo bằng OpenTelemetry API
+    nên SDK và exporter (OTLP, Jaeger...) cấu hình theo cách chuẩn của OpenTelemetry.
+    """
+
+    def __init__(self, exporter_name: str = EXPORTER_NONE, max_spans: int = 5000) -> None:
+        self._current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+        self._remote_parent: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar(
+            "remote_parent", default=None
+        )
+        self.exporter: Optional[Any] = None
+        self.use_otel = False
+        self.configure(exporter_name, max_spans)
+
+    def configure(self, exporter_name: str, max_spans: int = 5000) -> None:
+        """Chọn exporter: none, log, memory hoặc otel."""
+        self.use_otel = False
+        if exporter_name == EXPORTER_OTEL:
+            if otel_trace is None:
+                logger.error("opentelemetry is not installed, falling back to the log span exporter")
+                exporter_name = EXPORTER_LOG
+            else:
+                self.use_otel = True
+        self.exporter_name = exporter_name
+        if exporter_name == EXPORTER_MEMORY:
+            self.exporter = InMemorySpanExporter(max_spans)
+        elif exporter_name == EXPORTER_LOG:
+            self.exporter = LoggingSpanExporter()
+        else:
+            self.exporter = None
+
+    def set_exporter(self, exporter: Optional[Any]) -> None:
+        """Dùng exporter tùy chỉnh (đối tượng có phương thức export(span))."""
+        self.use_otel = False
+        self.exporter = exporter
+        self.exporter_name = type(exporter).__name__ if exporter is not None else EXPORTER_NONE
+
+    @property
+    def enabled(self) -> bool:
+        return self.use_otel or self.exporter is not None
+
+    def current_span(self) -> Optional[Span]:
+        """Span đang hoạt động trong context hiện tại."""
+        return self._current.get()
+
+    @contextmanager
+    def start_span(self, name: str, **attributes: Any) -> Iterator[Any]:
+        """Mở span con của span hiện tại (hoặc của trace context nhận từ request)."""
+        if not self.enabled:
+            yield _NOOP_SPAN
+            return
+        if self.use_otel:
+            with otel_trace.get_tracer(__name__).start_as_current_span(name, record_exception=False) as otel_span:
+                span = _OtelSpan(otel_span)
+                for key, value in attributes.items():
+                    span.set_attribute(key, value)
+                try:
+                    yield span
+                except BaseException as e:
+                    span.record_exception(e)
+                    raise
+            return
+
+        parent = self._current.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            remote = self._remote_parent.get()
+            trace_id, parent_id = remote if remote else (f"{random.getrandbits(128):032x}", None)
+        span = Span(name, trace_id, parent_id, attributes)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            self._current.reset(token)
+            span.end()
+            try:
+                self.exporter.export(span)
+            except Exception as e:
+                logger.warning(f"Span exporter failed: {e}")
+
+    @contextmanager
+    def remote_context(self, headers: Dict[str, str]) -> Iterator[None]:
+        """Dùng trace context từ header (traceparent) làm cha cho các span mở bên trong."""
+        if self.use_otel:
+            token = otel_context.attach(otel_extract(headers))
+            try:
+                yield
+            finally:
+                otel_context.detach(token)
+            return
+        token = self._remote_parent.set(parse_traceparent(headers.get(TRACEPARENT_HEADER)))
+        try:
+            yield
+        finally:
+            self._remote_parent.reset(token)
+
+    def current_traceparent(self) -> Optional[str]:
+        """Header traceparent của span hiện tại để truyền sang service khác."""
+        if self.use_otel:
+            carrier: Dict[str, str] = {}
+            otel_inject(carrier)
+            return carrier.get(TRACEPARENT_HEADER)
+        span = self._current.get()
+        return span.traceparent if span is not None else None
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple]:
+    """Đọc header W3C traceparent thành (trace_id, parent span id), None nếu không hợp lệ."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2]
+
+
+tracer = Tracer(config.TRACING_EXPORTER, config.TRACING_MEMORY_MAX_SPANS)
+
+
+def span(name: str, **attributes: Any):
+    """Context manager mở span trên tracer dùng chung."""
+    return tracer.start_span(name, **attributes)
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator bọc hàm (sync hoặc async) trong một span."""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        span_name = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with tracer.start_span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with tracer.start_span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceContextMiddleware:
+    """ASGI middleware: mở span cho mỗi HTTP request, nối vào traceparent của client nếu có.
+
+    Response có header traceparent của span request để client gửi tiếp cho các
+    request sau, nên các bước của một lượt chat (web, RAG, generate) nằm chung một trace.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        with tracer.remote_context(headers):
+            with tracer.start_span(f"HTTP {scope['method']} {scope['path']}", **{
+                "http.method": scope["method"],
+                "http.target": scope["path"],
+            }) as request_span:
+                traceparent = tracer.current_traceparent()
+
+                async def send_with_trace(message: Dict[str, Any]) -> None:
+                    if message["type"] == "http.response.start":
+                        request_span.set_attribute("http.status_code", message["status"])
+                        if traceparent:
+                            message.setdefault("headers", [])
+                            message["headers"] = list(message["headers"]) + [
+                                (TRACEPARENT_HEADER.encode("latin-1"), traceparent.encode("latin-1"))
+                            ]
+                    await send(message)
+
+                await self.app(scope, receive, send_with_trace)